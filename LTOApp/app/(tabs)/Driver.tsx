@@ -3,7 +3,9 @@ import { View, Text, ScrollView, Pressable, TouchableOpacity, ActivityIndicator,
 import BackgroundWrapper from '@/components/backgroundwrapper';
 import { MaterialIcons } from '@expo/vector-icons';
 import { useRouter } from 'expo-router';
+import { useLogout } from '@/hooks/useLogout';
 import AsyncStorage from '@react-native-async-storage/async-storage';
+import { authHeaders } from '@/hooks/authHeaders';
 
 export default function Driver() {
   const router = useRouter();
@@ -58,7 +60,7 @@ export default function Driver() {
         // Fetch license details
         const detailsRes = await fetch('http://127.0.0.1:8000/api/driver/details/', {
           method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
+          headers: await authHeaders({ 'Content-Type': 'application/json' }),
           body: JSON.stringify({ driver_user_id: parseInt(userId, 10) })
         });
         const detailsData = await detailsRes.json();
@@ -71,7 +73,7 @@ export default function Driver() {
         // Fetch penalties
         const penaltiesRes = await fetch('http://127.0.0.1:8000/api/driver/penalties/', {
           method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
+          headers: await authHeaders({ 'Content-Type': 'application/json' }),
           body: JSON.stringify({ driver_user_id: parseInt(userId, 10) })
         });
         const penaltiesData = await penaltiesRes.json();
@@ -106,9 +108,7 @@ export default function Driver() {
     daysLeft = diffDays > 0 ? ` (${diffDays} days left)` : ' (Expired)';
   }
 
-  const handleLogout = () => {
-    router.replace('/(tabs)');
-  };
+  const handleLogout = useLogout();
 
   // Loading and error UI
   if (loading) {
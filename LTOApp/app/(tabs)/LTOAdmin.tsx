@@ -1,8 +1,9 @@
 import React, { useState, useEffect } from 'react';
-import { Text, View, Pressable, ScrollView, Alert, ActivityIndicator } from 'react-native';
+import { Text, View, Pressable, ScrollView, Alert, ActivityIndicator, TextInput } from 'react-native';
 import BackgroundWrapper from '@/components/backgroundwrapper';
 import AsyncStorage from '@react-native-async-storage/async-storage';
-import { useRouter } from 'expo-router';
+import { useLogout } from '@/hooks/useLogout';
+import { authHeaders } from '@/hooks/authHeaders';
 
 type AdminDetails = {
   full_name: string;
@@ -32,6 +33,82 @@ type Payment = {
   status: string; // <-- add this!
 };
 
+type Snapshot = {
+  cursor: number;
+  auditLogs: AuditLog[];
+  drivers: DriverUser[];
+  payments: Payment[];
+};
+
+type ChangePage = {
+  success: boolean;
+  cursor: number;
+  has_more: boolean;
+  drivers: DriverUser[];
+  payments: Payment[];
+  audit_logs: (AuditLog & { lto_user: number | null })[];
+  deleted: { drivers?: number[]; payments?: number[]; audit_logs?: number[] };
+};
+
+const CHANGES_POLL_MS = 15000;
+
+// Replaces changed rows in place, adds new ones and drops deleted ones
+function mergeRows<T extends { id: number }>(rows: T[], changed: T[], deleted: number[] = [], prepend = false): T[] {
+  const byId = new Map(changed.map(row => [row.id, row]));
+  const gone = new Set(deleted);
+  const merged = rows
+    .filter(row => !gone.has(row.id))
+    .map(row => {
+      const updated = byId.get(row.id);
+      byId.delete(row.id);
+      return updated ?? row;
+    });
+  const added = [...byId.values()];
+  return prepend ? [...added, ...merged] : [...merged, ...added];
+}
+
+// Full load; the change feed cursor is taken first so nothing written meanwhile is missed
+async function loadSnapshot(uid: number, headers: Record<string, string>): Promise<Snapshot> {
+  const headRes = await fetch('http://127.0.0.1:8000/api/changes/', { headers });
+  const headData = await headRes.json();
+
+  const logsRes = await fetch('http://127.0.0.1:8000/api/lto_admin_audit_logs/', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json', ...headers },
+    body: JSON.stringify({ user_id: uid })
+  });
+  const logsData = await logsRes.json();
+  const driversRes = await fetch('http://127.0.0.1:8000/api/driver_users/', { headers });
+  const driversData = await driversRes.json();
+  const paymentsRes = await fetch('http://127.0.0.1:8000/api/payments/', { headers });
+  const paymentsData = await paymentsRes.json();
+
+  return {
+    cursor: headRes.ok && headData.success ? headData.cursor : 0,
+    auditLogs: logsData.logs ?? [],
+    drivers: driversData.drivers ?? [],
+    payments: paymentsData.payments ?? [],
+  };
+}
+
+// Applies every change since snapshot.cursor; null means the snapshot is too old to update
+async function pullChanges(snapshot: Snapshot, uid: number, headers: Record<string, string>): Promise<Snapshot | null> {
+  let next = snapshot;
+  for (;;) {
+    const res = await fetch(`http://127.0.0.1:8000/api/changes/?cursor=${next.cursor}`, { headers });
+    if (res.status === 410) return null;
+    const page: ChangePage = await res.json();
+    if (!res.ok || !page.success) return null;
+    next = {
+      cursor: page.cursor,
+      auditLogs: mergeRows(next.auditLogs, page.audit_logs.filter(log => log.lto_user === uid), page.deleted.audit_logs, true),
+      drivers: mergeRows(next.drivers, page.drivers, page.deleted.drivers),
+      payments: mergeRows(next.payments, page.payments, page.deleted.payments),
+    };
+    if (!page.has_more) return next;
+  }
+}
+
 export default function LTOAdmin() {
   const [tab, setTab] = useState<'audit' | 'payments' | 'drivers'>('audit');
   const [adminDetails, setAdminDetails] = useState<AdminDetails | null>(null);
@@ -42,30 +119,64 @@ export default function LTOAdmin() {
   const [userId, setUserId] = useState<number | null>(null);
   const [showCompleted, setShowCompleted] = useState(false);
   const [showVerified, setShowVerified] = useState(false);
-  const router = useRouter();
+  const [driverQuery, setDriverQuery] = useState('');
+  // ids of the drivers matching driverQuery, or null when not searching
+  const [driverMatches, setDriverMatches] = useState<Set<number> | null>(null);
 
   // Filter payments based on showCompleted state
   const filteredPayments = showCompleted
     ? payments.filter(p => p.status === 'completed')
     : payments.filter(p => p.status !== 'completed');
 
-  const filteredDrivers = showVerified
+  const filteredDrivers = (showVerified
     ? drivers.filter(d => d.status === 'Verified')
-    : drivers;
+    : drivers
+  ).filter(d => driverMatches === null || driverMatches.has(d.id));
+
+  // Search drivers on the server as the admin types
+  useEffect(() => {
+    const query = driverQuery.trim();
+    if (!query) {
+      setDriverMatches(null);
+      return;
+    }
+    let cancelled = false;
+    const timer = setTimeout(async () => {
+      try {
+        const res = await fetch(
+          `http://127.0.0.1:8000/api/search/?type=drivers&limit=100&q=${encodeURIComponent(query)}`,
+          { headers: await authHeaders() }
+        );
+        const data = await res.json();
+        if (!res.ok || !data.success) throw new Error(data.error || 'Search failed');
+        if (!cancelled) setDriverMatches(new Set(data.results.map((r: { id: number }) => r.id)));
+      } catch (err) {
+        console.error('Driver search error:', err);
+      }
+    }, 300);
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
+  }, [driverQuery]);
 
 
   useEffect(() => {
+    let cancelled = false;
+    let timer: ReturnType<typeof setInterval> | undefined;
+
     const fetchAll = async () => {
       setLoading(true);
       try {
         const uid = await AsyncStorage.getItem('user_id');
         if (!uid) throw new Error('No admin user_id found in storage');
         setUserId(Number(uid));
+        const headers = await authHeaders();
 
         // Fetch admin details
         const adminRes = await fetch('http://127.0.0.1:8000/api/lto_admin_details/', {
           method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
+          headers: { 'Content-Type': 'application/json', ...headers },
           body: JSON.stringify({ user_id: Number(uid) })
         });
         const adminData = await adminRes.json();
@@ -78,37 +189,52 @@ export default function LTOAdmin() {
           phone_number: adminData.phone_number,
         });
 
-        // Fetch audit logs
-        const logsRes = await fetch('http://127.0.0.1:8000/api/lto_admin_audit_logs/', {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({ user_id: Number(uid) })
-        });
-        const logsData = await logsRes.json();
-        setAuditLogs(logsData.logs ?? []);
-
-        // Fetch driver users
-        const driversRes = await fetch('http://127.0.0.1:8000/api/driver_users/');
-        const driversData = await driversRes.json();
-        setDrivers(driversData.drivers ?? []);
-
-        // Fetch payments
-        const paymentsRes = await fetch('http://127.0.0.1:8000/api/payments/');
-        const paymentsData = await paymentsRes.json();
-        setPayments(paymentsData.payments ?? []);
+        // Start from the copy saved last time and only pull what changed since
+        const snapshotKey = `admin_snapshot_${uid}`;
+        const saved = await AsyncStorage.getItem(snapshotKey);
+        let snapshot: Snapshot | null = saved ? JSON.parse(saved) : null;
+        if (snapshot) {
+          snapshot = await pullChanges(snapshot, Number(uid), headers);
+        }
+        if (!snapshot) {
+          snapshot = await loadSnapshot(Number(uid), headers);
+        }
+        if (cancelled) return;
+        applySnapshot(snapshot);
+        await AsyncStorage.setItem(snapshotKey, JSON.stringify(snapshot));
+
+        timer = setInterval(async () => {
+          const current: Snapshot | null = JSON.parse((await AsyncStorage.getItem(snapshotKey)) ?? 'null');
+          if (!current || cancelled) return;
+          const next = (await pullChanges(current, Number(uid), headers)) ?? (await loadSnapshot(Number(uid), headers));
+          if (cancelled || next.cursor === current.cursor) return;
+          applySnapshot(next);
+          await AsyncStorage.setItem(snapshotKey, JSON.stringify(next));
+        }, CHANGES_POLL_MS);
       } catch (e: any) {
         Alert.alert('Error', e.message ?? 'Failed to load admin dashboard.');
       }
       setLoading(false);
     };
+
+    const applySnapshot = (snapshot: Snapshot) => {
+      setAuditLogs(snapshot.auditLogs);
+      setDrivers(snapshot.drivers);
+      setPayments(snapshot.payments);
+    };
+
     fetchAll();
+    return () => {
+      cancelled = true;
+      if (timer) clearInterval(timer);
+    };
   }, []);
 
   const handleUpdatePaymentStatus = async (id: number, newStatus: string) => {
     try {
       const res = await fetch('http://127.0.0.1:8000/api/update_payment_status/', {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: await authHeaders({ 'Content-Type': 'application/json' }),
         body: JSON.stringify({ payment_id: id, status: 'completed', user_id: userId })
       });
       const data = await res.json();
@@ -130,7 +256,7 @@ export default function LTOAdmin() {
     try {
       const res = await fetch('http://127.0.0.1:8000/api/verify_driver_admin/', {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: await authHeaders({ 'Content-Type': 'application/json' }),
         body: JSON.stringify({ driver_user_id: id, user_id: userId })
       });
       const data = await res.json();
@@ -187,7 +313,7 @@ export default function LTOAdmin() {
         try {
         const res = await fetch('http://127.0.0.1:8000/api/update_license_expiry/', {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
+            headers: await authHeaders({ 'Content-Type': 'application/json' }),
             body: JSON.stringify({ driver_user_id: id, license_expiry: expiry, user_id: userId })
         });
         const data = await res.json();
@@ -205,9 +331,7 @@ export default function LTOAdmin() {
         }
     }
     };
-    const handleLogout = () => {
-      router.replace('/(tabs)');
-    };
+    const handleLogout = useLogout();
 
 
   return (
@@ -332,6 +456,12 @@ export default function LTOAdmin() {
           {tab === 'drivers' && (
             <View className="w-full px-4">
               <Text className="font-bold text-lg mb-2 text-center">Driver Users</Text>
+              <TextInput
+                className="border border-gray-300 rounded px-3 py-2 mb-2 bg-white"
+                placeholder="Search name, license, email or username"
+                value={driverQuery}
+                onChangeText={setDriverQuery}
+              />
 
               <ScrollView style={{ maxHeight: 300 }}>
                 <View className="border border-gray-300 rounded-md">
@@ -377,7 +507,7 @@ export default function LTOAdmin() {
                       ))}
                     {filteredDrivers.filter(d => showVerified ? d.status === 'Verified' : d.status !== 'Verified').length === 0 && (
                       <Text className="text-center text-gray-500 py-4 text-sm">
-                        {showVerified ? 'No verified users.' : 'No non-verified users.'}
+                        {driverMatches !== null ? 'No matching users.' : showVerified ? 'No verified users.' : 'No non-verified users.'}
                       </Text>
                     )}
                   </ScrollView>
@@ -1,9 +1,27 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { View, Text, ScrollView, Pressable, ActivityIndicator, Modal, TouchableWithoutFeedback, TextInput, Alert } from 'react-native';
 import BackgroundWrapper from '@/components/backgroundwrapper';
 import { useRouter } from 'expo-router';
+import { useLogout } from '@/hooks/useLogout';
 import AsyncStorage from '@react-native-async-storage/async-storage';
 import { Picker } from '@react-native-picker/picker';
+import { useIdempotencyKeys } from '@/hooks/useIdempotencyKeys';
+import { authHeaders } from '@/hooks/authHeaders';
+
+// Where the device is, for the hotspot map; tickets are sent without a position when it cannot tell
+const currentPosition = () =>
+  new Promise<{ latitude: number; longitude: number } | null>(resolve => {
+    const geolocation = (globalThis as any).navigator?.geolocation;
+    if (!geolocation) {
+      resolve(null);
+      return;
+    }
+    geolocation.getCurrentPosition(
+      (p: any) => resolve({ latitude: p.coords.latitude, longitude: p.coords.longitude }),
+      () => resolve(null),
+      { timeout: 5000, maximumAge: 60000 },
+    );
+  });
 
 export default function OfficerDashboard() {
   const router = useRouter();
@@ -41,6 +59,10 @@ export default function OfficerDashboard() {
   // Backend base URL
   const BACKEND_URL = "http://localhost:8000";
 
+  // Resubmitting an unchanged ticket sends the same body and key, so a retry never issues it twice
+  const idempotencyKeys = useIdempotencyKeys();
+  const lastTicket = useRef<{ fields: string; body: string } | null>(null);
+
   useEffect(() => {
     const fetchOfficerDetails = async () => {
       try {
@@ -52,7 +74,7 @@ export default function OfficerDashboard() {
         }
         const detailsRes = await fetch(`${BACKEND_URL}/api/officer/details/`, {
           method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
+          headers: await authHeaders({ 'Content-Type': 'application/json' }),
           credentials: 'include',
           body: JSON.stringify({ officer_user_id: parseInt(userId, 10) }),
         });
@@ -75,7 +97,7 @@ export default function OfficerDashboard() {
   useEffect(() => {
     const fetchNextViolationId = async () => {
       try {
-        const res = await fetch(`${BACKEND_URL}/api/violation/next-id/`);
+        const res = await fetch(`${BACKEND_URL}/api/violation/next-id/`, { headers: await authHeaders() });
         const data = await res.json();
         setNextViolationId(data.next_violation_id);
       } catch (e) {
@@ -89,7 +111,7 @@ export default function OfficerDashboard() {
     const fetchViolationTypes = async () => {
       setLoadingViolationTypes(true);
       try {
-        const res = await fetch(`${BACKEND_URL}/api/violation/types/`);
+        const res = await fetch(`${BACKEND_URL}/api/violation/types/`, { headers: await authHeaders() });
         if (!res.ok) throw new Error(`HTTP error! status: ${res.status}`);
         const data = await res.json();
         setViolationTypes(data.violation_types || []);
@@ -108,6 +130,11 @@ export default function OfficerDashboard() {
     setViolations(prev => {
       const arr = [...prev];
       arr[idx][name] = value;
+      if (name === 'violation_type') {
+        // The fee is set by the server's schedule; show the current one
+        const type = violationTypes.find(t => String(t.violation_type ?? t.id) === String(value));
+        arr[idx].fee_at_time = type ? type.violation_fee : '';
+      }
       return arr;
     });
   };
@@ -135,7 +162,7 @@ export default function OfficerDashboard() {
     try {
       const verifyRes = await fetch(`${BACKEND_URL}/api/driver/verify/`, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: await authHeaders({ 'Content-Type': 'application/json' }),
         body: JSON.stringify({ full_name: driverName, license_number: licenseNumber })
       });
       const verifyData = await verifyRes.json();
@@ -150,35 +177,50 @@ export default function OfficerDashboard() {
 
     // Register violation
     try {
+      const ticket = {
+        violation_id: nextViolationId,
+        driver_name: driverName,
+        license_number: licenseNumber,
+        address: address,
+        platenumber,
+        vehicle_type: vehicleType,
+        car_name: carName,
+        vehicle_color: vehicleColor,
+        notes,
+        violations,
+      };
+      const fields = JSON.stringify(ticket);
+      let sent = lastTicket.current;
+      if (!sent || sent.fields !== fields) {
+        // a resubmission keeps the first position too, or the server would see a different request
+        const position = await currentPosition();
+        sent = { fields, body: JSON.stringify({ ...ticket, ...(position ?? {}) }) };
+        lastTicket.current = sent;
+      }
       const res = await fetch(`${BACKEND_URL}/api/violation/register/`, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        credentials: 'include',
-        body: JSON.stringify({
-          violation_id: nextViolationId,
-          driver_name: driverName,
-          license_number: licenseNumber,
-          address: address,
-          platenumber,
-          vehicle_type: vehicleType,
-          car_name: carName,
-          vehicle_color: vehicleColor,
-          notes,
-          violations,
+        headers: await authHeaders({
+          'Content-Type': 'application/json',
+          'Idempotency-Key': idempotencyKeys.keyFor(fields),
         }),
+        credentials: 'include',
+        body: sent.body,
       });
       const data = await res.json();
       if (data.success) {
+        idempotencyKeys.forget(fields);
+        lastTicket.current = null;
         // After successful registration, go to ViolationDetails screen and pass all the details as params
         router.push({
           pathname: '/ViolationDetails',
           params: {
             violation_id: nextViolationId,
             penalties: JSON.stringify(
-              violations.map(v => ({
+              violations.map((v, idx) => ({
                 violation: v.violation_type,
                 officer: officerDetails.full_name,
-                fee: v.fee_at_time + " PHP",
+                // what the server charged, which may differ from the fee shown while filling in
+                fee: (data.fees?.[idx]?.fee_at_time ?? v.fee_at_time) + " PHP",
               }))
             ),
             driverName,
@@ -204,7 +246,7 @@ export default function OfficerDashboard() {
         setVehicleColor('');
         setNotes('');
         setViolations([{ violation_type: '', fee_at_time: '' }]);
-        const res2 = await fetch(`${BACKEND_URL}/api/violation/next-id/`);
+        const res2 = await fetch(`${BACKEND_URL}/api/violation/next-id/`, { headers: await authHeaders() });
         const newData = await res2.json();
         setNextViolationId(newData.next_violation_id);
       } else {
@@ -214,9 +256,7 @@ export default function OfficerDashboard() {
       Alert.alert('Network error', e.message);
     }
   };
-  const handleLogout = () => {
-    router.replace('/(tabs)');
-  };
+  const handleLogout = useLogout();
 
   if (loading) {
     return (
@@ -366,9 +406,8 @@ export default function OfficerDashboard() {
                 <TextInput
                   className="border border-gray-300 rounded px-3 py-2 mb-3 w-[200px] bg-white"
                   value={v.fee_at_time}
-                  onChangeText={val => handleViolationChange(idx, 'fee_at_time', val)}
+                  editable={false}
                   placeholder="Fee"
-                  keyboardType="numeric"
                 />
               </View>
             ))}
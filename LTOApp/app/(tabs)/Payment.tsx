@@ -4,6 +4,8 @@ import BackgroundWrapper from '@/components/backgroundwrapper';
 import { Picker } from '@react-native-picker/picker';
 import AsyncStorage from '@react-native-async-storage/async-storage';
 import { useLocalSearchParams, useRouter } from 'expo-router';
+import { useIdempotencyKeys } from '@/hooks/useIdempotencyKeys';
+import { authHeaders } from '@/hooks/authHeaders';
 
 export default function Payment() {
   const router = useRouter();
@@ -14,6 +16,8 @@ export default function Payment() {
   const [referenceId, setReferenceId] = useState('');
   const [submitting, setSubmitting] = useState(false);
   const [driverUserId, setDriverUserId] = useState(null);
+  // Paying again after a failure resends each unchanged payment with its first key, so none is recorded twice
+  const idempotencyKeys = useIdempotencyKeys();
 
   useEffect(() => {
     AsyncStorage.getItem('driver_user_id').then((val) => setDriverUserId(val));
@@ -27,14 +31,15 @@ export default function Payment() {
     }
   }, [params.selectedPenalties]);
 
-  // Calculates the grand total
+  // Calculates the grand total, in centavos so the sum is exact
   const getTotal = () => (
     penalties.reduce((sum, p) => {
+      if (p.fee_centavos != null) return sum + p.fee_centavos;
       const num = parseFloat(
         (p.fee_at_time || p.fee || '').toString().replace(/[^\d.]/g, '')
       );
-      return sum + (isNaN(num) ? 0 : num);
-    }, 0)
+      return sum + (isNaN(num) ? 0 : Math.round(num * 100));
+    }, 0) / 100
   );
 
   const handleSubmitPayment = async () => {
@@ -71,16 +76,17 @@ export default function Payment() {
         const amount = parseFloat(
           (penalty.fee_at_time || penalty.fee || '').toString().replace(/[^\d.]/g, '')
         );
+        const body = JSON.stringify({
+          violation_id,
+          driver_user_id: driverUserId,
+          payment_type: paymentMethod,
+          amount_paid: isNaN(amount) ? 0 : amount,
+          transaction_ref: referenceId,
+        });
         const response = await fetch('http://127.0.0.1:8000/api/payment/submit/', {
           method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({
-            violation_id,
-            driver_user_id: driverUserId,
-            payment_type: paymentMethod,
-            amount_paid: isNaN(amount) ? 0 : amount,
-            transaction_ref: referenceId,
-          }),
+          headers: await authHeaders({ 'Content-Type': 'application/json', 'Idempotency-Key': idempotencyKeys.keyFor(body) }),
+          body,
         });
         const data = await response.json();
         if (!data.success) {
@@ -144,7 +150,7 @@ export default function Payment() {
                   <Text className="flex-1 text-center text-gray-800">{row.violation_type || row.violation}</Text>
                   <Text className="flex-1 text-center text-gray-800">{row.officer}</Text>
                   <Text className="flex-1 text-center text-gray-800">
-                    {(row.fee_at_time || row.fee).toLocaleString(undefined, { minimumFractionDigits: 2 })} PHP
+                    {Number(row.fee_at_time || row.fee).toLocaleString(undefined, { minimumFractionDigits: 2 })} PHP
                   </Text>
                 </View>
               ))}
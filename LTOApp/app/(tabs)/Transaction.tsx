@@ -3,6 +3,7 @@ import { View, Text, ScrollView, ActivityIndicator, Pressable } from 'react-nati
 import BackgroundWrapper from '@/components/backgroundwrapper';
 import AsyncStorage from '@react-native-async-storage/async-storage';
 import { useRouter } from 'expo-router';
+import { authHeaders } from '@/hooks/authHeaders';
 
 export default function Transaction() {
   const [loading, setLoading] = useState(true);
@@ -23,7 +24,7 @@ export default function Transaction() {
         }
         const res = await fetch('http://127.0.0.1:8000/api/driver/payments/', {
           method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
+          headers: await authHeaders({ 'Content-Type': 'application/json' }),
           body: JSON.stringify({ driver_user_id: parseInt(driver_user_id, 10) }),
         });
         const data = await res.json();
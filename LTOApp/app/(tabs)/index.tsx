@@ -35,9 +35,11 @@ export default function LoginScreen() {
       await AsyncStorage.removeItem('user_type');
       await AsyncStorage.removeItem('full_name');
       await AsyncStorage.removeItem('account_status');
+      await AsyncStorage.removeItem('token');
 
       if (res.ok && data.success) {
         await AsyncStorage.setItem('user_type', data.user_type);
+        if (data.token) await AsyncStorage.setItem('token', data.token);
 
         if (data.full_name) await AsyncStorage.setItem('full_name', data.full_name);
         if (data.account_status) await AsyncStorage.setItem('account_status', data.account_status);
@@ -0,0 +1,8 @@
+import AsyncStorage from '@react-native-async-storage/async-storage';
+
+// Headers for an API call as the logged-in user. Officer and admin endpoints
+// answer 401 without the token; driver endpoints use it to check the user id.
+export async function authHeaders(extra: Record<string, string> = {}): Promise<Record<string, string>> {
+  const token = await AsyncStorage.getItem('token');
+  return token ? { ...extra, Authorization: `Bearer ${token}` } : extra;
+}
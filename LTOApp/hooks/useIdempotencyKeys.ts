@@ -0,0 +1,34 @@
+import { useRef } from 'react';
+
+// A random version 4 UUID; crypto.randomUUID is not available on every React Native engine
+export function newIdempotencyKey(): string {
+  const randomUUID = (globalThis as any).crypto?.randomUUID;
+  if (randomUUID) {
+    return randomUUID.call((globalThis as any).crypto);
+  }
+  return 'xxxxxxxx-xxxx-4xxx-yxxx-xxxxxxxxxxxx'.replace(/[xy]/g, c => {
+    const r = (Math.random() * 16) | 0;
+    return (c === 'x' ? r : (r & 0x3) | 0x8).toString(16);
+  });
+}
+
+// One Idempotency-Key per request: sending the same request again (a retry after a
+// timeout or a dropped connection) reuses its key, so the server answers with the
+// first response instead of writing a second ticket or payment.
+export function useIdempotencyKeys() {
+  const keys = useRef(new Map<string, string>());
+  return {
+    keyFor(request: string) {
+      let key = keys.current.get(request);
+      if (!key) {
+        key = newIdempotencyKey();
+        keys.current.set(request, key);
+      }
+      return key;
+    },
+    // once the server has answered, a new submission must not replay the old answer
+    forget(request: string) {
+      keys.current.delete(request);
+    },
+  };
+}
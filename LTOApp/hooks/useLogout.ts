@@ -0,0 +1,25 @@
+import AsyncStorage from '@react-native-async-storage/async-storage';
+import { useRouter } from 'expo-router';
+
+const SESSION_KEYS = ['token', 'user_type', 'user_id', 'driver_user_id', 'full_name', 'account_status'];
+
+// Revokes the session's token on the server, so a copy of it stops working,
+// then forgets the session on this device and returns to the login screen.
+export function useLogout() {
+  const router = useRouter();
+  return async () => {
+    const token = await AsyncStorage.getItem('token');
+    if (token) {
+      try {
+        await fetch('http://127.0.0.1:8000/api/logout/', {
+          method: 'POST',
+          headers: { Authorization: `Bearer ${token}` },
+        });
+      } catch {
+        // offline: the token still expires on its own
+      }
+    }
+    await AsyncStorage.multiRemove(SESSION_KEYS);
+    router.replace('/(tabs)');
+  };
+}
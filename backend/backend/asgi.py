@@ -13,4 +13,11 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Long-lived event streams are served without Django's per-request thread
+# (see core/events.py); everything else goes to Django.
+from django.urls import reverse  # noqa: E402
+from core.events import StreamApp  # noqa: E402  (needs the app registry)
+
+application = StreamApp(django_application, reverse('event_stream'))
@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from corsheaders.defaults import default_headers
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -52,9 +55,25 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    
+    'core.routers.ReplicaRoutingMiddleware',
+    'core.ratelimit.RateLimitMiddleware',
+    # keep last so only the view is measured
+    'core.profiling.ProfilingMiddleware',
 ]
 
+# On-demand profiling of core views, see core/profiling.py.
+# SAMPLE_RATES maps URL names (or '*') to the fraction of requests profiled;
+# a request whose HEADER carries a valid admin token (the one universal_login
+# issues) is always profiled; set HEADER to None to turn that off.
+CORE_PROFILING = {
+    'ENABLED': False,
+    'MODE': 'sample',
+    'SAMPLE_RATES': {},
+    'HEADER': 'X-Profile-Token',
+    'OUTPUT_DIR': BASE_DIR / 'profiles',
+    'MAX_DIR_BYTES': 50 * 1024 * 1024,
+}
+
 
 
 ROOT_URLCONF = 'backend.urls'
@@ -91,9 +110,163 @@ DATABASES = {
     }
 }
 
+# Reuse connections instead of opening one per request: a psycopg 3 pool when
+# psycopg[pool] is installed, otherwise persistent per-thread connections.
+# Either way, connections are health-checked before reuse.
+DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+try:
+    import psycopg_pool  # noqa: F401
+except ImportError:
+    DATABASES['default']['CONN_MAX_AGE'] = 60
+else:
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': int(os.environ.get('LTO_DB_POOL_MIN', 2)),
+            'max_size': int(os.environ.get('LTO_DB_POOL_MAX', 10)),
+            'timeout': 10,
+        },
+    }
+
+# LTO_DB_REPLICA_HOST adds a read replica; see core.routers.PrimaryReplicaRouter
+if os.environ.get('LTO_DB_REPLICA_HOST'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': os.environ['LTO_DB_REPLICA_HOST'],
+        'PORT': os.environ.get('LTO_DB_REPLICA_PORT', DATABASES['default']['PORT']),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+# LTO_DB_BACKEND=sqlite runs against a local SQLite file instead (benchmarks,
+# local testing without Postgres). LTO_DB_REPLICA_PATH adds a second SQLite
+# file as the replica alias.
+if os.environ.get('LTO_DB_BACKEND') == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
+    }
+    if os.environ.get('LTO_DB_REPLICA_PATH'):
+        DATABASES['replica'] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ['LTO_DB_REPLICA_PATH'],
+            'TEST': {'MIRROR': 'default'},
+        }
+
+# LTO_DB_SHARDS moves the tickets and payments of some stations to databases
+# of their own (core/shards.py), e.g.
+#   LTO_DB_SHARDS="1:north=Quezon City,Baguio;2:south=Cebu City,Davao City"
+# The number before the colon is part of every id the shard hands out; never
+# renumber a shard. Each gets the alias shard_<name>: a SQLite file next to
+# db.sqlite3, or the database lto_shard_<name> on the Postgres server. Run
+# init_shards after adding one.
+CORE_SHARDS = {
+    'STRIDE': 100_000_000,
+    'SHARDS': {},
+}
+for _spec in filter(None, os.environ.get('LTO_DB_SHARDS', '').split(';')):
+    _number, _, _rest = _spec.partition(':')
+    _name, _, _stations = _rest.partition('=')
+    _alias = f'shard_{_name.strip()}'
+    CORE_SHARDS['SHARDS'][_alias] = {
+        'NUMBER': int(_number),
+        'STATIONS': [station.strip() for station in _stations.split(',') if station.strip()],
+    }
+    if DATABASES['default']['ENGINE'].endswith('sqlite3'):
+        DATABASES[_alias] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / f'db_{_alias}.sqlite3'}
+    else:
+        DATABASES[_alias] = {**DATABASES['default'], 'NAME': f'lto_{_alias}'}
+
+DATABASE_ROUTERS = ['core.routers.StationShardRouter', 'core.routers.PrimaryReplicaRouter']
+
+# Read-only views served from the replica, and how long a client stays on the
+# primary after it writes (read-your-writes).
+CORE_REPLICA_VIEWS = ['driver_users', 'payments', 'driver_penalties', 'lto_admin_audit_logs', 'change_feed', 'violation_hotspots', 'search']
+CORE_REPLICA_PIN_SECONDS = 10
+
+# Change feed for the admin console (core/changefeed.py). prune_change_log
+# removes entries older than RETENTION_DAYS.
+CORE_CHANGE_FEED = {
+    'PAGE_SIZE': 500,
+    'MAX_PAGE_SIZE': 2000,
+    'RETENTION_DAYS': 30,
+}
+
+# Fee schedules (core/fees.py) are cached per process and reloaded every
+# RELOAD seconds; schedule fee changes at least that far ahead.
+CORE_FEES = {
+    'RELOAD': 60,
+}
+
+# Violation hotspots (core/hotspots.py): TOP cells by default, at most
+# MAX_CELLS per response and MAX_DAYS per query.
+CORE_HOTSPOTS = {
+    'TOP': 20,
+    'MAX_CELLS': 2000,
+    'MAX_DAYS': 366,
+}
+
+# Payment review queue (core/review.py). A claim leases up to BATCH payments
+# (MAX_BATCH when the admin asks for more) for LEASE seconds.
+CORE_REVIEW_QUEUE = {
+    'LEASE': 300,
+    'BATCH': 10,
+    'MAX_BATCH': 50,
+}
+
+# Full-text search (core/search.py): PAGE_SIZE results per page, at most
+# MAX_PAGE_SIZE, and no pages starting past MAX_OFFSET results.
+CORE_SEARCH = {
+    'PAGE_SIZE': 20,
+    'MAX_PAGE_SIZE': 100,
+    'MAX_OFFSET': 1000,
+}
+
+# Profile cache for the *_details endpoints (core/profiles.py). 'memory' keeps
+# an LRU per worker, so another worker may serve a changed profile for up to
+# TTL seconds; 'cache' uses the Django cache CACHE, shared by all workers.
+CORE_PROFILE_CACHE = {
+    'BACKEND': 'memory',
+    'MAXSIZE': 10000,
+    'TTL': 300,
+}
+
+# Monthly station reports (core/reports.py). Finished months are written once
+# per format under DIR; a late change to a month writes a new file and deletes
+# the one it replaces. Any file can be deleted at will.
+# WORKERS is the default process pool size of build_station_reports.
+CORE_REPORTS = {
+    'DIR': BASE_DIR / 'reports',
+    'WORKERS': 4,
+}
+
+# Server-sent events (core/events.py). Serve events/ through backend.asgi so an
+# idle stream costs a coroutine, not a worker thread; under WSGI (backend.wsgi,
+# and runserver) events/ answers 501. 'postgres' fans events out to every
+# worker with LISTEN/NOTIFY; 'local' only reaches streams in the process that
+# published.
+CORE_EVENTS = {
+    'BACKEND': 'local' if DATABASES['default']['ENGINE'].endswith('sqlite3') else 'postgres',
+    'QUEUE_SIZE': 100,
+    'HEARTBEAT': 15,
+    'MAX_SUBSCRIBERS': 1000,
+}
+
+# Database job queue (core/jobs.py), worked by `manage.py run_jobs`. LEASE is
+# how long a claimed job may run before another worker takes it back.
+CORE_JOBS = {
+    'BATCH': 10,
+    'POLL_INTERVAL': 1.0,
+    'LEASE': 300,
+    'BACKOFF': 5,
+    'MAX_BACKOFF': 3600,
+}
+
 
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_CREDENTIALS = True
+# the app sends Idempotency-Key with tickets and payments (core/idempotency.py)
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
 
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:8081",
@@ -116,6 +289,85 @@ CSRF_TRUSTED_ORIGINS = [
 SESSION_COOKIE_SAMESITE = None
 SESSION_COOKIE_SECURE = False
 
+# API tokens (see core/tokens.py). Officer and admin endpoints always require
+# one. Until every driver app sends its token, CORE_REQUIRE_TOKENS stays off
+# and driver endpoints still accept anonymous callers.
+CORE_TOKEN_MAX_AGE = 12 * 60 * 60
+# seconds a process trusts its cached token versions; a logout or password
+# change in another process rejects old tokens here within this window
+CORE_TOKEN_VERSION_TTL = 30
+CORE_REQUIRE_TOKENS = False
+
+# Password hashing pool and login throttle (see core/credentials.py)
+CORE_CREDENTIALS = {
+    'WORKERS': 4,              # hashes running at once
+    'QUEUE': 32,               # hashes allowed to wait; beyond that logins get 503
+    'TIMEOUT': 10,
+    'USERNAME_FAILURES': 5,    # failed logins per username from one client IP per WINDOW
+    'IP_FAILURES': 30,         # failed logins per client IP per WINDOW
+    'WINDOW': 15 * 60,
+}
+
+# Rate limits per URL name and per-process admission control (see core/ratelimit.py).
+# 'file' shares buckets between worker processes on one host.
+CORE_RATE_LIMIT_BACKEND = 'memory'
+CORE_RATE_LIMIT_FILE = BASE_DIR / 'ratelimit.buckets'
+CORE_RATE_LIMITS = {
+    'universal_login': {'rate': 0.5, 'burst': 10, 'keys': ['ip']},
+    'register_driver': {'rate': 0.1, 'burst': 5, 'keys': ['ip']},
+    'submit_payment': {'rate': 0.2, 'burst': 5, 'keys': ['user', 'ip']},
+    'register_violation': {'rate': 1, 'burst': 20, 'keys': ['user', 'ip']},
+    'update_payment_status': {'rate': 2, 'burst': 20, 'keys': ['user', 'ip']},
+}
+CORE_ADMISSION = {
+    # at or below the database pool max_size
+    'MAX_INFLIGHT': 10,
+    # how long a request may wait for a slot before getting 503
+    'WAIT': 0.05,
+}
+
+# Logging
+# core loggers write JSON lines through a background queue (see core/log.py).
+# CORE_LOG_SAMPLING maps logger names to the fraction of DEBUG/INFO records kept.
+
+CORE_LOG_LEVEL = 'INFO'
+CORE_LOG_SAMPLING = {
+    'core.views': 1.0,
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'sample': {
+            '()': 'core.log.SampleFilter',
+            'rates': CORE_LOG_SAMPLING,
+        },
+        'redact': {
+            '()': 'core.log.RedactFilter',
+        },
+    },
+    'formatters': {
+        'json': {
+            '()': 'core.log.JSONFormatter',
+        },
+    },
+    'handlers': {
+        'core_queue': {
+            'class': 'core.log.BackgroundQueueHandler',
+            'filters': ['sample', 'redact'],
+            'formatter': 'json',
+        },
+    },
+    'loggers': {
+        'core': {
+            'handlers': ['core_queue'],
+            'level': CORE_LOG_LEVEL,
+            'propagate': False,
+        },
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
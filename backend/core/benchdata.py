@@ -0,0 +1,369 @@
+"""
+Throwaway benchmark database with synthetic data.
+
+Every core model except the Django-owned ones is ``managed = False``, so a
+test database created by Django has none of our tables. ``setup_database``
+creates the test database, builds the unmanaged tables from the models and
+``seed`` fills them with deterministic synthetic rows. The index packs from
+``core.schema`` are applied on top, as the migrations would on a real database.
+
+With station shards configured (core.shards), the home database's test
+database comes with one per shard, holding only the ticket tables, and the
+seeded tickets and payments are spread over them by the officer's station.
+"""
+
+import os
+import random
+import tempfile
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+
+from django.core.management.color import no_style
+from django.db import connections
+
+from . import changefeed, hotspots, schema, search, shards
+from .models import (
+    AuditLog, ChangeLogEntry, DriverUser, LawOfficer, LtoAdminUser, Payment, Violation, ViolationDetail, ViolationType,
+    ViolationTypeFee,
+)
+
+STATIONS = ['Quezon City', 'Manila', 'Makati', 'Pasig', 'Taguig', 'Cebu City', 'Davao City', 'Baguio']
+CITY_CENTERS = {
+    'Quezon City': (14.676, 121.044), 'Manila': (14.599, 120.984), 'Makati': (14.555, 121.024),
+    'Pasig': (14.576, 121.085), 'Taguig': (14.518, 121.051), 'Cebu City': (10.316, 123.891),
+    'Davao City': (7.190, 125.455), 'Baguio': (16.402, 120.596),
+}
+LOCATIONS = ['EDSA', 'Commonwealth Ave', 'Taft Ave', 'Roxas Blvd', 'C-5 Road', 'Ortigas Ave', 'Aurora Blvd', 'Katipunan Ave']
+VIOLATION_NAMES = [
+    'Reckless driving', 'Driving without license', 'Expired registration', 'No helmet', 'Illegal parking',
+    'Overspeeding', 'Beating the red light', 'Obstruction', 'Disregarding traffic signs', 'Overloading',
+    'Smoke belching', 'Unregistered vehicle', 'No seatbelt', 'Using phone while driving', 'Counterflow',
+]
+VEHICLES = [('Sedan', 'Toyota Vios'), ('SUV', 'Mitsubishi Montero'), ('Motorcycle', 'Honda Click'), ('Van', 'Toyota Hiace')]
+COLORS = ['White', 'Black', 'Silver', 'Red', 'Blue', 'Gray']
+PAYMENT_TYPES = ['Online', 'Cash', 'GCash', 'BankTransfer']
+
+
+@dataclass
+class Volumes:
+    drivers: int = 1000
+    officers: int = 50
+    admins: int = 5
+    violations: int = 10000
+    details: int = 20000
+    payments: int = 5000
+    audit_logs: int = 5000
+    changes: int = 5000
+
+
+def _aliases(alias):
+    # the shards belong to the home database
+    return shards.aliases(alias) if alias == shards.HOME else [alias]
+
+
+def setup_database(alias='default', keepdb=False, verbosity=0, concurrent=False):
+    """Create the test database for ``alias`` (and its shards) and the unmanaged core tables.
+
+    SQLite test databases live in memory with a shared cache, where a write
+    that meets another thread's fails at once with "database table is locked".
+    ``concurrent=True`` puts them in temporary files instead, opened in
+    IMMEDIATE mode, so concurrent writers wait their turn as they would on a
+    real database.
+
+    Returns the original database names, to be passed to ``teardown_database``.
+    """
+    old_names = {}
+    for name in _aliases(alias):
+        connection = connections[name]
+        old_names[name] = connection.settings_dict['NAME']
+        if concurrent and connection.vendor == 'sqlite' and not connection.settings_dict['TEST'].get('NAME'):
+            connection.settings_dict['TEST']['NAME'] = os.path.join(tempfile.gettempdir(), f'lto_load_{name}.sqlite3')
+            connection.settings_dict['OPTIONS'] = {
+                **connection.settings_dict['OPTIONS'], 'transaction_mode': 'IMMEDIATE', 'timeout': 30,
+            }
+        connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False, keepdb=keepdb)
+        schema.create_unmanaged_tables(connection, shards.models(name))
+        schema.apply_all(connection)
+    return old_names
+
+
+def teardown_database(old_names, alias='default', keepdb=False, verbosity=0):
+    for name, old_name in old_names.items():
+        connections[name].creation.destroy_test_db(old_name, verbosity=verbosity, keepdb=keepdb)
+
+
+def _batched(model, rows, using, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            model.objects.using(using).bulk_create(batch)
+            batch = []
+    if batch:
+        model.objects.using(using).bulk_create(batch)
+
+
+def _batched_sharded(model, rows, batch_size):
+    """Like ``_batched`` for ``(alias, row)`` pairs."""
+    batches = {}
+    for using, row in rows:
+        batch = batches.setdefault(using, [])
+        batch.append(row)
+        if len(batch) >= batch_size:
+            model.objects.using(using).bulk_create(batch)
+            batch.clear()
+    for using, batch in batches.items():
+        if batch:
+            model.objects.using(using).bulk_create(batch)
+
+
+def seed(volumes, alias='default', seed=1234, batch_size=5000, log=None):
+    """Fill the core tables with ``volumes`` rows, using explicit primary keys 1..N.
+
+    Tickets, details and payments on a shard get ``1..N`` on top of the first
+    id of the shard's range instead.
+
+    Returns a dict of the values scenarios need to build realistic requests
+    (which violations belong to which driver, usernames, and so on).
+    """
+    rng = random.Random(seed)
+    log = log or (lambda msg: None)
+    today = date.today()
+    now = datetime.now(timezone.utc)
+
+    log(f"seeding {volumes.drivers} drivers")
+    _batched(DriverUser, (
+        DriverUser(
+            driver_user_id=i,
+            username=f'driver{i}',
+            password=f'pass{i}',
+            full_name=f'Driver {i}',
+            email=f'driver{i}@example.com',
+            phone_number=f'0917{i:07d}',
+            license_number=f'N{i:09d}',
+            license_status='Valid',
+            license_expiry=today + timedelta(days=rng.randint(-200, 1800)),
+            birthday=date(1960, 1, 1) + timedelta(days=rng.randint(0, 15000)),
+            account_status='Verified' if rng.random() < 0.9 else 'Unverified',
+        )
+        for i in range(1, volumes.drivers + 1)
+    ), alias, batch_size)
+
+    officer_stations = [rng.choice(STATIONS) for _ in range(volumes.officers)]
+    _batched(LawOfficer, (
+        LawOfficer(
+            law_of_user_id=i,
+            username=f'officer{i}',
+            password=f'pass{i}',
+            badge_id=f'B{i:06d}',
+            station=officer_stations[i - 1],
+            phone_number=f'0918{i:07d}',
+            full_name=f'Officer {i}',
+        )
+        for i in range(1, volumes.officers + 1)
+    ), alias, batch_size)
+
+    _batched(LtoAdminUser, (
+        LtoAdminUser(
+            lto_user=i,
+            username=f'admin{i}',
+            password=f'pass{i}',
+            full_name=f'Admin {i}',
+            position='Records Officer',
+        )
+        for i in range(1, volumes.admins + 1)
+    ), alias, batch_size)
+
+    fees = [Decimal(rng.choice([150, 500, 1000, 1500, 2000, 3000, 5000])) for _ in VIOLATION_NAMES]
+    _batched(ViolationType, (
+        ViolationType(violation_type=i, violation_name=name, violation_fee=fees[i - 1])
+        for i, name in enumerate(VIOLATION_NAMES, start=1)
+    ), alias, batch_size)
+    # the current fees took effect a year ago; every third type cost less before that
+    fee_changed = now - timedelta(days=365)
+    schedule = []
+    for i, fee in enumerate(fees, start=1):
+        if i % 3 == 0:
+            schedule.append(ViolationTypeFee(
+                violation_type_id=i, effective_from=fee_changed - timedelta(days=730), amount_centavos=int(fee * 80)))
+        schedule.append(ViolationTypeFee(violation_type_id=i, effective_from=fee_changed, amount_centavos=int(fee * 100)))
+    _batched(ViolationTypeFee, schedule, alias, batch_size)
+
+    log(f"seeding {volumes.violations} violations")
+    drivers = [0] * (volumes.violations + 1)
+    for i in range(1, volumes.violations + 1):
+        drivers[i] = rng.randint(1, volumes.drivers)
+    # the database and id of violation ``i``, set as the officers are drawn
+    violation_alias = [alias] * (volumes.violations + 1)
+    violation_ids = [0] * (volumes.violations + 1)
+
+    def violations():
+        for i in range(1, volumes.violations + 1):
+            city = rng.choice(STATIONS)
+            latitude = longitude = geocell = None
+            # most devices report a position; tickets cluster around city centres
+            if rng.random() < 0.8:
+                center_lat, center_lon = CITY_CENTERS[city]
+                latitude = center_lat + rng.gauss(0, 0.02)
+                longitude = center_lon + rng.gauss(0, 0.02)
+                geocell = hotspots.cell_id(*hotspots.cell_of(latitude, longitude))
+            officer_id = rng.randint(1, volumes.officers)
+            using = shards.for_station(officer_stations[officer_id - 1], alias)
+            violation_alias[i] = using
+            violation_ids[i] = shards.id_range(using)[0] + i
+            yield using, Violation(
+                violation_id=violation_ids[i],
+                driver_user_id=drivers[i],
+                law_officer_id=officer_id,
+                station=officer_stations[officer_id - 1],
+                location=f'{rng.choice(LOCATIONS)}, {city}',
+                status='paid' if rng.random() < 0.4 else 'unpaid',
+                total_fee=fees[rng.randrange(len(fees))],
+                issued_at=now - timedelta(minutes=rng.randint(0, 525600)),
+                latitude=latitude,
+                longitude=longitude,
+                geocell=geocell,
+            )
+
+    _batched_sharded(Violation, violations(), batch_size)
+    # bulk inserts skip the receivers that keep the counters
+    hotspots.rebuild(alias)
+
+    log(f"seeding {volumes.details} violation details")
+
+    def details():
+        for i in range(1, volumes.details + 1):
+            type_index = rng.randrange(len(VIOLATION_NAMES))
+            vehicle_type, car_name = rng.choice(VEHICLES)
+            # the first pass gives every violation at least one detail
+            v = i if i <= volumes.violations else rng.randint(1, volumes.violations)
+            using = violation_alias[v]
+            yield using, ViolationDetail(
+                violation_details=shards.id_range(using)[0] + i,
+                violation_id=violation_ids[v],
+                violation_type_id=type_index + 1,
+                fee_at_time=fees[type_index],
+                notes=rng.choice(['', 'Driver cooperative', 'Refused to sign', 'Towed']),
+                platenumber=f'{rng.choice("ABCDNPTWXYZ")}{rng.choice("ABCDEFGH")}{rng.choice("ABCDEFGH")} {rng.randint(1000, 9999)}',
+                vehicle_type=vehicle_type,
+                car_name=car_name,
+                vehicle_color=rng.choice(COLORS),
+            )
+
+    _batched_sharded(ViolationDetail, details(), batch_size)
+    # bulk inserts skip the search receivers too
+    log("indexing drivers and violations for search")
+    search.rebuild(alias)
+
+    log(f"seeding {volumes.payments} payments")
+
+    payment_ids = [0] * (volumes.payments + 1)
+
+    def payments():
+        for i in range(1, volumes.payments + 1):
+            v = rng.randint(1, volumes.violations)
+            using = violation_alias[v]
+            payment_ids[i] = shards.id_range(using)[0] + i
+            yield using, Payment(
+                payment_id=payment_ids[i],
+                violation_id=violation_ids[v],
+                driver_user_id=drivers[v],
+                payment_type=rng.choice(PAYMENT_TYPES),
+                amount_paid=fees[rng.randrange(len(fees))],
+                transaction_ref=f'SEED-{i:09d}',
+                status=rng.choice(['For Checking', 'completed']),
+            )
+
+    _batched_sharded(Payment, payments(), batch_size)
+
+    log(f"seeding {volumes.audit_logs} audit log entries")
+    _batched(AuditLog, (
+        AuditLog(
+            log_id=i,
+            lto_user_id=rng.randint(1, volumes.admins),
+            driver_user_id=rng.randint(1, volumes.drivers),
+            action_type=rng.choice(['verify_driver', 'update_license_expiry', 'approve_payment']),
+            description='synthetic',
+            timestamp=now - timedelta(minutes=rng.randint(0, 525600)),
+        )
+        for i in range(1, volumes.audit_logs + 1)
+    ), alias, batch_size)
+
+    log(f"seeding {volumes.changes} change feed entries")
+    entity_ids = [
+        ('drivers', range(volumes.drivers + 1)), ('payments', payment_ids),
+        ('violations', violation_ids), ('audit_logs', range(volumes.audit_logs + 1)),
+    ]
+
+    def changes():
+        for i in range(1, volumes.changes + 1):
+            entity, ids = rng.choice(entity_ids)
+            yield ChangeLogEntry(
+                seq=i,
+                entity=entity,
+                entity_id=ids[rng.randint(1, len(ids) - 1)],
+                op=ChangeLogEntry.UPSERT,
+                changed_at=now - timedelta(seconds=volumes.changes - i + 60),
+                # as if each was written by a transaction of its own, long finished
+                txid=i,
+            )
+
+    _batched(ChangeLogEntry, changes(), alias, batch_size)
+
+    # explicit primary keys leave Postgres sequences behind; move them past the seeded rows
+    connection = connections[alias]
+    sql = connection.ops.sequence_reset_sql(
+        no_style(),
+        [DriverUser, LawOfficer, LtoAdminUser, ViolationType, Violation, ViolationDetail, Payment, AuditLog, ChangeLogEntry],
+    )
+    if sql:
+        with connection.cursor() as cursor:
+            for statement in sql:
+                cursor.execute(statement)
+    for using in _aliases(alias)[1:]:
+        connection = connections[using]
+        sql = connection.ops.sequence_reset_sql(no_style(), [Violation, ViolationDetail, Payment])
+        with connection.cursor() as cursor:
+            for statement in sql:
+                cursor.execute(statement)
+        # a shard that got no rows still has to start at its range
+        shards.reserve_ids(using)
+
+    return {
+        'volumes': volumes,
+        'violation_driver': {violation_ids[i]: drivers[i] for i in range(1, volumes.violations + 1)},
+        'violation_ids': violation_ids[1:],
+        'payment_ids': payment_ids[1:],
+        'officer_stations': officer_stations,
+        'change_head': volumes.changes,
+    }
+
+
+def load_context(alias='default'):
+    """Rebuild what ``seed`` returns from an already seeded database (``--keepdb``)."""
+    violation_driver, payment_ids, details = {}, [], 0
+    for using in _aliases(alias):
+        violations = Violation.objects.using(using).order_by('violation_id').values_list('violation_id', 'driver_user_id')
+        violation_driver.update(violations.iterator(chunk_size=10000))
+        payment_ids.extend(Payment.objects.using(using).order_by('payment_id').values_list('payment_id', flat=True))
+        details += ViolationDetail.objects.using(using).count()
+    volumes = Volumes(
+        drivers=DriverUser.objects.using(alias).count(),
+        officers=LawOfficer.objects.using(alias).count(),
+        admins=LtoAdminUser.objects.using(alias).count(),
+        violations=len(violation_driver),
+        details=details,
+        payments=len(payment_ids),
+        audit_logs=AuditLog.objects.using(alias).count(),
+        changes=ChangeLogEntry.objects.using(alias).count(),
+    )
+    officer_stations = list(LawOfficer.objects.using(alias).order_by('law_of_user_id').values_list('station', flat=True))
+    return {
+        'volumes': volumes,
+        'violation_driver': violation_driver,
+        'violation_ids': list(violation_driver),
+        'payment_ids': payment_ids,
+        'officer_stations': officer_stations,
+        'change_head': changefeed.head(alias),
+    }
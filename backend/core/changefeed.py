@@ -0,0 +1,211 @@
+"""
+Change feed for clients that keep a local copy of the admin tables.
+
+Every save or delete of a driver, payment, violation or audit log row appends
+a ``ChangeLogEntry`` (see the receivers in ``core.models``) in the same
+transaction as the write, or right after it commits for tickets and payments
+on a station's shard (core.shards). Each entry has a position that only grows
+in commit order, which is the client's cursor:
+
+1. Call ``changes/`` without a cursor to get the current head.
+2. Load the full lists once (``driver_users/``, ``payments/``, ...).
+3. From then on, call ``changes/?cursor=<head>`` and apply what comes back.
+
+A page lists each changed row once, in its current state and in the same
+shape the full-list endpoints use, plus the ids of deleted rows (tombstones).
+
+``seq`` is taken at insert time, so where transactions write concurrently a
+long one (an idempotent request, a report build) can commit a lower ``seq``
+after a reader's cursor moved past it. On PostgreSQL the position is
+therefore the id of the writing transaction (``txid``), and only entries of
+transactions older than every running one are returned: any transaction
+that can still commit has a higher id than all of them. A page never splits
+one transaction's entries. SQLite runs one write transaction at a time, so
+there ``seq`` itself is in commit order and is the position.
+
+Entries older than ``RETENTION_DAYS`` are removed by ``prune_change_log``; a
+cursor that points into the removed range gets 410 and must start over.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import F
+from django.utils import timezone
+
+from . import shards
+from .models import AuditLog, ChangeLogEntry, DriverUser, OldestRunningTransactionId, Payment, Violation
+
+DEFAULTS = {
+    'PAGE_SIZE': 500,
+    'MAX_PAGE_SIZE': 2000,
+    'RETENTION_DAYS': 30,
+}
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'CORE_CHANGE_FEED', {}))
+    return config
+
+
+class CursorExpired(Exception):
+    """The cursor is older than the retained history."""
+
+
+def _drivers(ids):
+    rows = DriverUser.objects.filter(pk__in=ids).values(
+        'driver_user_id', 'full_name', 'license_number', 'account_status', 'license_expiry')
+    return [
+        {
+            'id': d['driver_user_id'],
+            'name': d['full_name'],
+            'license': d['license_number'],
+            'status': d['account_status'],
+            'license_expiry': str(d['license_expiry']) if d['license_expiry'] else None,
+        }
+        for d in rows
+    ]
+
+
+def _sharded(model, ids, fields):
+    # payments and violations live on their station's database (core.shards)
+    rows = []
+    for alias, chunk in shards.group(ids).items():
+        with shards.use(alias):
+            rows.extend(model.objects.filter(pk__in=chunk).values(*fields))
+    return rows
+
+
+def _payments(ids):
+    rows = _sharded(Payment, ids, ['payment_id', 'driver_user_id', 'amount_paid', 'transaction_ref', 'status'])
+    names = dict(DriverUser.objects.filter(pk__in={p['driver_user_id'] for p in rows}).values_list('pk', 'full_name'))
+    return [
+        {
+            'id': p['payment_id'],
+            'driver': names.get(p['driver_user_id']) or '',
+            'amount': float(p['amount_paid']),
+            'transaction_ref': p['transaction_ref'],
+            'status': p['status'].lower(),
+        }
+        for p in rows
+    ]
+
+
+def _violations(ids):
+    rows = _sharded(Violation, ids, ['violation_id', 'driver_user_id', 'law_officer_id', 'location', 'status', 'total_fee'])
+    return [
+        {
+            'id': v['violation_id'],
+            'driver_user_id': v['driver_user_id'],
+            'law_officer_id': v['law_officer_id'],
+            'location': v['location'],
+            'status': v['status'],
+            'total_fee': float(v['total_fee']),
+        }
+        for v in rows
+    ]
+
+
+def _audit_logs(ids):
+    rows = AuditLog.objects.filter(pk__in=ids).values('log_id', 'lto_user_id', 'action_type', 'description', 'timestamp')
+    return [
+        {
+            'id': log['log_id'],
+            'lto_user': log['lto_user_id'],
+            'action': log['action_type'],
+            'description': log['description'],
+            'timestamp': log['timestamp'].strftime('%Y-%m-%d %H:%M'),
+        }
+        for log in rows
+    ]
+
+
+# entity name -> loader for the current rows, shaped like the full-list endpoints
+LOADERS = {
+    'drivers': _drivers,
+    'payments': _payments,
+    'violations': _violations,
+    'audit_logs': _audit_logs,
+}
+
+
+def _entries(using=None):
+    """Entries that can be handed out, annotated with their ``position``.
+
+    On PostgreSQL that leaves out those of transactions that may still be
+    running (see the module docstring).
+    """
+    entries = ChangeLogEntry.objects.using(using) if using else ChangeLogEntry.objects.all()
+    if connections[entries.db].vendor == 'postgresql':
+        return entries.filter(txid__lt=OldestRunningTransactionId()).annotate(position=F('txid'))
+    return entries.annotate(position=F('seq'))
+
+
+def head(using=None):
+    """The newest position; a fresh client's first cursor."""
+    return _entries(using).order_by('-position').values_list('position', flat=True).first() or 0
+
+
+def changes_since(cursor, limit=None):
+    """One page of changes after ``cursor``.
+
+    Returns a dict with the next ``cursor``, ``has_more``, the changed rows per
+    entity and ``deleted`` ids per entity. Raises ``CursorExpired`` when entries
+    after ``cursor`` have been pruned.
+    """
+    config = get_config()
+    limit = min(limit or config['PAGE_SIZE'], config['MAX_PAGE_SIZE'])
+    entries = _entries()
+
+    # clients only hold positions of entries we returned, and pruning removes
+    # the oldest entries first (never the newest): nothing at or below the
+    # cursor means the history after it is gone too
+    if cursor and not entries.filter(position__lte=cursor).exists():
+        raise CursorExpired(cursor)
+
+    fields = ('position', 'entity', 'entity_id', 'op')
+    after = entries.filter(position__gt=cursor).order_by('position', 'seq')
+    rows = list(after.values_list(*fields)[:limit + 1])
+    has_more = len(rows) > limit
+    if has_more:
+        # end the page on a whole transaction: the cursor moves past all of the last one
+        last = rows[limit][0]
+        rows = [row for row in rows[:limit] if row[0] != last]
+        if not rows:
+            # one transaction larger than a page is sent whole
+            rows = list(after.filter(position=last).values_list(*fields))
+
+    # a row written several times in the page is sent once, as it is now
+    latest = {}
+    for _position, entity, entity_id, op in rows:
+        latest[(entity, entity_id)] = op
+
+    upserts = {name: [] for name in LOADERS}
+    deleted = {name: [] for name in LOADERS}
+    for (entity, entity_id), op in latest.items():
+        if entity not in LOADERS:
+            continue
+        (deleted if op == ChangeLogEntry.DELETE else upserts)[entity].append(entity_id)
+
+    result = {'cursor': rows[-1][0] if rows else cursor, 'has_more': has_more}
+    for name, loader in LOADERS.items():
+        ids = upserts[name]
+        rows = loader(ids) if ids else []
+        # rows deleted since; their delete entry is in a later page
+        missing = set(ids) - {row['id'] for row in rows}
+        result[name] = rows
+        deleted[name].extend(sorted(missing))
+    result['deleted'] = {name: ids for name, ids in deleted.items() if ids}
+    return result
+
+
+def prune(days=None):
+    """Delete entries older than ``days``; returns the number removed."""
+    days = get_config()['RETENTION_DAYS'] if days is None else days
+    cutoff = timezone.now() - timedelta(days=days)
+    # keep the newest entry so the oldest retained position never runs ahead of the head
+    newest = _entries().order_by('-position', '-seq').values_list('seq', flat=True).first()
+    removed, _ = ChangeLogEntry.objects.filter(changed_at__lt=cutoff).exclude(seq=newest).delete()
+    return removed
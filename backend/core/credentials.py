@@ -0,0 +1,183 @@
+"""
+Password hashing and login throttling for the three user tables.
+
+Passwords are hashed with Django's hashers (``PASSWORD_HASHERS``). Rows that
+still hold a plaintext password are accepted once and rehashed on that
+successful login, so existing accounts migrate lazily. A failed check
+always costs one hash, whether the username is unknown, has a plaintext
+password or a hashed one, so response times do not reveal which usernames
+exist.
+
+Hashing is deliberately slow, so it runs on a small bounded thread pool:
+at most ``WORKERS`` hashes run at once and at most ``QUEUE`` more wait. When
+both are full the login is refused straight away (``HashingBusy``) instead of
+piling up request workers during a shift-change spike.
+
+``LoginThrottle`` counts recent failures per username from each client IP,
+and per client IP, in memory and turns callers away before any hashing or
+database work. A username is only locked for the address that kept getting
+its password wrong, so nobody can lock another user out of their account.
+"""
+
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, identify_hasher, make_password
+from django.utils.crypto import constant_time_compare, get_random_string
+
+from .lru import LRUCache
+
+DEFAULTS = {
+    'WORKERS': 4,
+    'QUEUE': 32,
+    'TIMEOUT': 10,
+    'USERNAME_FAILURES': 5,
+    'IP_FAILURES': 30,
+    'WINDOW': 15 * 60,
+}
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'CORE_CREDENTIALS', {}))
+    return config
+
+
+class HashingBusy(Exception):
+    """The hashing pool and its queue are full."""
+
+
+class HashPool:
+    def __init__(self, workers, queue, timeout):
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='core-hash')
+        self._slots = threading.BoundedSemaphore(workers + queue)
+
+    def run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy("Password hashing is busy. Try again shortly.")
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _f: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            raise HashingBusy("Password hashing timed out. Try again shortly.")
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                config = get_config()
+                _pool = HashPool(config['WORKERS'], config['QUEUE'], config['TIMEOUT'])
+    return _pool
+
+
+def is_hashed(stored):
+    try:
+        identify_hasher(stored)
+    except ValueError:
+        return False
+    return True
+
+
+_dummy_hash = None
+
+
+def _hash_anyway(raw):
+    # as Django's ModelBackend does for unknown users: spend the time a real check takes
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = make_password(get_random_string(32))
+    check_password(raw, _dummy_hash)
+
+
+def _verify(raw, stored):
+    """``(matches, new_hash)``; ``new_hash`` is set when the stored value should be replaced.
+
+    An empty ``stored`` (no such user) is checked against a throwaway hash.
+    """
+    if not stored:
+        _hash_anyway(raw)
+        return False, None
+    if is_hashed(stored):
+        upgraded = []
+        # check_password calls setter only when the hasher wants an upgrade
+        matches = check_password(raw, stored, setter=lambda r: upgraded.append(make_password(r)))
+        return matches, (upgraded[0] if matches and upgraded else None)
+    # legacy plaintext row
+    if constant_time_compare(raw, stored):
+        return True, make_password(raw)
+    _hash_anyway(raw)
+    return False, None
+
+
+def verify_password(raw, stored):
+    return get_pool().run(_verify, raw, stored)
+
+
+def hash_password(raw):
+    return get_pool().run(make_password, raw)
+
+
+class LoginThrottle:
+    """In-memory failure counters per (username, client IP) and per client IP."""
+
+    def __init__(self, username_limit, ip_limit, window, maxsize=10000):
+        self.username_limit = username_limit
+        self.ip_limit = ip_limit
+        self.window = window
+        self._failures = LRUCache(maxsize=maxsize, ttl=window)
+        self._lock = threading.Lock()
+
+    def blocked(self, username, ip):
+        """Seconds until the caller may retry, or 0 if not blocked."""
+        now = time.monotonic()
+        wait = 0
+        for key, limit in ((('u', username, ip), self.username_limit), (('ip', ip), self.ip_limit)):
+            count, last = self._failures.get(key) or (0, now)
+            if count >= limit:
+                # entries expire with the window, so this is at least 1
+                wait = max(wait, math.ceil(last + self.window - now))
+        return wait
+
+    def record_failure(self, username, ip):
+        now = time.monotonic()
+        with self._lock:
+            for key in (('u', username, ip), ('ip', ip)):
+                # the window restarts with each failure
+                count, _last = self._failures.get(key) or (0, now)
+                self._failures.set(key, (count + 1, now))
+
+    def reset(self, username, ip):
+        self._failures.delete(('u', username, ip))
+
+
+_throttle = None
+
+
+def get_throttle():
+    global _throttle
+    if _throttle is None:
+        with _pool_lock:
+            if _throttle is None:
+                config = get_config()
+                _throttle = LoginThrottle(config['USERNAME_FAILURES'], config['IP_FAILURES'], config['WINDOW'])
+    return _throttle
+
+
+def client_ip(request):
+    return request.META.get('REMOTE_ADDR', '')
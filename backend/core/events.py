@@ -0,0 +1,323 @@
+"""
+Server-sent events for the admin console.
+
+Views call ``publish`` (after their transaction commits) with a small event
+such as ``payment_submitted``. Every open ``events/`` stream in the process
+receives it through the in-process ``Broker``: each stream has its own
+bounded ``asyncio.Queue`` and waits on it, so an idle connection costs a
+suspended coroutine and a queue, not a thread.
+
+``CORE_EVENTS['BACKEND']`` decides how an event reaches the other workers:
+
+* ``local`` - only streams in the publishing process see it (development,
+  SQLite, a single worker).
+* ``postgres`` - ``publish`` sends ``NOTIFY``; one listener thread per
+  process (started with the first stream) runs ``LISTEN`` and hands events
+  to that process's broker.
+
+A stream that falls ``QUEUE_SIZE`` events behind, or that may have missed
+events while the listener reconnected, is sent ``resync``; the client then
+catches up through the change feed (``changes/``).
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+
+from .tokens import verify_token
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'core_events'
+
+DEFAULTS = {
+    'BACKEND': 'local',
+    'QUEUE_SIZE': 100,
+    'HEARTBEAT': 15,
+    'MAX_SUBSCRIBERS': 1000,
+}
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'CORE_EVENTS', {}))
+    return config
+
+
+class Subscription:
+    def __init__(self, loop, maxsize):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize)
+        self.overflowed = False
+
+    def offer(self, event):
+        # runs on the subscriber's loop
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # drop everything queued and tell the client to resync instead
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({'event': 'resync', 'data': {}})
+
+
+class TooManySubscribers(Exception):
+    """The process already serves ``MAX_SUBSCRIBERS`` streams."""
+
+
+class Broker:
+    """Fans published events out to the streams of this process.
+
+    ``publish`` may be called from any thread; it schedules one callback per
+    event loop, which then fills the queues of that loop's subscribers.
+    """
+
+    def __init__(self, max_subscribers):
+        self.max_subscribers = max_subscribers
+        self.published = 0
+        self.dropped = 0
+        self._by_loop = {}
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def subscribe(self, maxsize):
+        subscription = Subscription(asyncio.get_running_loop(), maxsize)
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                raise TooManySubscribers()
+            self._by_loop.setdefault(subscription.loop, set()).add(subscription)
+            self._count += 1
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._by_loop.get(subscription.loop)
+            if subscribers and subscription in subscribers:
+                subscribers.discard(subscription)
+                self._count -= 1
+                if not subscribers:
+                    del self._by_loop[subscription.loop]
+
+    def publish(self, event):
+        with self._lock:
+            targets = [(loop, list(subscribers)) for loop, subscribers in self._by_loop.items()]
+            self.published += 1
+        for loop, subscribers in targets:
+            try:
+                loop.call_soon_threadsafe(self._deliver, subscribers, event)
+            except RuntimeError:
+                # loop already closed; its subscribers are going away
+                with self._lock:
+                    self.dropped += len(subscribers)
+
+    def _deliver(self, subscribers, event):
+        for subscription in subscribers:
+            was_overflowed = subscription.overflowed
+            subscription.offer(event)
+            if subscription.overflowed and not was_overflowed:
+                self.dropped += 1
+
+
+class PostgresListener:
+    """Background thread that turns ``NOTIFY core_events`` into local publishes."""
+
+    def __init__(self, broker, alias='default'):
+        self.broker = broker
+        self.alias = alias
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='core-events-listen', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _connect(self):
+        import psycopg
+
+        # the parameters Django itself connects with, OPTIONS (sslmode, service, ...) included;
+        # a connection of its own, never one from a pool, since it stays in LISTEN
+        params = connections[self.alias].get_connection_params()
+        params['autocommit'] = True
+        return psycopg.connect(**params)
+
+    def _run(self):
+        backoff = 1
+        while not self._stop.is_set():
+            try:
+                with self._connect() as conn:
+                    conn.execute(f'LISTEN {CHANNEL}')
+                    backoff = 1
+                    # anything sent while we were not listening is lost
+                    self.broker.publish({'event': 'resync', 'data': {}})
+                    while not self._stop.is_set():
+                        for notify in conn.notifies(timeout=5):
+                            self.broker.publish(json.loads(notify.payload))
+            except Exception:
+                logger.exception("event listener lost its connection; retrying in %ss", backoff)
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 60)
+
+
+_broker = None
+_listener = None
+_lock = threading.Lock()
+
+
+def get_broker():
+    """The process-wide broker; starts the Postgres listener on first use if configured."""
+    global _broker, _listener
+    if _broker is None:
+        with _lock:
+            if _broker is None:
+                config = get_config()
+                if config['BACKEND'] not in ('local', 'postgres'):
+                    raise ValueError(f"Unknown CORE_EVENTS backend {config['BACKEND']!r}")
+                broker = Broker(config['MAX_SUBSCRIBERS'])
+                if config['BACKEND'] == 'postgres':
+                    _listener = PostgresListener(broker)
+                    _listener.start()
+                _broker = broker
+    return _broker
+
+
+def publish(event, **data):
+    """Send ``event`` to every open stream. Call it from ``transaction.on_commit``."""
+    payload = {'event': event, 'data': data}
+    if get_config()['BACKEND'] == 'postgres':
+        with connections['default'].cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [CHANNEL, json.dumps(payload, default=str)])
+    else:
+        get_broker().publish(payload)
+
+
+def refuse(actor):
+    """``(status, message)`` when ``actor`` may not open a stream, else None."""
+    if actor is None:
+        return 401, 'Authentication required.'
+    if actor.role != 'admin':
+        return 403, 'Not allowed for this account type.'
+    return None
+
+
+def format_event(payload, event_id):
+    data = json.dumps(payload['data'], default=str, separators=(',', ':'))
+    return f"id: {event_id}\nevent: {payload['event']}\ndata: {data}\n\n".encode()
+
+
+async def stream(broker, subscription, heartbeat):
+    """Yields SSE frames for ``subscription`` until the client goes away.
+
+    A comment line every ``heartbeat`` seconds keeps proxies from closing an
+    idle stream.
+    """
+    try:
+        # how long the client should wait before reconnecting
+        yield b'retry: 3000\n\n'
+        event_id = 0
+        while True:
+            try:
+                payload = await asyncio.wait_for(subscription.queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield f': ping {int(time.time())}\n\n'.encode()
+                continue
+            event_id += 1
+            yield format_event(payload, event_id)
+            if payload['event'] == 'resync':
+                subscription.overflowed = False
+    finally:
+        broker.unsubscribe(subscription)
+
+
+class StreamApp:
+    """ASGI app that serves ``path`` itself and passes everything else to ``app``.
+
+    Django's ASGI handler keeps a thread for each request that runs any sync
+    code (middleware, signal receivers) until the response is finished; for
+    a stream that stays open all shift, that is a parked thread per client.
+    Streams served here cost only their coroutine. They skip the Django
+    middleware, so authentication is the token alone.
+    """
+
+    def __init__(self, app, path):
+        self.app = app
+        self.path = path
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] != self.path:
+            return await self.app(scope, receive, send)
+        if scope['method'] != 'GET':
+            return await self.send_json(send, 405, {'success': False, 'error': 'GET only.'})
+
+        # the token's version is checked in the database
+        denied = refuse(await sync_to_async(verify_token)(self.token(scope)))
+        if denied:
+            return await self.send_json(send, denied[0], {'success': False, 'error': denied[1]})
+        config = get_config()
+        broker = get_broker()
+        try:
+            subscription = broker.subscribe(config['QUEUE_SIZE'])
+        except TooManySubscribers:
+            return await self.send_json(send, 503, {'success': False, 'error': 'Too many open event streams.'},
+                                        [(b'retry-after', b'30')])
+
+        frames = stream(broker, subscription, config['HEARTBEAT'])
+        try:
+            await send({'type': 'http.response.start', 'status': 200, 'headers': self.headers([
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ])})
+            writer = asyncio.create_task(self.write(send, frames))
+            disconnect = asyncio.create_task(self.wait_for_disconnect(receive))
+            done, pending = await asyncio.wait({writer, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            for task in done:
+                task.result()
+        finally:
+            # unsubscribes
+            await frames.aclose()
+
+    def token(self, scope):
+        for name, value in scope['headers']:
+            if name == b'authorization':
+                scheme, _, token = value.decode('latin-1').partition(' ')
+                if scheme.lower() == 'bearer' and token:
+                    return token.strip()
+        # browsers' EventSource cannot send headers
+        return parse_qs(scope.get('query_string', b'').decode('latin-1')).get('token', [''])[0]
+
+    def headers(self, headers):
+        if getattr(settings, 'CORS_ALLOW_ALL_ORIGINS', False):
+            headers.append((b'access-control-allow-origin', b'*'))
+        return headers
+
+    async def send_json(self, send, status, body, headers=()):
+        await send({'type': 'http.response.start', 'status': status, 'headers': self.headers([
+            (b'content-type', b'application/json'), *headers,
+        ])})
+        await send({'type': 'http.response.body', 'body': json.dumps(body).encode()})
+
+    async def write(self, send, frames):
+        async for frame in frames:
+            await send({'type': 'http.response.body', 'body': frame, 'more_body': True})
+
+    async def wait_for_disconnect(self, receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
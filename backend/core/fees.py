@@ -0,0 +1,229 @@
+"""
+Violation fees, in integer centavos.
+
+Each violation type has a fee schedule: ``ViolationTypeFee`` rows, each one
+the fee from its ``effective_from`` until the next row of the same type. A
+fee change is scheduled by adding a row (``manage.py set_fee``); existing
+rows are never edited, so the fee of any past ticket can be recomputed from
+the time it was issued. Types without a schedule fall back to
+``violation_type.violation_fee``.
+
+``get_schedule()`` loads every schedule into a ``FeeSchedule`` held by the
+process, so pricing a ticket does not touch the database. Saving or deleting
+a schedule row drops it in this process once the transaction commits; other
+processes reload it every ``RELOAD`` seconds, which is why fee changes
+should be scheduled ahead of the time they take effect.
+
+The unmanaged tables keep pesos in ``DECIMAL(10, 2)`` columns; ``pesos()``
+converts back for writing to them. ``audit()`` (``manage.py audit_fees``)
+checks the fees already stored there against the schedule.
+"""
+
+import threading
+import time
+from bisect import bisect_right
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import shards
+from .models import Violation, ViolationDetail, ViolationType, ViolationTypeFee
+
+DEFAULTS = {
+    'RELOAD': 60,
+}
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'CORE_FEES', {}))
+    return config
+
+
+class UnknownViolationType(ValueError):
+    """No violation type with this id."""
+
+
+def to_centavos(value):
+    """Pesos (``Decimal``, ``str`` or ``int``) as integer centavos.
+
+    Raises ``ValueError`` for amounts with more than two decimal places.
+    """
+    centavos = Decimal(str(value)) * 100
+    if centavos != centavos.to_integral_value():
+        raise ValueError(f"{value!r} is not a whole number of centavos")
+    return int(centavos)
+
+
+def pesos(centavos):
+    """Integer centavos as a two-place ``Decimal``, for the pesos columns."""
+    return Decimal(centavos).scaleb(-2)
+
+
+class FeeSchedule:
+    """Fee lookup table for every violation type."""
+
+    def __init__(self, versions, base):
+        # type id -> (effective_from times, amounts), both oldest first
+        self.versions = versions
+        # type id -> violation_type.violation_fee, for types without a schedule
+        self.base = base
+
+    @classmethod
+    def load(cls, using='default'):
+        versions = {}
+        rows = (
+            ViolationTypeFee.objects.using(using)
+            .order_by('violation_type_id', 'effective_from')
+            .values_list('violation_type_id', 'effective_from', 'amount_centavos')
+        )
+        for type_id, effective_from, amount in rows:
+            times, amounts = versions.setdefault(type_id, ([], []))
+            times.append(effective_from)
+            amounts.append(amount)
+        base = {
+            type_id: to_centavos(fee)
+            for type_id, fee in ViolationType.objects.using(using).values_list('violation_type', 'violation_fee')
+        }
+        return cls(versions, base)
+
+    def _type_id(self, type_id):
+        try:
+            type_id = int(type_id)
+        except (TypeError, ValueError):
+            raise UnknownViolationType(type_id) from None
+        if type_id not in self.base and type_id not in self.versions:
+            raise UnknownViolationType(type_id)
+        return type_id
+
+    def fee(self, type_id, at=None):
+        """Centavos due for ``type_id`` on a ticket issued at ``at`` (default now)."""
+        type_id = self._type_id(type_id)
+        if type_id in self.versions:
+            times, amounts = self.versions[type_id]
+            i = bisect_right(times, at or timezone.now()) - 1
+            if i >= 0:
+                return amounts[i]
+        return self.base[type_id]
+
+    def amounts(self, type_id):
+        """Every fee ``type_id`` has had, for tickets whose issue time is unknown."""
+        type_id = self._type_id(type_id)
+        found = set(self.versions.get(type_id, ((), ()))[1])
+        if type_id in self.base:
+            found.add(self.base[type_id])
+        return found
+
+    def price(self, type_ids, at=None):
+        """``(line fees, total)`` in centavos for the violations on one ticket."""
+        at = at or timezone.now()
+        lines = [self.fee(type_id, at) for type_id in type_ids]
+        return lines, sum(lines)
+
+
+def audit(chunk_size=5000, keep=100, using='default'):
+    """Recomputes the fees of every ticket from the schedule.
+
+    Tickets are read in ``violation_id`` ranges of ``chunk_size``, each with
+    its details in one more query. A detail is a mismatch (``fee``) when its
+    ``fee_at_time`` is not what the schedule charged when the ticket was
+    issued or, for tickets issued before ``issued_at`` was recorded, not any
+    fee its type has had. A ticket is a mismatch (``total``) when its
+    ``total_fee`` is not the sum of its details. Details without a type, or
+    with a type that no longer exists, are counted as ``untyped`` and
+    ``unknown_type``.
+
+    Returns the counts per kind and the first ``keep`` findings.
+    """
+    schedule = FeeSchedule.load(using)
+    counts = dict.fromkeys(['tickets', 'undated', 'details', 'fee', 'total', 'untyped', 'unknown_type'], 0)
+    findings = []
+
+    def found(kind, **data):
+        counts[kind] += 1
+        if len(findings) < keep:
+            findings.append({'kind': kind, **data})
+
+    # tickets of every station, each with its details on the same database
+    for alias in shards.aliases(using):
+        tickets = Violation.objects.using(alias).order_by('violation_id')
+        last = 0
+        while True:
+            chunk = list(tickets.filter(violation_id__gt=last).values_list('violation_id', 'total_fee', 'issued_at')[:chunk_size])
+            if not chunk:
+                break
+            first, last = chunk[0][0], chunk[-1][0]
+            issued = {violation_id: issued_at for violation_id, _total, issued_at in chunk}
+            sums = dict.fromkeys(issued, 0)
+            details = (
+                ViolationDetail.objects.using(alias)
+                .filter(violation_id__gte=first, violation_id__lte=last)
+                .values_list('violation_details', 'violation_id', 'violation_type_id', 'fee_at_time')
+            )
+            for detail_id, violation_id, type_id, fee_at_time in details:
+                if violation_id not in issued:
+                    continue
+                counts['details'] += 1
+                recorded = to_centavos(fee_at_time or 0)
+                sums[violation_id] += recorded
+                if type_id is None:
+                    found('untyped', violation_id=violation_id, detail_id=detail_id)
+                    continue
+                issued_at = issued[violation_id]
+                try:
+                    if issued_at is None:
+                        expected = None
+                        ok = recorded in schedule.amounts(type_id)
+                    else:
+                        expected = schedule.fee(type_id, issued_at)
+                        ok = recorded == expected
+                except UnknownViolationType:
+                    found('unknown_type', violation_id=violation_id, detail_id=detail_id, violation_type=type_id)
+                    continue
+                if not ok:
+                    found('fee', violation_id=violation_id, detail_id=detail_id, violation_type=type_id,
+                          recorded=recorded, expected=expected)
+
+            for violation_id, total_fee, issued_at in chunk:
+                counts['tickets'] += 1
+                if issued_at is None:
+                    counts['undated'] += 1
+                if to_centavos(total_fee) != sums[violation_id]:
+                    found('total', violation_id=violation_id, recorded=to_centavos(total_fee), expected=sums[violation_id])
+    return {'counts': counts, 'findings': findings}
+
+
+_schedule = None
+_loaded_at = 0.0
+_lock = threading.Lock()
+
+
+def get_schedule():
+    """The process-wide ``FeeSchedule``, reloaded every ``RELOAD`` seconds."""
+    global _schedule, _loaded_at
+    reload = get_config()['RELOAD']
+    if _schedule is None or time.monotonic() - _loaded_at > reload:
+        with _lock:
+            if _schedule is None or time.monotonic() - _loaded_at > reload:
+                _schedule = FeeSchedule.load()
+                _loaded_at = time.monotonic()
+    return _schedule
+
+
+def invalidate():
+    global _schedule
+    with _lock:
+        _schedule = None
+
+
+@receiver(post_save, sender=ViolationTypeFee, dispatch_uid='fees_schedule_saved')
+@receiver(post_delete, sender=ViolationTypeFee, dispatch_uid='fees_schedule_deleted')
+@receiver(post_save, sender=ViolationType, dispatch_uid='fees_type_saved')
+@receiver(post_delete, sender=ViolationType, dispatch_uid='fees_type_deleted')
+def invalidate_on_change(sender, using, **kwargs):
+    # a reload before the commit would cache the old rows again
+    transaction.on_commit(invalidate, using=using)
@@ -0,0 +1,249 @@
+"""
+Where violations are concentrated.
+
+``register_violation`` takes the latitude and longitude of the officer's
+device. The map is cut into a fixed grid of ``1 / CELLS_PER_DEGREE`` degree
+cells (about 1.1 km north to south); each ticket stores its cell as
+``geocell``, and ``HotspotCount`` keeps the number of tickets issued per cell
+per day (UTC). The receivers below keep those counters in step with the
+``violations`` table, in the same transaction as the write (after it, for
+tickets on a station's shard), so hotspot queries read only the counters
+and never the tickets; a ticket whose position or issue day is edited has
+its count moved to its new cell and day. The counters of every station are
+on ``default``.
+
+Changing ``CELLS_PER_DEGREE`` changes every cell id: run ``rebuild_hotspots``
+after updating ``geocell`` for existing tickets.
+"""
+
+import heapq
+import math
+from collections import Counter
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from functools import partial
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import shards
+from .models import HotspotCount, Violation
+
+CELLS_PER_DEGREE = 100
+ROWS = 180 * CELLS_PER_DEGREE
+COLUMNS = 360 * CELLS_PER_DEGREE
+
+DEFAULTS = {
+    'TOP': 20,
+    # most cells one response may hold; callers zoom out past that
+    'MAX_CELLS': 2000,
+    'MAX_DAYS': 366,
+}
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'CORE_HOTSPOTS', {}))
+    return config
+
+
+def position(latitude, longitude):
+    """Validated ``(latitude, longitude)`` floats, or None when neither is given.
+
+    Raises ``ValueError`` for a half-given or out-of-range position.
+    """
+    given = [value not in (None, '') for value in (latitude, longitude)]
+    if not any(given):
+        return None
+    if not all(given):
+        raise ValueError("latitude and longitude must be sent together")
+    latitude, longitude = float(latitude), float(longitude)
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError("latitude must be within -90..90 and longitude within -180..180")
+    return latitude, longitude
+
+
+def cell_of(latitude, longitude):
+    """Grid ``(row, column)`` of a position; rows run south to north from the south pole."""
+    row = min(ROWS - 1, math.floor((latitude + 90) * CELLS_PER_DEGREE))
+    column = math.floor((longitude + 180) * CELLS_PER_DEGREE) % COLUMNS
+    return row, column
+
+
+def cell_id(row, column):
+    return row * COLUMNS + column
+
+
+def bounds(row, column, size=1):
+    """``(south, west, north, east)`` of the ``size`` x ``size`` block starting at the cell."""
+    # from whole cells, so the edges come out as round numbers
+    south = (row - 90 * CELLS_PER_DEGREE) / CELLS_PER_DEGREE
+    west = (column - 180 * CELLS_PER_DEGREE) / CELLS_PER_DEGREE
+    north = (row + size - 90 * CELLS_PER_DEGREE) / CELLS_PER_DEGREE
+    east = (column + size - 180 * CELLS_PER_DEGREE) / CELLS_PER_DEGREE
+    return south, west, north, east
+
+
+def _day(issued_at):
+    return timezone.localtime(issued_at or timezone.now(), dt_timezone.utc).date()
+
+
+def _bump(day, row, column, delta, using):
+    counts = HotspotCount.objects.using(using).filter(day=day, cell_y=row, cell_x=column)
+    if delta < 0:
+        counts.filter(count__gte=-delta).update(count=F('count') + delta)
+        return
+    if counts.update(count=F('count') + delta):
+        return
+    try:
+        with transaction.atomic(using=using):
+            HotspotCount.objects.using(using).create(day=day, cell_y=row, cell_x=column, count=delta)
+    except IntegrityError:
+        # another ticket created the row first
+        counts.update(count=F('count') + delta)
+
+
+def _counted(geocell, issued_at):
+    """``(day, row, column)`` a ticket is counted under, or None if it has no cell."""
+    if geocell is None:
+        return None
+    return (_day(issued_at), *divmod(geocell, COLUMNS))
+
+
+@receiver(pre_save, sender=Violation, dispatch_uid='hotspots_locate')
+def locate(sender, instance, using, update_fields=None, **kwargs):
+    if instance.latitude is None or instance.longitude is None:
+        instance.geocell = None
+    else:
+        instance.geocell = cell_id(*cell_of(instance.latitude, instance.longitude))
+    # where an existing ticket was counted, so an edit can move its count
+    instance._hotspot_before = None
+    if instance._state.adding or instance.pk is None:
+        return
+    if update_fields is not None and not {'latitude', 'longitude', 'geocell', 'issued_at'} & set(update_fields):
+        # neither its cell nor its day can change
+        instance._hotspot_before = _counted(instance.geocell, instance.issued_at)
+        return
+    before = Violation.objects.using(using).filter(pk=instance.pk).values_list('geocell', 'issued_at').first()
+    if before:
+        instance._hotspot_before = _counted(*before)
+
+
+@receiver(post_save, sender=Violation, dispatch_uid='hotspots_count_save')
+def count_on_save(sender, instance, using, **kwargs):
+    # tickets are counted once, where and when they were issued
+    now = _counted(instance.geocell, instance.issued_at)
+    before, instance._hotspot_before = getattr(instance, '_hotspot_before', None), None
+    if before == now:
+        return
+    if before is not None:
+        shards.after_write(using, partial(_bump, *before, -1))
+    if now is not None:
+        shards.after_write(using, partial(_bump, *now, 1))
+
+
+@receiver(post_delete, sender=Violation, dispatch_uid='hotspots_count_delete')
+def count_on_delete(sender, instance, using, **kwargs):
+    if instance.geocell is not None:
+        shards.after_write(using, partial(_bump, _day(instance.issued_at), *divmod(instance.geocell, COLUMNS), -1))
+
+
+def default_range():
+    today = timezone.localtime(timezone.now(), dt_timezone.utc).date()
+    return today - timedelta(days=6), today
+
+
+def hotspots(since, until, box=None, zoom=1, limit=None):
+    """The cells with the most tickets issued from ``since`` to ``until`` (days, inclusive).
+
+    ``box`` is ``(south, west, north, east)``; a box with ``west`` east of
+    ``east`` crosses the antimeridian. ``zoom`` merges ``zoom`` x ``zoom``
+    cells into one, for heatmaps of wide areas. Returns up to ``limit``
+    cells, busiest first.
+    """
+    counts = HotspotCount.objects.filter(day__gte=since, day__lte=until)
+    if box is not None:
+        south, west, north, east = box
+        (row0, column0), row1 = cell_of(south, west), cell_of(north, east)[0]
+        # the east edge is the last column, not the first wrapped around from 180
+        column1 = min(COLUMNS - 1, math.floor((east + 180) * CELLS_PER_DEGREE))
+        counts = counts.filter(cell_y__gte=row0, cell_y__lte=row1)
+        if column0 <= column1:
+            counts = counts.filter(cell_x__gte=column0, cell_x__lte=column1)
+        else:
+            # across the antimeridian: from west to 180, then from -180 to east
+            counts = counts.filter(Q(cell_x__gte=column0) | Q(cell_x__lte=column1))
+    if zoom > 1:
+        counts = counts.annotate(row=F('cell_y') / zoom * zoom, column=F('cell_x') / zoom * zoom)
+    else:
+        counts = counts.annotate(row=F('cell_y'), column=F('cell_x'))
+    rows = (
+        counts.values('row', 'column')
+        .annotate(total=Sum('count'))
+        .filter(total__gt=0)
+        .order_by('-total', 'row', 'column')[:limit or get_config()['TOP']]
+    )
+    cells = []
+    for r in rows:
+        south, west, north, east = bounds(r['row'], r['column'], zoom)
+        cell = {'count': r['total'], 'south': south, 'west': west, 'north': north, 'east': east}
+        if zoom == 1:
+            cell['cell'] = cell_id(r['row'], r['column'])
+        cells.append(cell)
+    return cells
+
+
+def violations_in_cell(cell, since, until, limit=100):
+    """Tickets issued in one cell from ``since`` to ``until``, newest first."""
+    start = datetime.combine(since, time.min, tzinfo=dt_timezone.utc)
+    end = datetime.combine(until + timedelta(days=1), time.min, tzinfo=dt_timezone.utc)
+
+    def newest(alias):
+        return list(
+            Violation.objects
+            .filter(geocell=cell, issued_at__gte=start, issued_at__lt=end)
+            .order_by('-issued_at')
+            .values('violation_id', 'location', 'latitude', 'longitude', 'status', 'issued_at')[:limit]
+        )
+
+    # a cell near a boundary can hold tickets of several stations
+    rows = heapq.merge(*(found for _alias, found in shards.fan_out(newest)), key=lambda v: v['issued_at'], reverse=True)
+    return [
+        {
+            'id': v['violation_id'],
+            'location': v['location'],
+            'latitude': v['latitude'],
+            'longitude': v['longitude'],
+            'status': v['status'],
+            'issued_at': v['issued_at'].isoformat(),
+        }
+        for v in list(rows)[:limit]
+    ]
+
+
+def rebuild(using='default', batch_size=5000):
+    """Recounts every cell from the tickets; returns the number of counters written."""
+    totals = Counter()
+    for alias in shards.aliases(using):
+        counts = (
+            Violation.objects.using(alias)
+            .filter(geocell__isnull=False, issued_at__isnull=False)
+            .annotate(day=TruncDate('issued_at', tzinfo=dt_timezone.utc))
+            .values_list('day', 'geocell')
+            .annotate(n=Count('violation_id'))
+            .order_by()
+        )
+        for day, geocell, n in counts:
+            totals[day, geocell] += n
+    counters = [
+        HotspotCount(day=day, cell_y=geocell // COLUMNS, cell_x=geocell % COLUMNS, count=n)
+        for (day, geocell), n in totals.items()
+    ]
+    with transaction.atomic(using=using):
+        HotspotCount.objects.using(using).all().delete()
+        HotspotCount.objects.using(using).bulk_create(counters, batch_size=batch_size)
+    return len(counters)
@@ -0,0 +1,147 @@
+"""
+Idempotency keys for retried writes.
+
+Clients send ``Idempotency-Key: <uuid>`` with a write. The first response for
+a key is stored in ``IdempotencyKey``; a retry with the same key gets that
+response back (marked ``Idempotent-Replayed: true``) without running the
+view again.
+
+The key's row is inserted in a transaction on the home database that stays
+open while the view runs, and takes the response before it commits. A
+duplicate sent while the first is still running, from any worker, waits on
+that row's unique index: once the first commits it replays its response,
+and if the first failed (5xx, or an exception) its claim is rolled back and
+the duplicate runs instead. Without a key, nothing changes.
+
+The view's own writes go in the same transaction when they are on the home
+database. Writes to a station's shard (core.shards) commit just before the
+claim does; only a crash between the two can let a retry write again.
+
+Keys are scoped per endpoint and per caller. Reusing a key with a different
+body is rejected with 422. Keys are kept for ``CORE_IDEMPOTENCY_TTL``
+seconds; ``prune_idempotency_keys`` deletes older ones.
+"""
+
+import hashlib
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, OperationalError, connections, transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+
+from . import shards
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+
+
+def get_ttl():
+    return getattr(settings, 'CORE_IDEMPOTENCY_TTL', 24 * 60 * 60)
+
+
+class _Discard(Exception):
+    """Rolls back the claim of a response that is not kept (5xx, streams)."""
+
+    def __init__(self, response):
+        self.response = response
+
+
+def _caller(request):
+    actor = getattr(request, 'actor', None)
+    if actor is not None:
+        return f'{actor.role}:{actor.user_id}'
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def _replay(stored):
+    response = HttpResponse(bytes(stored.content), status=stored.status, content_type=stored.content_type)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _insert(fields, wait):
+    connection = connections[shards.HOME]
+    with transaction.atomic(using=shards.HOME):
+        if connection.vendor == 'postgresql':
+            # how long to wait for a request still running with this key (SQLite waits its own timeout)
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT set_config('lock_timeout', %s, true)", [f'{int(wait * 1000)}ms'])
+        IdempotencyKey.objects.using(shards.HOME).create(**fields)
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL lock_timeout TO DEFAULT')
+
+
+def _claim(fields, wait):
+    """Inserts the key's row and returns None, or returns the response already stored for it.
+
+    Raises OperationalError when a request with the key is still running after ``wait`` seconds.
+    """
+    keys = IdempotencyKey.objects.using(shards.HOME).filter(
+        scope=fields['scope'], caller=fields['caller'], key=fields['key'])
+    for _attempt in range(2):
+        try:
+            _insert(fields, wait)
+            return None
+        except IntegrityError:
+            stored = keys.first()
+            if stored is not None and stored.created_at >= timezone.now() - timedelta(seconds=get_ttl()):
+                return stored
+            # expired (or pruned meanwhile): the key is free again
+            keys.delete()
+    raise OperationalError(f"could not claim {HEADER} {fields['key']!r}")
+
+
+def idempotent(scope, wait=30):
+    """Replays the stored response for a repeated ``Idempotency-Key``.
+
+    Place it below ``with_actor`` so keys are scoped to the authenticated caller.
+    Responses with a 5xx status are not stored, so those can be retried.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            key = request.headers.get(HEADER)
+            if not key:
+                return view(request, *args, **kwargs)
+            if len(key) > 255:
+                return JsonResponse({'success': False, 'error': f'{HEADER} is too long.'}, status=400)
+
+            fingerprint = hashlib.sha256(request.body).hexdigest()
+            fields = {'scope': scope, 'caller': _caller(request)[:100], 'key': key, 'fingerprint': fingerprint}
+            try:
+                with transaction.atomic(using=shards.HOME):
+                    try:
+                        stored = _claim(fields, wait)
+                    except OperationalError:
+                        return JsonResponse(
+                            {'success': False, 'error': 'A request with this key is still in progress.'}, status=409
+                        )
+                    if stored is not None:
+                        if stored.fingerprint != fingerprint:
+                            return JsonResponse(
+                                {'success': False, 'error': f'{HEADER} was already used with a different request.'},
+                                status=422,
+                            )
+                        return _replay(stored)
+
+                    response = view(request, *args, **kwargs)
+                    if response.status_code >= 500 or response.streaming:
+                        raise _Discard(response)
+                    IdempotencyKey.objects.using(shards.HOME).filter(
+                        scope=scope, caller=fields['caller'], key=key,
+                    ).update(status=response.status_code, content=response.content, content_type=response['Content-Type'])
+                    return response
+            except _Discard as discard:
+                return discard.response
+        return wrapper
+    return decorator
+
+
+def prune():
+    """Deletes keys older than ``CORE_IDEMPOTENCY_TTL``; returns the number removed."""
+    cutoff = timezone.now() - timedelta(seconds=get_ttl())
+    removed, _ = IdempotencyKey.objects.using(shards.HOME).filter(created_at__lt=cutoff).delete()
+    return removed
@@ -0,0 +1,263 @@
+"""
+Database-backed job queue for work that should not run inside a request.
+
+Register a function as a task and enqueue it where the work comes up::
+
+    @jobs.task(queue='audit')
+    def write_audit_log(action_type, description, lto_user_id=None): ...
+
+    write_audit_log.enqueue(action_type='verify_driver', description='...')
+
+The job row is inserted in the caller's transaction, so it only exists if
+the caller's own writes commit. Payloads must be JSON-serialisable keyword
+arguments.
+
+``run_jobs`` workers claim due jobs in batches, highest ``priority`` first,
+then oldest ``run_at``. On Postgres the claim is ``SELECT ... FOR UPDATE SKIP
+LOCKED``, so workers never wait on rows another worker is claiming. Backends
+without SKIP LOCKED (SQLite) first update the queue's ``JobLock`` row, which
+serialises claims instead.
+
+A job that raises is retried after an exponential backoff (``BACKOFF * 2 **
+(attempts - 1)`` seconds, capped at ``MAX_BACKOFF``, with jitter) until
+``max_attempts``; after that it stays behind with status ``failed`` and the
+traceback in ``last_error``. Finished jobs are deleted. A job whose worker
+died is put back once its lease (``LEASE`` seconds) runs out, so tasks must
+be safe to run twice.
+
+The lease of each job in a batch restarts when the worker gets to it. A job
+that waited behind the rest of its batch for longer than the lease may have
+been put back and taken by another worker meanwhile; the first worker then
+skips it instead of running it a second time.
+"""
+
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta
+from functools import update_wrapper
+from importlib import import_module
+
+from django.conf import settings
+from django.db import close_old_connections, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job, JobLock
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BATCH': 10,
+    'POLL_INTERVAL': 1.0,
+    'LEASE': 300,
+    'BACKOFF': 5,
+    'MAX_BACKOFF': 3600,
+}
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'CORE_JOBS', {}))
+    return config
+
+
+_registry = {}
+
+
+class Task:
+    def __init__(self, fn, name, queue, priority, max_attempts):
+        self.fn = fn
+        self.name = name
+        self.queue = queue
+        self.priority = priority
+        self.max_attempts = max_attempts
+        update_wrapper(self, fn)
+
+    def __call__(self, *args, **kwargs):
+        return self.fn(*args, **kwargs)
+
+    def enqueue(self, *, priority=None, run_at=None, using='default', **kwargs):
+        return enqueue(
+            self.name, kwargs, queue=self.queue,
+            priority=self.priority if priority is None else priority,
+            max_attempts=self.max_attempts, run_at=run_at, using=using,
+        )
+
+
+def task(name=None, queue='default', priority=0, max_attempts=5):
+    """Registers the decorated function as a task; adds ``.enqueue(**kwargs)``."""
+    def decorator(fn):
+        registered = Task(fn, name or f'{fn.__module__}.{fn.__name__}', queue, priority, max_attempts)
+        _registry[registered.name] = registered
+        return registered
+    return decorator
+
+
+def get_task(name):
+    if name not in _registry:
+        # tasks register on import; load the module the default name points at
+        module, _, _attr = name.rpartition('.')
+        if module:
+            import_module(module)
+    return _registry[name]
+
+
+def enqueue(task_name, payload=None, queue='default', priority=0, max_attempts=5, run_at=None, using='default'):
+    return Job.objects.using(using).create(
+        task=task_name,
+        payload=payload or {},
+        queue=queue,
+        priority=priority,
+        max_attempts=max_attempts,
+        run_at=run_at or timezone.now(),
+    )
+
+
+def backoff(attempts, base, cap):
+    """Seconds to wait before attempt ``attempts + 1``; half fixed, half random."""
+    delay = min(cap, base * 2 ** max(0, attempts - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def lock_queues(queues, now, using='default'):
+    """Updates the ``JobLock`` row of each queue; inside a transaction this
+    serialises work on those queues where SKIP LOCKED is not available."""
+    for queue in sorted(queues):
+        if not JobLock.objects.using(using).filter(queue=queue).update(held_at=now):
+            JobLock.objects.using(using).get_or_create(queue=queue, defaults={'held_at': now})
+
+
+def claim(queues, worker, batch, using='default'):
+    """Marks up to ``batch`` due jobs as running for ``worker`` and returns them."""
+    now = timezone.now()
+    skip_locked = connections[using].features.has_select_for_update_skip_locked
+    with transaction.atomic(using=using):
+        if not skip_locked:
+            # writing first takes SQLite's database lock before the read, so
+            # two claims cannot pick the same rows
+            lock_queues(queues, now, using)
+        due = (
+            Job.objects.using(using)
+            .filter(queue__in=queues, status=Job.QUEUED, run_at__lte=now)
+            .order_by('-priority', 'run_at', 'id')
+            .only('id', 'task', 'payload', 'attempts', 'max_attempts', 'run_at')
+        )
+        if skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        jobs = list(due[:batch])
+        if jobs:
+            Job.objects.using(using).filter(pk__in=[job.pk for job in jobs]).update(
+                status=Job.RUNNING, locked_by=worker, locked_at=now, attempts=F('attempts') + 1,
+            )
+    for job in jobs:
+        job.status = Job.RUNNING
+        job.locked_by = worker
+        job.locked_at = now
+        job.attempts += 1
+    return jobs
+
+
+def renew(job, using='default'):
+    """Restarts the lease of a claimed job; False when it is no longer ``job.locked_by``'s."""
+    now = timezone.now()
+    if not Job.objects.using(using).filter(pk=job.pk, status=Job.RUNNING, locked_by=job.locked_by).update(locked_at=now):
+        return False
+    job.locked_at = now
+    return True
+
+
+def complete(job, using='default'):
+    Job.objects.using(using).filter(pk=job.pk, locked_by=job.locked_by).delete()
+
+
+def fail(job, error, using='default'):
+    config = get_config()
+    mine = Job.objects.using(using).filter(pk=job.pk, locked_by=job.locked_by)
+    if job.attempts >= job.max_attempts:
+        mine.update(status=Job.FAILED, last_error=error, locked_by='', locked_at=None)
+        return False
+    retry_at = timezone.now() + timedelta(seconds=backoff(job.attempts, config['BACKOFF'], config['MAX_BACKOFF']))
+    mine.update(status=Job.QUEUED, run_at=retry_at, last_error=error, locked_by='', locked_at=None)
+    return True
+
+
+def requeue_stale(lease, using='default'):
+    """Puts back jobs whose worker has held them longer than ``lease`` seconds."""
+    now = timezone.now()
+    stale = Job.objects.using(using).filter(status=Job.RUNNING, locked_at__lt=now - timedelta(seconds=lease))
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.FAILED, last_error='Worker lease expired.', locked_by='', locked_at=None)
+    requeued = stale.update(status=Job.QUEUED, run_at=now, locked_by='', locked_at=None)
+    return requeued + failed
+
+
+class Worker:
+    """Claims and runs jobs from ``queues`` until stopped.
+
+    ``on_finish(job, ok, wait)`` is called after every job, with ``wait`` the
+    seconds between the job becoming due and starting.
+    """
+
+    def __init__(self, queues, batch=None, poll_interval=None, name=None, using='default', on_finish=None):
+        config = get_config()
+        self.queues = list(queues)
+        self.batch = batch or config['BATCH']
+        self.poll_interval = config['POLL_INTERVAL'] if poll_interval is None else poll_interval
+        self.lease = config['LEASE']
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}'
+        self.using = using
+        self.on_finish = on_finish
+        self.processed = 0
+        self.failed = 0
+        self._stop = threading.Event()
+        self._last_requeue = 0.0
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self, burst=False, max_jobs=None):
+        """Runs until ``stop()``; with ``burst``, also stops once no job is due."""
+        while not self._stop.is_set():
+            if max_jobs is not None and self.processed + self.failed >= max_jobs:
+                break
+            if not self.run_once() and (burst or self._stop.wait(self.poll_interval)):
+                break
+
+    def run_once(self):
+        # between batches, as Django does between requests
+        close_old_connections()
+        if time.monotonic() - self._last_requeue > self.lease / 4:
+            self._last_requeue = time.monotonic()
+            requeue_stale(self.lease, self.using)
+        jobs = claim(self.queues, self.name, self.batch, self.using)
+        for job in jobs:
+            self.execute(job)
+        return len(jobs)
+
+    def execute(self, job):
+        if not renew(job, self.using):
+            logger.warning("job lease lost before it ran", extra={'job_id': job.pk, 'task': job.task})
+            return
+        wait = (timezone.now() - job.run_at).total_seconds()
+        try:
+            get_task(job.task)(**job.payload)
+        except Exception:
+            error = traceback.format_exc()
+            retrying = fail(job, error, self.using)
+            self.failed += 1
+            logger.warning(
+                "job failed", extra={'job_id': job.pk, 'task': job.task, 'attempt': job.attempts, 'retrying': retrying},
+                exc_info=True,
+            )
+            ok = False
+        else:
+            complete(job, self.using)
+            self.processed += 1
+            ok = True
+        if self.on_finish is not None:
+            self.on_finish(job, ok, wait)
@@ -0,0 +1,152 @@
+"""
+Structured logging for the core app.
+
+Records from the ``core`` loggers go through ``BackgroundQueueHandler``: the
+request thread only runs the cheap filters (sampling, redaction) and puts the
+record on a bounded queue, and a background listener thread does the JSON
+formatting and the actual write. When the queue is full the record is dropped
+instead of blocking the request.
+"""
+
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# attributes every LogRecord has; anything else came in through ``extra``
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+REDACTED = '[redacted]'
+DEFAULT_REDACT_KEYS = ('password', 'license_img', 'body', 'authorization', 'cookie', 'token')
+
+
+def _redact(value, keys):
+    if isinstance(value, dict):
+        return {
+            k: REDACTED if isinstance(k, str) and k.lower() in keys else _redact(v, keys)
+            for k, v in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return type(value)(_redact(v, keys) for v in value)
+    return value
+
+
+class RedactFilter(logging.Filter):
+    """Masks sensitive keys in ``extra`` fields and dict log arguments."""
+
+    def __init__(self, keys=DEFAULT_REDACT_KEYS):
+        super().__init__()
+        self.keys = frozenset(k.lower() for k in keys)
+
+    def filter(self, record):
+        for attr, value in list(vars(record).items()):
+            if attr in _RECORD_ATTRS:
+                continue
+            if attr.lower() in self.keys:
+                setattr(record, attr, REDACTED)
+            elif isinstance(value, (dict, list, tuple)):
+                setattr(record, attr, _redact(value, self.keys))
+        if isinstance(record.args, (dict, tuple)) and record.args:
+            record.args = _redact(record.args, self.keys)
+        return True
+
+
+class SampleFilter(logging.Filter):
+    """Keeps a fraction of records per logger name.
+
+    ``rates`` maps logger names to the fraction kept; the longest matching
+    prefix wins. Records at WARNING and above are never sampled away.
+    """
+
+    def __init__(self, rates=None, always_level=logging.WARNING):
+        super().__init__()
+        self.rates = sorted((rates or {}).items(), key=lambda item: -len(item[0]))
+        self.always_level = always_level
+
+    def rate_for(self, name):
+        for prefix, rate in self.rates:
+            if name == prefix or name.startswith(prefix + '.'):
+                return rate
+        return 1.0
+
+    def filter(self, record):
+        if record.levelno >= self.always_level:
+            return True
+        rate = self.rate_for(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line, including anything passed via ``extra``."""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for attr, value in vars(record).items():
+            if attr not in _RECORD_ATTRS:
+                entry[attr] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class BackgroundQueueHandler(QueueHandler):
+    """Hands records to a listener thread that writes them to ``stream``.
+
+    Unlike the stdlib ``QueueHandler`` this does not format the message in
+    the calling thread; only tracebacks are rendered eagerly, since they
+    reference frames that may be gone by the time the listener runs.
+    """
+
+    def __init__(self, stream=None, maxsize=10000):
+        super().__init__(queue.Queue(maxsize))
+        self.target = logging.StreamHandler(stream or sys.stdout)
+        self.listener = QueueListener(self.queue, self.target, respect_handler_level=True)
+        self.dropped = 0
+        self._started = False
+        self._start_lock = threading.Lock()
+
+    def setFormatter(self, fmt):
+        # formatting happens on the listener side
+        self.target.setFormatter(fmt)
+
+    def start(self):
+        with self._start_lock:
+            if not self._started:
+                self.listener.start()
+                self._started = True
+                atexit.register(self.stop)
+
+    def stop(self):
+        with self._start_lock:
+            if self._started:
+                self.listener.stop()
+                self._started = False
+
+    def prepare(self, record):
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def emit(self, record):
+        if not self._started:
+            self.start()
+        super().emit(record)
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import fees
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the fee of every ticket from the violation type fee schedules and reports "
+        "details and totals that do not match (see core/fees.py)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help="Tickets read per query.")
+        parser.add_argument('--show', type=int, default=20, help="Mismatches to list.")
+        parser.add_argument('--fail', action='store_true', help="Exit with an error if anything does not match.")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        result = fees.audit(chunk_size=options['chunk_size'], keep=options['show'])
+        elapsed = time.perf_counter() - started
+        counts = result['counts']
+
+        self.stdout.write(
+            f"checked {counts['tickets']} tickets ({counts['undated']} without an issue time) and "
+            f"{counts['details']} details in {elapsed:.2f}s"
+        )
+        for finding in result['findings']:
+            self.stdout.write('  ' + ' '.join(f'{key}={value}' for key, value in finding.items()))
+        mismatches = {kind: counts[kind] for kind in ('fee', 'total', 'untyped', 'unknown_type') if counts[kind]}
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS("all fees match the schedule"))
+            return
+        summary = ', '.join(f'{count} {kind}' for kind, count in mismatches.items())
+        if options['fail']:
+            raise CommandError(f"fee mismatches: {summary}")
+        self.stdout.write(self.style.WARNING(f"fee mismatches: {summary}"))
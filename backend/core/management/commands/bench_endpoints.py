@@ -0,0 +1,420 @@
+import json
+import logging
+import random
+import statistics
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from core import benchdata
+from core.tokens import issue_token
+from core.urls import urlpatterns
+
+DEFAULT_BASELINE = Path(settings.BASE_DIR) / 'benchmarks' / 'endpoints_baseline.json'
+
+
+def _json(data, **kwargs):
+    return {'data': json.dumps(data), 'content_type': 'application/json', **kwargs}
+
+
+def _calibration_work():
+    rows = [{'id': i, 'name': f'driver {i}', 'fee': i * 1.5} for i in range(2000)]
+    json.loads(json.dumps(rows))
+    return sorted(str(i) for i in range(20000))
+
+
+def calibrate(rounds=5):
+    """Milliseconds this machine takes for a fixed piece of Python work, right now.
+
+    Timings are compared with the baseline in units of this, so a slower
+    machine, or a busy one, is not reported as a regression.
+    """
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        _calibration_work()
+        timings.append((time.perf_counter() - started) * 1000)
+    return min(timings)
+
+
+class QueryCounter:
+    """Counts the queries of every connection, including those shards.fan_out opens on its threads."""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self, sender=None, connection=None, **kwargs):
+        # a reconnect sends connection_created again for the same wrapper
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+class Scenarios:
+    """One request builder per URL name in core/urls.py.
+
+    Each builder gets the request index and returns ``(method, kwargs)`` for
+    the test client. Endpoints that cannot be driven as plain request/response
+    go in ``SKIPPED`` with the reason.
+    """
+
+    SKIPPED = {
+        'event_stream': "long-lived server-sent events stream; see loadtest_sse",
+    }
+
+    def __init__(self, context, rng):
+        self.ctx = context
+        self.rng = rng
+        self.volumes = context['volumes']
+
+    def auth(self, role, user_id):
+        return {'Authorization': f'Bearer {issue_token(role, user_id)}'}
+
+    def driver_id(self):
+        return self.rng.randint(1, self.volumes.drivers)
+
+    def violation_id(self):
+        # ids on a station shard start at the shard's range (core.shards)
+        return self.rng.choice(self.ctx['violation_ids'])
+
+    def hello_world(self, i):
+        return 'get', {}
+
+    def universal_login(self, i):
+        # drivers are checked first, admins last: log in as an admin to hit every table
+        n = self.rng.randint(1, self.volumes.admins)
+        return 'post', _json({'username': f'admin{n}', 'password': f'pass{n}'})
+
+    def logout(self, i):
+        return 'post', _json({}, headers=self.auth('driver', self.driver_id()))
+
+    def change_password(self, i):
+        # to the same password, so universal_login's credentials keep working
+        n = self.driver_id()
+        return 'post', _json(
+            {'current_password': f'pass{n}', 'new_password': f'pass{n}'}, headers=self.auth('driver', n))
+
+    def get_driver_details(self, i):
+        n = self.driver_id()
+        return 'post', _json({'driver_user_id': n}, headers=self.auth('driver', n))
+
+    def driver_penalties(self, i):
+        n = self.driver_id()
+        return 'post', _json({'driver_user_id': n}, headers=self.auth('driver', n))
+
+    def register_driver(self, i):
+        n = f'{time.time_ns()}{i}'
+        return 'post', _json({
+            'username': f'bench{n}', 'password': 'pass', 'full_name': f'Bench Driver {n}',
+            'email': f'bench{n}@example.com', 'phone_number': '09170000000',
+            'license_number': f'B{n}', 'birthday': '1990-01-01',
+        })
+
+    def officer_id(self):
+        return self.rng.randint(1, self.volumes.officers)
+
+    def get_officer_details(self, i):
+        n = self.officer_id()
+        return 'post', _json({'officer_user_id': n}, headers=self.auth('officer', n))
+
+    def get_next_violation_id(self, i):
+        return 'get', {'headers': self.auth('officer', self.officer_id())}
+
+    def verify_driver(self, i):
+        n = self.driver_id()
+        return 'post', _json({'full_name': f'Driver {n}', 'license_number': f'N{n:09d}'},
+                             headers=self.auth('officer', self.officer_id()))
+
+    def register_violation(self, i):
+        n = self.driver_id()
+        return 'post', _json({
+            'driver_name': f'Driver {n}', 'license_number': f'N{n:09d}', 'address': 'EDSA, Quezon City',
+            'platenumber': 'ABC 1234', 'vehicle_type': 'Sedan', 'car_name': 'Toyota Vios',
+            'vehicle_color': 'White', 'notes': 'benchmark',
+            'latitude': 14.6 + self.rng.uniform(-0.05, 0.05), 'longitude': 121.0 + self.rng.uniform(-0.05, 0.05),
+            'violations': [{'violation_type': self.rng.randint(1, 5), 'fee_at_time': '500.00'}],
+        }, headers={
+            # as the app sends it
+            **self.auth('officer', self.officer_id()), 'Idempotency-Key': f'bench-{i}',
+        })
+
+    def violation_hotspots(self, i):
+        # Metro Manila over the last week
+        return 'get', {
+            'data': {'south': 14.4, 'west': 120.9, 'north': 14.8, 'east': 121.2},
+            'headers': self.auth('officer', self.officer_id()),
+        }
+
+    def get_violation_types(self, i):
+        return 'get', {'headers': self.auth('officer', self.officer_id())}
+
+    def submit_payment(self, i):
+        violation_id = self.violation_id()
+        driver_id = self.ctx['violation_driver'][violation_id]
+        return 'post', _json({
+            'violation_id': violation_id,
+            'driver_user_id': driver_id,
+            'payment_type': 'GCash', 'amount_paid': '500.00',
+            'transaction_ref': f'BENCH-{time.time_ns()}-{i}',
+        }, headers={**self.auth('driver', driver_id), 'Idempotency-Key': f'BENCH-{time.time_ns()}-{i}'})
+
+    def get_driver_payments(self, i):
+        n = self.driver_id()
+        return 'post', _json({'driver_user_id': n}, headers=self.auth('driver', n))
+
+    def lto_admin_details(self, i):
+        n = self.rng.randint(1, self.volumes.admins)
+        return 'post', _json({'user_id': n}, headers=self.auth('admin', n))
+
+    def lto_admin_audit_logs(self, i):
+        n = self.rng.randint(1, self.volumes.admins)
+        return 'post', _json({'user_id': n}, headers=self.auth('admin', n))
+
+    def verify_driver_admin(self, i):
+        return 'post', _json({'driver_user_id': self.driver_id()}, headers=self.admin_auth())
+
+    def driver_users(self, i):
+        return 'get', {'headers': self.admin_auth()}
+
+    def payments(self, i):
+        return 'get', {'headers': self.admin_auth()}
+
+    def change_feed(self, i):
+        # an admin console that last synced a few hundred writes ago
+        return 'get', {'data': {'cursor': max(0, self.ctx['change_head'] - 300)}, 'headers': self.admin_auth()}
+
+    def update_license_expiry(self, i):
+        return 'post', _json({'driver_user_id': self.driver_id(), 'license_expiry': '2030-01-01'},
+                             headers=self.admin_auth())
+
+    def update_payment_status(self, i):
+        return 'post', _json({'payment_id': self.rng.choice(self.ctx['payment_ids']), 'status': 'completed'},
+                             headers=self.admin_auth())
+
+    def admin_auth(self):
+        return self.auth('admin', self.rng.randint(1, self.volumes.admins))
+
+    def claim_payments(self, i):
+        return 'post', _json({'limit': 10}, headers=self.admin_auth())
+
+    def release_payments(self, i):
+        return 'post', _json({}, headers=self.admin_auth())
+
+    def review_queue(self, i):
+        return 'get', {'headers': self.admin_auth()}
+
+    def profile_cache_stats(self, i):
+        return 'get', {'headers': self.admin_auth()}
+
+    def station_report(self, i):
+        # an admin paging through recent months: the first request of a month builds it, later ones read its file
+        month = date.today().replace(day=1)
+        for _ in range(1 + i % 6):
+            month = (month - timedelta(days=1)).replace(day=1)
+        return 'get', {
+            'data': {
+                'station': self.rng.choice(self.ctx['officer_stations']),
+                'month': f'{month:%Y-%m}', 'format': ('csv', 'html')[i % 2],
+            },
+            'headers': self.admin_auth(),
+        }
+
+    def search(self, i):
+        # alternate a driver's license prefix with a plate-like prefix and a street
+        queries = [f'N{self.rng.randint(1, self.volumes.drivers):09d}'[:7], 'TA 12', 'taft manila']
+        return 'get', {'data': {'q': queries[i % 3]}, 'headers': self.admin_auth()}
+
+
+class Command(BaseCommand):
+    CALIBRATE_EVERY = 10
+
+    help = (
+        "Builds a throwaway database with synthetic data, drives every core endpoint through the "
+        "test client and compares latency percentiles and query counts with a stored baseline. "
+        "Fails on any answer other than 2xx."
+    )
+
+    def add_arguments(self, parser):
+        for name, default in vars(benchdata.Volumes()).items():
+            parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=default)
+        parser.add_argument('--requests', type=int, default=50, help="Requests per endpoint.")
+        parser.add_argument('--only', nargs='*', help="Only run these URL names.")
+        parser.add_argument('--baseline', default=str(DEFAULT_BASELINE))
+        parser.add_argument('--update-baseline', action='store_true')
+        parser.add_argument('--threshold', type=float, default=0.5,
+                            help="Allowed relative regression of the calibrated median before failing (default 0.5). "
+                                 "Query counts may not grow at all.")
+        parser.add_argument('--keepdb', action='store_true', help="Reuse the seeded test database.")
+        parser.add_argument('--seed', type=int, default=1234)
+
+    def handle(self, *args, **options):
+        volumes = benchdata.Volumes(**{name: options[name] for name in vars(benchdata.Volumes())})
+        names = [p.name for p in urlpatterns]
+        if options['only']:
+            unknown = set(options['only']) - set(names)
+            if unknown:
+                raise CommandError(f"Unknown URL names: {', '.join(sorted(unknown))}")
+            names = [n for n in names if n in options['only']]
+        missing = [n for n in names if n not in Scenarios.SKIPPED and not hasattr(Scenarios, n)]
+        if missing:
+            raise CommandError(f"No benchmark scenario for: {', '.join(missing)}")
+
+        if options['verbosity'] < 2:
+            # keep per-request log lines out of the report
+            logging.getLogger('core').setLevel(logging.WARNING)
+        setup_test_environment()
+        # measure the endpoints, not the rate limiter (see loadtest_admission for that)
+        no_limits = override_settings(CORE_RATE_LIMITS={}, CORE_ADMISSION={})
+        no_limits.enable()
+        # report files of the throwaway database must not land in the real reports directory
+        report_dir = tempfile.TemporaryDirectory()
+        reports_dir = override_settings(CORE_REPORTS={**getattr(settings, 'CORE_REPORTS', {}), 'DIR': report_dir.name})
+        reports_dir.enable()
+        old_name = benchdata.setup_database(keepdb=options['keepdb'])
+        counter = QueryCounter()
+        connection_created.connect(counter.install)
+        try:
+            if options['keepdb'] and benchdata.DriverUser.objects.exists():
+                context = benchdata.load_context()
+            else:
+                started = time.perf_counter()
+                context = benchdata.seed(volumes, seed=options['seed'], log=self.stdout.write)
+                self.stdout.write(f"seeded in {time.perf_counter() - started:.1f}s")
+            results = self.run_scenarios(names, context, counter, options)
+        finally:
+            connection_created.disconnect(counter.install)
+            benchdata.teardown_database(old_name, keepdb=options['keepdb'])
+            reports_dir.disable()
+            report_dir.cleanup()
+            no_limits.disable()
+            teardown_test_environment()
+
+        self.report(results)
+        self.check_statuses(results)
+        self.compare(results, options)
+
+    def run_scenarios(self, names, context, counter, options):
+        scenarios = Scenarios(context, random.Random(options['seed']))
+        client = Client()
+        for connection in connections.all(initialized_only=True):
+            counter.install(connection=connection)
+        results = {}
+        for name in names:
+            if name in Scenarios.SKIPPED:
+                self.stdout.write(f"skipping {name}: {Scenarios.SKIPPED[name]}")
+                continue
+            build = getattr(scenarios, name)
+            url = reverse(name)
+            timings, queries, statuses = [], [], {}
+            # machine speed drifts during a batch: calibrate around every few requests
+            calibrations, block = [calibrate()], []
+            normalized = []
+            for i in range(options['requests']):
+                method, kwargs = build(i)
+                counter.count = 0
+                started = time.perf_counter()
+                response = getattr(client, method)(url, **kwargs)
+                if response.streaming:
+                    # streamed and file responses do their work while being read
+                    b''.join(response.streaming_content)
+                timings.append((time.perf_counter() - started) * 1000)
+                block.append(timings[-1])
+                queries.append(counter.count)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                if len(block) == self.CALIBRATE_EVERY or i == options['requests'] - 1:
+                    calibrations.append(calibrate())
+                    unit = (calibrations[-2] + calibrations[-1]) / 2
+                    normalized.extend(ms / unit for ms in block)
+                    block = []
+            timings.sort()
+            normalized.sort()
+            results[name] = {
+                'requests': len(timings),
+                'calibration_ms': round(statistics.mean(calibrations), 3),
+                # the median in units of calibrate(), which is what is compared with the baseline;
+                # a p90 of 50 requests moves with every scheduler hiccup
+                'p50_units': round(self.percentile(normalized, 50), 4),
+                'p50_ms': round(self.percentile(timings, 50), 3),
+                'p90_ms': round(self.percentile(timings, 90), 3),
+                'p99_ms': round(self.percentile(timings, 99), 3),
+                'max_ms': round(timings[-1], 3),
+                'queries': int(statistics.median(queries)),
+                'max_queries': max(queries),
+                'statuses': {str(k): v for k, v in sorted(statuses.items())},
+            }
+        return results
+
+    @staticmethod
+    def percentile(sorted_values, pct):
+        if len(sorted_values) == 1:
+            return sorted_values[0]
+        k = (len(sorted_values) - 1) * pct / 100
+        lo = int(k)
+        hi = min(lo + 1, len(sorted_values) - 1)
+        return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+    def report(self, results):
+        self.stdout.write(f"{'endpoint':<26}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'queries':>9}  statuses")
+        for name, r in results.items():
+            self.stdout.write(
+                f"{name:<26}{r['p50_ms']:>9.2f}{r['p90_ms']:>9.2f}{r['p99_ms']:>9.2f}{r['queries']:>9}  {r['statuses']}"
+            )
+
+    def check_statuses(self, results):
+        # an endpoint answering errors is fast for the wrong reason; it never passes, or becomes a baseline
+        failed = [
+            f"{name}: {', '.join(f'{count} x {status}' for status, count in r['statuses'].items() if not status.startswith('2'))}"
+            for name, r in results.items()
+            if any(not status.startswith('2') for status in r['statuses'])
+        ]
+        if failed:
+            raise CommandError("Endpoints answered with errors:\n  " + "\n  ".join(failed))
+
+    def compare(self, results, options):
+        path = Path(options['baseline'])
+        if options['update_baseline']:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            baseline = json.loads(path.read_text()) if path.exists() else {}
+            baseline.update(results)
+            path.write_text(json.dumps(baseline, indent=2, sort_keys=True) + '\n')
+            self.stdout.write(f"baseline written to {path}")
+            return
+        if not path.exists():
+            self.stdout.write(f"no baseline at {path}; run with --update-baseline to create one")
+            return
+
+        baseline = json.loads(path.read_text())
+        threshold = options['threshold']
+        regressions = []
+        for name, r in results.items():
+            base = baseline.get(name)
+            if not base:
+                self.stdout.write(f"{name}: not in the baseline; run with --update-baseline to add it")
+                continue
+            if r['p50_units'] > base['p50_units'] * (1 + threshold):
+                # the baseline's median as it would have been on this machine, at this run's speed
+                expected = base['p50_units'] * r['calibration_ms']
+                regressions.append(
+                    f"{name}: p50 {r['p50_ms']:.2f}ms, baseline {base['p50_ms']:.2f}ms "
+                    f"({expected:.2f}ms at this run's machine speed)"
+                )
+            if r['queries'] > base['queries']:
+                regressions.append(f"{name}: {r['queries']} queries vs baseline {base['queries']}")
+        if regressions:
+            raise CommandError("Regressions against baseline:\n  " + "\n  ".join(regressions))
+        self.stdout.write(self.style.SUCCESS("no regressions against baseline"))
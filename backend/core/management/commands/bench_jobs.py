@@ -0,0 +1,121 @@
+import multiprocessing
+import random
+import statistics
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import override_settings
+from django.utils import timezone
+
+from core import jobs
+from core.models import Job
+
+QUEUE = 'bench'
+NOOP = 'core.management.commands.bench_jobs.noop'
+
+
+@jobs.task(name=NOOP, queue=QUEUE)
+def noop(work_ms=0, fail_rate=0.0):
+    if work_ms:
+        time.sleep(work_ms / 1000)
+    if fail_rate and random.random() < fail_rate:
+        raise RuntimeError("injected failure")
+
+
+def worker_main(batch, stop, results):
+    # runs in a forked process, with Django already set up
+    waits = []
+    worker = jobs.Worker([QUEUE], batch=batch, poll_interval=0.01,
+                         on_finish=lambda job, ok, wait: waits.append(wait))
+    threading.Thread(target=lambda: (stop.wait(), worker.stop()), daemon=True).start()
+    worker.run()
+    results.put({'name': worker.name, 'processed': worker.processed, 'failed': worker.failed, 'waits': waits})
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures job queue throughput and latency with several worker processes claiming from the "
+        "configured database. Uses its own queue ('bench') and removes its jobs afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--jobs', type=int, default=2000)
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--batch', type=int, default=10)
+        parser.add_argument('--work-ms', type=float, default=0.0, help="Time each job sleeps.")
+        parser.add_argument('--rate', type=float, default=0.0,
+                            help="Jobs enqueued per second while workers run (0: all up front, measures drain throughput).")
+        parser.add_argument('--fail-rate', type=float, default=0.0, help="Fraction of attempts that raise.")
+        parser.add_argument('--timeout', type=float, default=300.0)
+
+    def handle(self, *args, **options):
+        if Job.objects.filter(queue=QUEUE).exists():
+            raise CommandError(f"Queue {QUEUE!r} is not empty; remove its jobs first.")
+        payload = {'work_ms': options['work_ms'], 'fail_rate': options['fail_rate']}
+        total = options['jobs']
+
+        if not options['rate']:
+            now = timezone.now()
+            Job.objects.bulk_create(
+                [Job(task=NOOP, queue=QUEUE, payload=payload, priority=i % 3, run_at=now) for i in range(total)],
+                batch_size=1000,
+            )
+
+        # forked children must not share the parent's connections
+        connections.close_all()
+        ctx = multiprocessing.get_context('fork')
+        stop = ctx.Event()
+        results = ctx.Queue()
+        processes = [
+            ctx.Process(target=worker_main, args=(options['batch'], stop, results))
+            for _ in range(options['workers'])
+        ]
+        started = time.perf_counter()
+        # retries come back quickly so a run with --fail-rate finishes
+        with override_settings(CORE_JOBS={**jobs.get_config(), 'BACKOFF': 0.05, 'MAX_BACKOFF': 0.5}):
+            for process in processes:
+                process.start()
+
+        try:
+            if options['rate']:
+                for i in range(total):
+                    jobs.enqueue(NOOP, payload, queue=QUEUE, priority=i % 3)
+                    time.sleep(1 / options['rate'])
+            deadline = time.monotonic() + options['timeout']
+            while time.monotonic() < deadline:
+                if not Job.objects.filter(queue=QUEUE).exclude(status=Job.FAILED).exists():
+                    break
+                time.sleep(0.05)
+            elapsed = time.perf_counter() - started
+        finally:
+            stop.set()
+            reports = [results.get(timeout=60) for _ in processes]
+            for process in processes:
+                process.join()
+            left = Job.objects.filter(queue=QUEUE).count()
+            gave_up = Job.objects.filter(queue=QUEUE, status=Job.FAILED).count()
+            Job.objects.filter(queue=QUEUE).delete()
+
+        self.report(reports, elapsed, left, gave_up, options)
+
+    def report(self, reports, elapsed, left, gave_up, options):
+        processed = sum(r['processed'] for r in reports)
+        failed = sum(r['failed'] for r in reports)
+        waits = sorted(w * 1000 for r in reports for w in r['waits'])
+        vendor = connections['default'].vendor
+        self.stdout.write(
+            f"{options['jobs']} jobs, {options['workers']} workers, batch {options['batch']} on {vendor}: "
+            f"{processed} done in {elapsed:.2f}s ({processed / elapsed:.0f} jobs/s)"
+        )
+        self.stdout.write(f"failed attempts {failed} (retried), gave up {gave_up}, left unfinished {left - gave_up}")
+        for r in reports:
+            self.stdout.write(f"  {r['name']}: {r['processed']} done, {r['failed']} failed")
+        if waits:
+            p99 = waits[min(len(waits) - 1, int(len(waits) * 0.99))]
+            self.stdout.write(
+                f"wait from due to start: p50 {statistics.median(waits):.1f}ms  p99 {p99:.1f}ms  max {waits[-1]:.1f}ms"
+            )
+        if processed > options['jobs']:
+            self.stderr.write(self.style.ERROR("more completions than jobs: a job was claimed twice"))
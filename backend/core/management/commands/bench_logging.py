@@ -0,0 +1,107 @@
+import contextlib
+import json
+import logging
+import os
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+
+from core.log import BackgroundQueueHandler, JSONFormatter, RedactFilter, SampleFilter
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the per-request logging cost of the old print() debugging with the queued JSON logger, "
+        "both on every request and both sampled at --sample-rate."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20000)
+        parser.add_argument('--sample-rate', type=float, default=0.01,
+                            help="Fraction of DEBUG records kept by the sampled logger.")
+        parser.add_argument('--output', default=os.devnull,
+                            help="Where both variants write (default: /dev/null).")
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        body = {'driver_user_id': 42, 'password': 'secret', 'license_img': 'data:image/png;base64,' + 'A' * 2000}
+        request = RequestFactory().post(
+            '/api/driver/details/', data=json.dumps(body), content_type='application/json',
+            HTTP_USER_AGENT='bench', HTTP_AUTHORIZATION='Bearer x',
+        )
+
+        rate = options['sample_rate']
+        with open(options['output'], 'w') as out:
+            def print_lines(data):
+                # what get_driver_details/verify_driver_admin used to do per call
+                with contextlib.redirect_stdout(out):
+                    print("Method:", request.method)
+                    print("Headers:", request.headers)
+                    print("Body:", request.body)
+                    print("Parsed data:", data)
+                    print("driver_user_id:", data.get('driver_user_id'))
+
+            def print_request():
+                print_lines(json.loads(request.body))
+
+            def print_sampled():
+                data = json.loads(request.body)
+                if random.random() < rate:
+                    print_lines(data)
+
+            # one handler for both loggers; only the sampled one is sampled
+            parent = logging.getLogger('core.bench_logging')
+            parent.propagate = False
+            handler = BackgroundQueueHandler(stream=out)
+            handler.setFormatter(JSONFormatter())
+            handler.addFilter(SampleFilter({'core.bench_logging.sampled': rate}))
+            handler.addFilter(RedactFilter())
+            parent.addHandler(handler)
+            every, sampled = logging.getLogger('core.bench_logging.every'), logging.getLogger('core.bench_logging.sampled')
+            for logger in (every, sampled):
+                logger.setLevel(logging.DEBUG)
+
+            def log_request(logger):
+                data = json.loads(request.body)
+                logger.debug("get_driver_details", extra={'driver_user_id': data.get('driver_user_id')})
+
+            def parse_only():
+                json.loads(request.body)
+
+            # (name, the print variant it is compared with, seconds, records dropped)
+            results = []
+
+            def run(name, fn, against=None):
+                dropped = handler.dropped
+                results.append((name, against, self.time_it(fn, iterations), handler.dropped - dropped))
+
+            try:
+                run('no logging (parse only)', parse_only)
+                # each logger is compared with print at the same rate
+                run('print, every request', print_request)
+                run('queued json, every request', lambda: log_request(every), against='print, every request')
+                run(f'print, sampled {rate:g}', print_sampled)
+                run(f'queued json, sampled {rate:g}', lambda: log_request(sampled), against=f'print, sampled {rate:g}')
+            finally:
+                parent.removeHandler(handler)
+                handler.stop()
+
+        seconds_of = {name: seconds for name, _against, seconds, _dropped in results}
+        self.stdout.write(f"{'variant':<32}{'us/request':>12}{'vs print':>10}")
+        for name, against, seconds, dropped in results:
+            ratio = f"{seconds / seconds_of[against]:.2f}x" if against else ''
+            line = f"{name:<32}{seconds / iterations * 1e6:>12.2f}{ratio:>10}"
+            if dropped:
+                # dropped records were never formatted or written, so the time is flattering
+                line += f"  ({dropped} records dropped on full queue)"
+            self.stdout.write(line)
+
+    def time_it(self, fn, iterations):
+        for _ in range(min(iterations, 500)):
+            fn()
+        start = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        return time.perf_counter() - start
@@ -0,0 +1,127 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from core import benchdata, search, shards
+from core.management.commands.bench_endpoints import Command as BenchEndpoints
+from core.models import DriverUser, SearchDocument, Violation, ViolationDetail
+
+percentile = BenchEndpoints.percentile
+
+
+class Command(BaseCommand):
+    help = (
+        "Builds a throwaway database with synthetic drivers and violations (a million search documents "
+        "by default) and measures index rebuild throughput, query latency per kind of query, and the "
+        "cost of keeping the index up to date on writes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drivers', type=int, default=200000)
+        parser.add_argument('--violations', type=int, default=800000)
+        parser.add_argument('--queries', type=int, default=200, help="Queries per kind.")
+        parser.add_argument('--writes', type=int, default=200, help="Driver and violation writes to time.")
+        parser.add_argument('--seed', type=int, default=1234)
+        parser.add_argument('--keepdb', action='store_true')
+
+    def handle(self, *args, **options):
+        volumes = benchdata.Volumes(
+            drivers=options['drivers'], violations=options['violations'], details=options['violations'],
+            payments=1000, audit_logs=1000, changes=1000,
+        )
+        setup_test_environment()
+        old_name = benchdata.setup_database(keepdb=options['keepdb'])
+        try:
+            if not (options['keepdb'] and DriverUser.objects.exists()):
+                started = time.perf_counter()
+                benchdata.seed(volumes, seed=options['seed'], log=self.stdout.write)
+                self.stdout.write(f"seeded in {time.perf_counter() - started:.1f}s")
+            connection = connections['default']
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute('ANALYZE')
+            self.bench_rebuild()
+            self.bench_queries(random.Random(options['seed']), options['queries'])
+            self.bench_writes(options['writes'])
+        finally:
+            benchdata.teardown_database(old_name, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+    def bench_rebuild(self):
+        started = time.perf_counter()
+        written = search.rebuild()
+        elapsed = time.perf_counter() - started
+        total = sum(written.values())
+        self.stdout.write(
+            f"rebuild: {total} documents in {elapsed:.1f}s ({total / elapsed:.0f} documents/s)")
+
+    def bench_queries(self, rng, n):
+        drivers = DriverUser.objects.count()
+        sampled = shards.fan_out(lambda alias: list(ViolationDetail.objects.values_list('platenumber', flat=True)[:1000]))
+        plates = [plate for _alias, rows in sampled for plate in rows] or ['ABC 1234']
+        kinds = {
+            # one driver by name, the way an admin types it
+            'name': lambda: f'driver {rng.randint(1, drivers)}',
+            # the first digits of a license number
+            'license prefix': lambda: f'N{rng.randint(1, drivers):09d}'[:rng.randint(5, 8)],
+            'plate': lambda: rng.choice(plates),
+            'location': lambda: rng.choice(['taft manila', 'edsa quezon', 'c-5 taguig', 'ortigas pasig']),
+            # matches a large share of the documents: the ranking cost
+            'broad': lambda: rng.choice(['driver', 'toyota', 'towed']),
+        }
+        self.stdout.write(f"{'query':<16}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'hits':>7}")
+        for kind, make in kinds.items():
+            timings, hits = [], []
+            for _ in range(n):
+                query = make()
+                started = time.perf_counter()
+                results, _has_more = search.search(query)
+                timings.append((time.perf_counter() - started) * 1000)
+                hits.append(len(results))
+            timings.sort()
+            self.stdout.write(
+                f"{kind:<16}{percentile(timings, 50):>9.2f}{percentile(timings, 90):>9.2f}"
+                f"{percentile(timings, 99):>9.2f}{statistics.mean(hits):>7.1f}"
+            )
+
+    def bench_writes(self, n):
+        # the reindex runs when the write commits, so a driver is searchable
+        # as soon as the transaction that created it returns
+        first = (DriverUser.objects.order_by('-pk').values_list('pk', flat=True).first() or 0) + 1
+        violation = next(v for _alias, v in shards.fan_out(lambda alias: Violation.objects.order_by('pk').first()) if v)
+        writes, visible, missing = [], [], 0
+        for i in range(first, first + n):
+            name = f'Searchable Person{i}'
+            started = time.perf_counter()
+            with transaction.atomic():
+                DriverUser.objects.create(
+                    driver_user_id=i, username=f'search{i}', password='x', full_name=name,
+                    email=f'search{i}@example.com', license_number=f'S{i:09d}',
+                )
+                written = time.perf_counter()
+            committed = time.perf_counter()
+            writes.append((written - started) * 1000)
+            visible.append((committed - written) * 1000)
+            if not SearchDocument.objects.filter(entity='drivers', entity_id=i).exists():
+                missing += 1
+        location = violation.location
+        started = time.perf_counter()
+        for i in range(n):
+            violation.location = f'{location} {i}'
+            violation.save(update_fields=['location'])
+        per_update = (time.perf_counter() - started) * 1000 / n
+        violation.location = location
+        violation.save(update_fields=['location'])
+
+        writes.sort()
+        visible.sort()
+        self.stdout.write(
+            f"driver insert: p50 {percentile(writes, 50):.2f} ms, p99 {percentile(writes, 99):.2f} ms; "
+            f"commit and reindex: p50 {percentile(visible, 50):.2f} ms, p99 {percentile(visible, 99):.2f} ms; "
+            f"not searchable: {missing}"
+        )
+        self.stdout.write(f"violation update with reindex: {per_update:.2f} ms each")
@@ -0,0 +1,66 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from core import reports
+
+
+def _start_worker():
+    # a no-op when forked; spawned workers (macOS, Windows) set Django up here
+    django.setup()
+    connections.close_all()
+
+
+def _build(station, month, formats):
+    try:
+        return reports.build_and_write(station, month, formats)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = (
+        "Brings the monthly station reports up to date: recomputes the changed days of each station's month "
+        "and, for a finished month, writes its report files. Stations are built in parallel processes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--month', help="YYYY-MM (default: last month).")
+        parser.add_argument('--station', action='append', help="Only this station (repeatable; default: all).")
+        parser.add_argument('--workers', type=int, help="Processes (default: CORE_REPORTS['WORKERS']).")
+        parser.add_argument(
+            '--format', action='append', choices=sorted(reports.FORMATS),
+            help="File format to write (repeatable; default: all).")
+
+    def handle(self, *args, **options):
+        try:
+            month = reports.parse_month(options['month']) if options['month'] else reports.last_month()
+        except ValueError:
+            raise CommandError("--month must be YYYY-MM.")
+        if month > reports.today():
+            raise CommandError("--month is in the future.")
+        workers = options['workers'] or reports.get_config()['WORKERS']
+        if workers < 1:
+            raise CommandError("--workers must be at least 1.")
+        formats = tuple(options['format'] or reports.FORMATS)
+        stations = options['station'] or reports.stations()
+        if not stations:
+            self.stdout.write("No stations.")
+            return
+
+        if workers == 1 or len(stations) == 1:
+            results = (reports.build_and_write(station, month, formats) for station in stations)
+            self._report(results)
+            return
+        # children must not share the parent's database connections
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=min(workers, len(stations)), initializer=_start_worker) as pool:
+            futures = [pool.submit(_build, station, month, formats) for station in stations]
+            self._report(future.result() for future in as_completed(futures))
+
+    def _report(self, results):
+        for station, days, paths in results:
+            self.stdout.write(self.style.SUCCESS(
+                f"{station}: {days} day(s) recomputed" + (f", {', '.join(paths)}" if paths else "")))
@@ -0,0 +1,186 @@
+import random
+import re
+import tempfile
+import threading
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.db.backends.signals import connection_created
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from core import benchdata, shards
+from core.management.commands.bench_endpoints import Scenarios
+from core.urls import urlpatterns
+
+# tables that grow with usage; a sequential scan on any of these is a failure
+LARGE_TABLES = {
+    'driver_user', 'violations', 'violations_details', 'payment', 'audit_log', 'core_change_log', 'core_hotspot_count',
+    'core_search_document', 'core_station_day_total', 'core_idempotency_key',
+}
+
+# endpoints that return a whole table by design
+FULL_SCAN_ALLOWED = {'driver_users', 'payments'}
+
+# statements EXPLAIN can plan without running them; inserts have no plan worth checking
+EXPLAINABLE = re.compile(r'\s*(SELECT|WITH|UPDATE|DELETE)\b', re.IGNORECASE)
+
+
+class StatementRecorder:
+    """Collects the statements run on every connection (shards.fan_out's threads included) while recording."""
+
+    def __init__(self):
+        self.statements = None
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        if self.statements is not None and not many and EXPLAINABLE.match(sql):
+            with self._lock:
+                self.statements.append((context['connection'].alias, sql, params))
+        return execute(sql, params, many, context)
+
+    def install(self, sender=None, connection=None, **kwargs):
+        # a reconnect sends connection_created again for the same wrapper
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+def explain(connection, sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(f"{connection.ops.explain_query_prefix()} {sql}", params)
+        rows = cursor.fetchall()
+    # SQLite returns (id, parent, notused, detail) rows, Postgres one text column
+    return '\n'.join(str(row[-1]) for row in rows)
+
+
+def sequential_scans(connection, plan):
+    """Large tables the plan reads in full."""
+    if connection.vendor == 'postgresql':
+        found = re.findall(r'Seq Scan on (\w+)', plan)
+    elif connection.vendor == 'sqlite':
+        # "SCAN t" is a full scan; "SCAN t USING COVERING INDEX" still reads every row
+        found = re.findall(r'\bSCAN (\w+)', plan)
+    else:
+        raise CommandError(f"Plan checks are not implemented for {connection.vendor}")
+    return sorted(set(found) & LARGE_TABLES)
+
+
+class Command(BaseCommand):
+    help = (
+        "Drives every core endpoint with the bench_endpoints scenarios, records the SQL each one runs on "
+        "each database, and fails when EXPLAIN shows a sequential scan of a large table."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--synthetic', action='store_true',
+                            help="Check against a throwaway database seeded with synthetic data.")
+        parser.add_argument('--requests', type=int, default=4,
+                            help="Requests per endpoint; scenarios vary their parameters between requests.")
+        parser.add_argument('--seed', type=int, default=1234)
+        parser.add_argument('--show-plans', action='store_true')
+
+    def handle(self, *args, **options):
+        missing = [p.name for p in urlpatterns if p.name not in Scenarios.SKIPPED and not hasattr(Scenarios, p.name)]
+        if missing:
+            raise CommandError(f"No bench_endpoints scenario for: {', '.join(missing)}")
+
+        setup_test_environment()
+        # as in bench_endpoints: the endpoints, not the rate limiter; report files in a scratch directory
+        report_dir = tempfile.TemporaryDirectory()
+        overrides = override_settings(
+            CORE_RATE_LIMITS={}, CORE_ADMISSION={},
+            CORE_REPORTS={**getattr(settings, 'CORE_REPORTS', {}), 'DIR': report_dir.name},
+        )
+        overrides.enable()
+        old_names = None
+        try:
+            if options['synthetic']:
+                old_names = benchdata.setup_database()
+                context = benchdata.seed(
+                    benchdata.Volumes(drivers=500, violations=2000, details=4000, payments=1000, audit_logs=1000))
+                for alias in shards.aliases():
+                    if connections[alias].vendor == 'postgresql':
+                        with connections[alias].cursor() as cursor:
+                            cursor.execute('ANALYZE')
+            else:
+                context = benchdata.load_context()
+            statements = self.record(context, options)
+            self.check_plans(statements, options)
+        finally:
+            if old_names is not None:
+                benchdata.teardown_database(old_names)
+            overrides.disable()
+            report_dir.cleanup()
+            teardown_test_environment()
+
+    def record(self, context, options):
+        """``{url name: [(alias, sql, params)]}``, each distinct statement once."""
+        scenarios = Scenarios(context, random.Random(options['seed']))
+        client = Client()
+        recorder = StatementRecorder()
+        connection_created.connect(recorder.install)
+        for connection in connections.all(initialized_only=True):
+            recorder.install(connection=connection)
+        statements = {}
+        try:
+            for name in [p.name for p in urlpatterns]:
+                if name in Scenarios.SKIPPED:
+                    self.stdout.write(f"skipping {name}: {Scenarios.SKIPPED[name]}")
+                    continue
+                build = getattr(scenarios, name)
+                url = reverse(name)
+                recorder.statements = []
+                for i in range(options['requests']):
+                    method, kwargs = build(i)
+                    with ExitStack() as stack:
+                        if not options['synthetic']:
+                            # a real database: every write the endpoints make is rolled back
+                            for alias in shards.aliases():
+                                stack.enter_context(transaction.atomic(using=alias))
+                        response = getattr(client, method)(url, **kwargs)
+                        if response.streaming:
+                            b''.join(response.streaming_content)
+                        if not options['synthetic']:
+                            for alias in shards.aliases():
+                                transaction.set_rollback(True, using=alias)
+                    if response.status_code >= 500:
+                        raise CommandError(f"{name} answered {response.status_code}: {response.content[:300]!r}")
+                seen = {}
+                for alias, sql, params in recorder.statements:
+                    seen.setdefault((alias, sql), params)
+                statements[name] = [(alias, sql, params) for (alias, sql), params in seen.items()]
+                recorder.statements = None
+        finally:
+            recorder.statements = None
+            connection_created.disconnect(recorder.install)
+            for connection in connections.all(initialized_only=True):
+                if recorder in connection.execute_wrappers:
+                    connection.execute_wrappers.remove(recorder)
+        return statements
+
+    def check_plans(self, statements, options):
+        failures = []
+        for name, queries in statements.items():
+            for alias, sql, params in queries:
+                connection = connections[alias]
+                with transaction.atomic(using=alias):
+                    if connection.vendor == 'postgresql':
+                        # small tables make the planner prefer seq scans even when an
+                        # index fits; only report scans that happen with no alternative
+                        with connection.cursor() as cursor:
+                            cursor.execute('SET LOCAL enable_seqscan = off')
+                    plan = explain(connection, sql, params)
+                if options['show_plans']:
+                    self.stdout.write(f"-- {name} on {alias}\n{sql}\n{plan}\n")
+                scans = sequential_scans(connection, plan)
+                if scans and name not in FULL_SCAN_ALLOWED:
+                    failures.append(f"{name} on {alias}: sequential scan on {', '.join(scans)}\n    {sql}")
+
+        if failures:
+            raise CommandError("Queries without a usable index:\n  " + "\n  ".join(failures))
+        count = sum(len(queries) for queries in statements.values())
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(statements)} endpoints checked ({count} statements), no sequential scans on large tables"))
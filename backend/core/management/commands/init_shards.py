@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Max
+
+from core import schema, shards
+from core.models import Payment, Violation, ViolationDetail
+
+
+class Command(BaseCommand):
+    help = (
+        "Prepares the station shards in CORE_SHARDS: creates missing ticket tables, applies the schema "
+        "packs and moves each shard's id sequences to the start of its range. Safe to run again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shard', action='append', help="Only this shard alias (repeatable).")
+
+    def handle(self, *args, **options):
+        config = shards.get_config()
+        numbers = [shard['NUMBER'] for shard in config['SHARDS'].values()]
+        if any(n < 1 for n in numbers) or len(set(numbers)) != len(numbers):
+            raise CommandError("Shard NUMBERs must be unique and at least 1 (0 is the home database).")
+        stations = [station for shard in config['SHARDS'].values() for station in shard['STATIONS']]
+        if len(set(stations)) != len(stations):
+            raise CommandError("A station is listed under more than one shard.")
+
+        aliases = shards.shard_aliases()
+        if options['shard']:
+            unknown = set(options['shard']) - set(aliases)
+            if unknown:
+                raise CommandError(f"Not a shard: {', '.join(sorted(unknown))}")
+            aliases = [alias for alias in aliases if alias in options['shard']]
+        if not aliases:
+            self.stdout.write("No shards configured in CORE_SHARDS.")
+
+        for alias in aliases:
+            connection = connections[alias]
+            schema.create_unmanaged_tables(connection, shards.models(alias))
+            schema.apply_all(connection)
+            moved = shards.reserve_ids(alias)
+            first, end = shards.id_range(alias)
+            self.stdout.write(self.style.SUCCESS(
+                f"{alias}: ids {first}..{end - 1}"
+                + (f", sequences moved for {', '.join(moved)}" if moved else "")))
+
+        # the home database is shard 0: its ids must stay below the first shard's range
+        _first, end = shards.id_range(shards.HOME)
+        for model in (Violation, ViolationDetail, Payment):
+            last = model.objects.using(shards.HOME).aggregate(last=Max('pk'))['last'] or 0
+            if last >= end * 0.9:
+                self.stderr.write(self.style.WARNING(
+                    f"{model._meta.db_table}: the home database is at id {last}, close to where shard 1's "
+                    f"ids start ({end})"))
@@ -0,0 +1,162 @@
+import json
+import logging
+import statistics
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.backends.signals import connection_created
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from core import benchdata, ratelimit
+from core.tokens import issue_token
+
+
+class QueryConcurrency:
+    """Tracks how many queries run at the same time on each database.
+
+    The budget is per database (its connection pool); with station shards one
+    admitted request can query every database at once (shards.fan_out).
+    """
+
+    def __init__(self):
+        self.current = {}
+        self.peaks = {}
+        self._lock = threading.Lock()
+
+    @property
+    def peak(self):
+        return max(self.peaks.values(), default=0)
+
+    def __call__(self, execute, sql, params, many, context):
+        alias = context['connection'].alias
+        with self._lock:
+            self.current[alias] = self.current.get(alias, 0) + 1
+            self.peaks[alias] = max(self.peaks.get(alias, 0), self.current[alias])
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            with self._lock:
+                self.current[alias] -= 1
+
+    def install(self, sender, connection, **kwargs):
+        # a reconnect (fan_out threads close theirs after each call) sends connection_created again
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+class Command(BaseCommand):
+    help = (
+        "Overloads submit_payment with many concurrent retrying clients and reports how many were "
+        "admitted, rejected with 429/503, and the peak database concurrency against the budget. "
+        "Fails on any other 5xx answer, or when the database concurrency exceeded the budget."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=200, help="Concurrent client threads.")
+        parser.add_argument('--duration', type=float, default=5.0, help="Seconds to keep the load on.")
+        parser.add_argument('--max-inflight', type=int, default=4,
+                            help="Database connection budget (CORE_ADMISSION MAX_INFLIGHT).")
+        parser.add_argument('--backend', choices=['memory', 'file'], default='memory')
+        parser.add_argument('--rate', type=float, default=0.2)
+        parser.add_argument('--burst', type=int, default=5)
+        parser.add_argument('--no-limits', action='store_true',
+                            help="Disable rate limiting and admission control, for comparison.")
+
+    def handle(self, *args, **options):
+        limits = {} if options['no_limits'] else {
+            'submit_payment': {'rate': options['rate'], 'burst': options['burst'], 'keys': ['user', 'ip']},
+        }
+        admission = {} if options['no_limits'] else {'MAX_INFLIGHT': options['max_inflight'], 'WAIT': 0.05}
+        overrides = override_settings(
+            CORE_RATE_LIMITS=limits,
+            CORE_ADMISSION=admission,
+            CORE_RATE_LIMIT_BACKEND=options['backend'],
+        )
+
+        # every rejection would otherwise log a warning
+        logging.getLogger('django.request').setLevel(logging.CRITICAL)
+        logging.getLogger('core').setLevel(logging.WARNING)
+        setup_test_environment()
+        overrides.enable()
+        # on disk: threads writing to an in-memory SQLite database fail instead of waiting
+        old_name = benchdata.setup_database(concurrent=True)
+        concurrency = QueryConcurrency()
+        connection_created.connect(concurrency.install)
+        try:
+            context = benchdata.seed(benchdata.Volumes(drivers=max(options['clients'], 100), violations=2000,
+                                                       details=2000, payments=100, audit_logs=10))
+            results = self.run_load(context, options)
+            limiter = ratelimit.get_inflight_limiter()
+        finally:
+            connection_created.disconnect(concurrency.install)
+            benchdata.teardown_database(old_name)
+            overrides.disable()
+            teardown_test_environment()
+
+        self.report(results, concurrency, limiter, options)
+
+    def run_load(self, context, options):
+        deadline = time.monotonic() + options['duration']
+        lock = threading.Lock()
+        statuses = {}
+        latencies = {}
+        violation_driver = context['violation_driver']
+        by_driver = {}
+        for violation_id, driver_id in violation_driver.items():
+            by_driver.setdefault(driver_id, violation_id)
+        # issuing a token reads the database; do it before the load, not inside the budget being measured
+        drivers = [list(by_driver)[n % len(by_driver)] for n in range(options['clients'])]
+        tokens = {driver_id: issue_token('driver', driver_id) for driver_id in set(drivers)}
+
+        def client_loop(n):
+            driver_id = drivers[n]
+            client = Client(headers={'Authorization': f'Bearer {tokens[driver_id]}'})
+            i = 0
+            while time.monotonic() < deadline:
+                i += 1
+                body = json.dumps({
+                    'violation_id': by_driver[driver_id], 'driver_user_id': driver_id,
+                    'payment_type': 'GCash', 'amount_paid': '500.00',
+                    'transaction_ref': f'LOAD-{n}-{i}',
+                })
+                started = time.perf_counter()
+                response = client.post('/api/payment/submit/', body, content_type='application/json',
+                                       REMOTE_ADDR=f'10.0.{n // 250}.{n % 250}')
+                elapsed = (time.perf_counter() - started) * 1000
+                with lock:
+                    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                    latencies.setdefault(response.status_code, []).append(elapsed)
+
+        threads = [threading.Thread(target=client_loop, args=(n,)) for n in range(options['clients'])]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return statuses, latencies
+
+    def report(self, results, concurrency, limiter, options):
+        statuses, latencies = results
+        total = sum(statuses.values())
+        self.stdout.write(f"{total} requests in {options['duration']:.1f}s from {options['clients']} clients")
+        for status in sorted(statuses):
+            values = sorted(latencies[status])
+            p99 = values[min(len(values) - 1, int(len(values) * 0.99))]
+            self.stdout.write(
+                f"  {status}: {statuses[status]:>7}  p50 {statistics.median(values):7.2f}ms  p99 {p99:7.2f}ms"
+            )
+        budget = options['max_inflight']
+        per_alias = ', '.join(f'{alias} {peak}' for alias, peak in sorted(concurrency.peaks.items()))
+        self.stdout.write(f"peak concurrent queries per database: {per_alias} (budget {budget})")
+        if limiter is not None:
+            self.stdout.write(f"peak admitted requests: {limiter.peak}")
+        # 503 is admission control turning a request away; any other 5xx is the endpoint failing under load
+        errors = {status: count for status, count in statuses.items() if status >= 500 and status != 503}
+        failures = []
+        if errors:
+            failures.append(f"server errors: {', '.join(f'{count} x {status}' for status, count in sorted(errors.items()))}")
+        if concurrency.peak > budget and not options['no_limits']:
+            failures.append("database concurrency exceeded the budget")
+        if failures:
+            raise CommandError('; '.join(failures))
@@ -0,0 +1,201 @@
+import asyncio
+import json
+import logging
+import resource
+import statistics
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from core import events
+from core.tokens import issue_token
+
+
+class StreamClient:
+    """One EventSource-like client, driven straight through the ASGI app."""
+
+    def __init__(self, app, path, n, token):
+        self.app = app
+        self.path = path
+        self.n = n
+        self.token = token
+        self.status = None
+        self.started = asyncio.Event()
+        self.closed = asyncio.Event()
+        self.latencies = []
+        self.resyncs = 0
+        self._requested = False
+        self._buffer = b''
+
+    def scope(self):
+        return {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': self.path,
+            'raw_path': self.path.encode(),
+            'root_path': '',
+            'query_string': f'token={self.token}'.encode(),
+            'headers': [(b'host', b'testserver'), (b'accept', b'text/event-stream')],
+            'client': (f'10.1.{self.n // 250}.{self.n % 250}', 40000 + self.n % 20000),
+            'server': ('testserver', 80),
+        }
+
+    async def run(self):
+        await self.app(self.scope(), self.receive, self.send)
+        self.started.set()
+
+    async def receive(self):
+        if not self._requested:
+            self._requested = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await self.closed.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(self, message):
+        if message['type'] == 'http.response.start':
+            self.status = message['status']
+            self.started.set()
+        elif message['type'] == 'http.response.body':
+            received = time.perf_counter()
+            self._buffer += message.get('body', b'')
+            while b'\n\n' in self._buffer:
+                frame, self._buffer = self._buffer.split(b'\n\n', 1)
+                self.handle_frame(frame.decode(), received)
+
+    def handle_frame(self, frame, received):
+        fields = dict(line.split(': ', 1) for line in frame.splitlines() if ': ' in line and not line.startswith(':'))
+        if fields.get('event') == 'resync':
+            self.resyncs += 1
+        elif fields.get('event') == 'loadtest':
+            self.latencies.append((received - json.loads(fields['data'])['sent']) * 1000)
+
+
+def rss_kb():
+    # peak resident set size; kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Command(BaseCommand):
+    help = (
+        "Opens many idle server-sent event streams against backend.asgi in this process, publishes "
+        "events from another thread and reports connection cost and fan-out latency."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=500)
+        parser.add_argument('--events', type=int, default=20, help="Events published once all streams are open.")
+        parser.add_argument('--interval', type=float, default=0.05, help="Seconds between published events.")
+        parser.add_argument('--idle', type=float, default=0.0,
+                            help="Seconds to hold the streams idle before publishing (heartbeats only).")
+        parser.add_argument('--heartbeat', type=float, default=15.0)
+        parser.add_argument('--timeout', type=float, default=60.0)
+        parser.add_argument('--through-django', action='store_true',
+                            help="Serve the streams with Django's ASGI handler instead of events.StreamApp, for comparison.")
+
+    def handle(self, *args, **options):
+        overrides = override_settings(
+            CORE_EVENTS={
+                'BACKEND': 'local',
+                'QUEUE_SIZE': max(100, options['events'] * 2),
+                'HEARTBEAT': options['heartbeat'],
+                'MAX_SUBSCRIBERS': options['connections'],
+            },
+            # measure the streams, not the rate limiter
+            CORE_RATE_LIMITS={},
+            CORE_ADMISSION={},
+        )
+        logging.getLogger('django.request').setLevel(logging.CRITICAL)
+        setup_test_environment()
+        overrides.enable()
+        try:
+            if events._broker is not None:
+                raise CommandError("The event broker was created before the load test settings applied.")
+            results = asyncio.run(self.run_load(options))
+        finally:
+            overrides.disable()
+            teardown_test_environment()
+        self.report(results, options)
+
+    async def run_load(self, options):
+        path = reverse('event_stream')
+        app = get_asgi_application()
+        if not options['through_django']:
+            app = events.StreamApp(app, path)
+        token = await sync_to_async(issue_token)('admin', 1)
+        threads_before = threading.active_count()
+        rss_before = rss_kb()
+
+        clients = [StreamClient(app, path, n, token) for n in range(options['connections'])]
+        started = time.perf_counter()
+        tasks = [asyncio.create_task(c.run()) for c in clients]
+        await asyncio.wait_for(asyncio.gather(*(c.started.wait() for c in clients)), options['timeout'])
+        open_seconds = time.perf_counter() - started
+        rss_open = rss_kb()
+        threads_open = threading.active_count()
+        open_streams = len(events.get_broker())
+
+        if options['idle']:
+            await asyncio.sleep(options['idle'])
+
+        # publish from a plain thread, the way views do after a commit
+        def publisher():
+            for i in range(options['events']):
+                events.publish('loadtest', seq=i, sent=time.perf_counter())
+                time.sleep(options['interval'])
+
+        publishing = threading.Thread(target=publisher)
+        publishing.start()
+        await asyncio.to_thread(publishing.join)
+        ok = [c for c in clients if c.status == 200]
+        deadline = time.monotonic() + options['timeout']
+        while time.monotonic() < deadline and any(len(c.latencies) + c.resyncs < options['events'] for c in ok):
+            await asyncio.sleep(0.05)
+
+        for c in clients:
+            c.closed.set()
+        await asyncio.wait_for(asyncio.gather(*tasks, return_exceptions=True), options['timeout'])
+        return {
+            'clients': clients,
+            'open_seconds': open_seconds,
+            'open_streams': open_streams,
+            'left_open': len(events.get_broker()),
+            'threads': (threads_before, threads_open),
+            'rss': (rss_before, rss_open),
+            'dropped': events.get_broker().dropped,
+        }
+
+    def report(self, results, options):
+        clients = results['clients']
+        statuses = {}
+        for c in clients:
+            statuses[c.status] = statuses.get(c.status, 0) + 1
+        latencies = sorted(value for c in clients for value in c.latencies)
+        expected = statuses.get(200, 0) * options['events']
+        rss_before, rss_open = results['rss']
+        threads_before, threads_open = results['threads']
+
+        self.stdout.write(f"{len(clients)} streams opened in {results['open_seconds']:.2f}s: statuses {statuses}")
+        self.stdout.write(f"open at once: {results['open_streams']}; still registered after close: {results['left_open']}")
+        self.stdout.write(f"threads: {threads_before} before, {threads_open} with all streams open")
+        self.stdout.write(
+            f"peak RSS: {rss_before / 1024:.1f}MB before, {rss_open / 1024:.1f}MB open "
+            f"(~{(rss_open - rss_before) / max(1, len(clients)):.1f}KB per stream)"
+        )
+        self.stdout.write(f"deliveries: {len(latencies)}/{expected}, resyncs {sum(c.resyncs for c in clients)}, "
+                          f"dropped {results['dropped']}")
+        if latencies:
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+            self.stdout.write(
+                f"fan-out latency: p50 {statistics.median(latencies):.2f}ms  p99 {p99:.2f}ms  max {latencies[-1]:.2f}ms"
+            )
+        if len(latencies) < expected:
+            self.stderr.write(self.style.ERROR("some streams did not receive every event"))
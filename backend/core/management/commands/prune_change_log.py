@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core import changefeed
+
+
+class Command(BaseCommand):
+    help = "Deletes change feed entries older than CORE_CHANGE_FEED['RETENTION_DAYS'] (or --days)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help="Keep this many days instead of the configured retention.")
+
+    def handle(self, *args, **options):
+        removed = changefeed.prune(options['days'])
+        self.stdout.write(self.style.SUCCESS(f"Removed {removed} change feed entries"))
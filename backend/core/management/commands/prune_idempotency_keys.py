@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core import idempotency
+
+
+class Command(BaseCommand):
+    help = "Deletes stored Idempotency-Key responses older than CORE_IDEMPOTENCY_TTL."
+
+    def handle(self, *args, **options):
+        removed = idempotency.prune()
+        self.stdout.write(self.style.SUCCESS(f"Removed {removed} idempotency keys"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core import hotspots
+
+
+class Command(BaseCommand):
+    help = "Recounts the per-cell, per-day violation counters behind violation/hotspots/ from the violations table."
+
+    def handle(self, *args, **options):
+        written = hotspots.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} hotspot counters"))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from core import search
+
+
+class Command(BaseCommand):
+    help = "Rewrites the search documents of every driver and violation, for rows written without the ORM."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        written = search.rebuild(chunk_size=options['chunk_size'], log=self.stdout.write if options['verbosity'] > 1 else None)
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {written['drivers']} drivers and {written['violations']} violations"))
@@ -0,0 +1,35 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from core import jobs
+
+
+class Command(BaseCommand):
+    help = "Runs background jobs from the database queue (see core/jobs.py) until stopped."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queue', action='append', dest='queues',
+                            help="Queue to work on; repeat for several (default: default and audit).")
+        parser.add_argument('--batch', type=int, help="Jobs claimed per query (default: CORE_JOBS['BATCH']).")
+        parser.add_argument('--poll-interval', type=float,
+                            help="Seconds to sleep when no job is due (default: CORE_JOBS['POLL_INTERVAL']).")
+        parser.add_argument('--burst', action='store_true', help="Exit once no job is due.")
+        parser.add_argument('--max-jobs', type=int, help="Exit after this many jobs.")
+
+    def handle(self, *args, **options):
+        worker = jobs.Worker(
+            options['queues'] or ['default', 'audit'],
+            batch=options['batch'],
+            poll_interval=options['poll_interval'],
+        )
+
+        def shutdown(signum, frame):
+            # finish the current job, then exit
+            worker.stop()
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+        self.stdout.write(f"worker {worker.name} on queues {', '.join(worker.queues)}")
+        worker.run(burst=options['burst'], max_jobs=options['max_jobs'])
+        self.stdout.write(f"processed {worker.processed}, failed {worker.failed}")
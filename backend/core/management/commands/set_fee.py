@@ -0,0 +1,65 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from core import fees
+from core.models import ViolationType, ViolationTypeFee
+
+
+class Command(BaseCommand):
+    help = "Schedules a new fee for a violation type, effective now or at --effective-from (see core/fees.py)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('violation_type', type=int)
+        parser.add_argument('amount', help="New fee in pesos, e.g. 1500.00")
+        parser.add_argument('--effective-from', help="ISO date and time the fee applies from (default: now).")
+        parser.add_argument('--backdate', action='store_true',
+                            help="Allow an effective time in the past; this changes the fee of tickets already issued.")
+
+    def handle(self, *args, **options):
+        try:
+            amount = fees.to_centavos(options['amount'])
+        except (ArithmeticError, ValueError):
+            raise CommandError(f"{options['amount']!r} is not an amount in pesos")
+        if amount < 0:
+            raise CommandError("Fees cannot be negative")
+        if not ViolationType.objects.filter(pk=options['violation_type']).exists():
+            raise CommandError(f"No violation type {options['violation_type']}")
+
+        now = timezone.now()
+        effective_from = now
+        if options['effective_from']:
+            effective_from = parse_datetime(options['effective_from'])
+            if effective_from is None:
+                raise CommandError(f"Cannot parse {options['effective_from']!r} as a date and time")
+            if timezone.is_naive(effective_from):
+                effective_from = timezone.make_aware(effective_from)
+        # a minute of slack for "now" typed by hand
+        if effective_from < now - timedelta(minutes=1) and not options['backdate']:
+            raise CommandError("The effective time is in the past; pass --backdate to rewrite history")
+
+        try:
+            with transaction.atomic():
+                entry = ViolationTypeFee.objects.create(
+                    violation_type_id=options['violation_type'], effective_from=effective_from, amount_centavos=amount,
+                )
+        except IntegrityError:
+            # rows are never edited (core.fees): a different fee needs a time of its own
+            entry = ViolationTypeFee.objects.get(
+                violation_type_id=options['violation_type'], effective_from=effective_from)
+            if entry.amount_centavos != amount:
+                raise CommandError(
+                    f"Violation type {entry.violation_type_id} already has {fees.pesos(entry.amount_centavos)} "
+                    f"from {effective_from.isoformat()}; schedule the new fee from another time"
+                )
+            self.stdout.write(
+                f"{fees.pesos(amount)} for violation type {entry.violation_type_id} from "
+                f"{effective_from.isoformat()} was already scheduled"
+            )
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Scheduled {fees.pesos(amount)} for violation type {entry.violation_type_id} from {effective_from.isoformat()}"
+        ))
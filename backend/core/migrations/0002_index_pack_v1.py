@@ -0,0 +1,15 @@
+from django.db import migrations
+
+from core.schema import index_pack_operations
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction on Postgres
+    atomic = False
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = index_pack_operations(1)
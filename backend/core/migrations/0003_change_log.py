@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:29
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_index_pack_v1'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLogEntry',
+            fields=[
+                ('seq', models.BigAutoField(primary_key=True, serialize=False)),
+                ('entity', models.CharField(max_length=20)),
+                ('entity_id', models.BigIntegerField()),
+                ('op', models.CharField(choices=[('u', 'upsert'), ('d', 'delete')], max_length=1)),
+                ('changed_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'core_change_log',
+                'indexes': [models.Index(fields=['changed_at'], name='core_change_log_changed_at')],
+            },
+        ),
+    ]
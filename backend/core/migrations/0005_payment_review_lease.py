@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_job_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentReviewLease',
+            fields=[
+                ('payment', models.OneToOneField(db_column='payment_id', db_constraint=False, on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='review_lease', serialize=False, to='core.payment')),
+                ('claim', models.UUIDField()),
+                ('leased_until', models.DateTimeField()),
+                ('lto_user', models.ForeignKey(db_column='lto_user_id', db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.ltoadminuser')),
+            ],
+            options={
+                'db_table': 'core_payment_review_lease',
+                'indexes': [models.Index(fields=['lto_user', 'leased_until'], name='core_review_lease_admin'), models.Index(fields=['leased_until'], name='core_review_lease_until')],
+            },
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:51
+
+from datetime import datetime, timezone
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+from core.schema import column_pack_operations
+
+# the fee a type had before it got a schedule applies to every earlier ticket
+SINCE = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def schedule_current_fees(apps, schema_editor):
+    connection = schema_editor.connection
+    if 'violation_type' not in connection.introspection.table_names():
+        return
+    # the violation_type table is unmanaged and its migration state is not
+    # kept up to date, so read it directly
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT violation_type, violation_fee FROM violation_type')
+        rows = cursor.fetchall()
+    ViolationTypeFee = apps.get_model('core', 'ViolationTypeFee')
+    ViolationTypeFee.objects.using(connection.alias).bulk_create([
+        ViolationTypeFee(violation_type_id=type_id, effective_from=SINCE, amount_centavos=int(round(fee * 100)))
+        for type_id, fee in rows
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_payment_review_lease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ViolationTypeFee',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('effective_from', models.DateTimeField()),
+                ('amount_centavos', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('violation_type', models.ForeignKey(db_column='violation_type', db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='fee_schedule', to='core.violationtype')),
+            ],
+            options={
+                'db_table': 'core_violation_type_fee',
+                'constraints': [models.UniqueConstraint(fields=('violation_type', 'effective_from'), name='core_fee_type_effective')],
+            },
+        ),
+        migrations.RunPython(schedule_current_fees, migrations.RunPython.noop),
+        *column_pack_operations(1),
+    ]
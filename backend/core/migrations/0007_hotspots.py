@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:55
+
+from django.db import migrations, models
+
+from core.schema import column_pack_operations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_fee_schedule'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HotspotCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('cell_y', models.IntegerField()),
+                ('cell_x', models.IntegerField()),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'core_hotspot_count',
+                'constraints': [models.UniqueConstraint(fields=('day', 'cell_y', 'cell_x'), name='core_hotspot_day_cell')],
+            },
+        ),
+        *column_pack_operations(2),
+    ]
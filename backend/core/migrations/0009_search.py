@@ -0,0 +1,83 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:58
+
+from django.db import migrations, models
+
+# Full-text index over core_search_document (see core.search). Titles weigh
+# more than the rest of the text.
+FULL_TEXT = {
+    'postgresql': (
+        [
+            "ALTER TABLE core_search_document ADD COLUMN search tsvector GENERATED ALWAYS AS ("
+            "setweight(to_tsvector('simple', title), 'A') || setweight(to_tsvector('simple', body), 'B')) STORED",
+            "CREATE INDEX core_search_document_search ON core_search_document USING GIN (search)",
+        ],
+        [
+            "DROP INDEX IF EXISTS core_search_document_search",
+            "ALTER TABLE core_search_document DROP COLUMN IF EXISTS search",
+        ],
+    ),
+    'sqlite': (
+        [
+            # external content: the text is stored once, in core_search_document;
+            # prefix indexes make 2 and 3 character prefix queries cheap
+            "CREATE VIRTUAL TABLE core_search_fts USING fts5("
+            "title, body, content='core_search_document', content_rowid='id', prefix='2 3')",
+            "CREATE TRIGGER core_search_fts_insert AFTER INSERT ON core_search_document BEGIN "
+            "INSERT INTO core_search_fts (rowid, title, body) VALUES (new.id, new.title, new.body); END",
+            "CREATE TRIGGER core_search_fts_delete AFTER DELETE ON core_search_document BEGIN "
+            "INSERT INTO core_search_fts (core_search_fts, rowid, title, body) "
+            "VALUES ('delete', old.id, old.title, old.body); END",
+            "CREATE TRIGGER core_search_fts_update AFTER UPDATE ON core_search_document BEGIN "
+            "INSERT INTO core_search_fts (core_search_fts, rowid, title, body) "
+            "VALUES ('delete', old.id, old.title, old.body); "
+            "INSERT INTO core_search_fts (rowid, title, body) VALUES (new.id, new.title, new.body); END",
+        ],
+        [
+            "DROP TRIGGER IF EXISTS core_search_fts_update",
+            "DROP TRIGGER IF EXISTS core_search_fts_delete",
+            "DROP TRIGGER IF EXISTS core_search_fts_insert",
+            "DROP TABLE IF EXISTS core_search_fts",
+        ],
+    ),
+}
+
+
+def _run(statements, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def create_full_text(apps, schema_editor):
+    if schema_editor.connection.vendor in FULL_TEXT:
+        _run(FULL_TEXT[schema_editor.connection.vendor][0], schema_editor)
+
+
+def drop_full_text(apps, schema_editor):
+    if schema_editor.connection.vendor in FULL_TEXT:
+        _run(FULL_TEXT[schema_editor.connection.vendor][1], schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_index_pack_v2'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entity', models.CharField(max_length=20)),
+                ('entity_id', models.IntegerField()),
+                ('title', models.CharField(max_length=255)),
+                ('body', models.TextField()),
+            ],
+            options={
+                'db_table': 'core_search_document',
+                'constraints': [models.UniqueConstraint(fields=('entity', 'entity_id'), name='core_search_entity')],
+            },
+        ),
+        migrations.RunPython(create_full_text, drop_full_text),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_search'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='paymentreviewlease',
+            name='payment',
+            field=models.OneToOneField(db_column='payment_id', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='review_lease', serialize=False, to='core.payment'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_review_lease_across_shards'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('station', models.CharField(max_length=100)),
+                ('day', models.DateField()),
+                ('changed_at', models.DateTimeField(blank=True, null=True)),
+                ('built_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'core_report_day',
+                'constraints': [models.UniqueConstraint(fields=('station', 'day'), name='core_report_station_day')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StationDayTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('station', models.CharField(max_length=100)),
+                ('day', models.DateField()),
+                ('metric', models.CharField(choices=[('issued', 'Fines issued'), ('type', 'Violations by type'), ('collected', 'Fines collected by method')], max_length=10)),
+                ('key', models.CharField(blank=True, default='', max_length=50)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('amount_centavos', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'core_station_day_total',
+                'constraints': [models.UniqueConstraint(fields=('station', 'day', 'metric', 'key'), name='core_station_day_total_key')],
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+from django.db import migrations
+
+# Postgres's text parser keeps emails, host names and hyphenated words such as
+# plates and license numbers as single words, while core.search splits queries
+# into runs of letters and digits; index the text split the same way.
+SPLIT = "regexp_replace({column}, '[^[:alnum:]]+', ' ', 'g')"
+
+
+def _search_column(title, body):
+    return (
+        "ALTER TABLE core_search_document ADD COLUMN search tsvector GENERATED ALWAYS AS ("
+        f"setweight(to_tsvector('simple', {title}), 'A') || setweight(to_tsvector('simple', {body}), 'B')) STORED"
+    )
+
+
+def _rebuild(schema_editor, title, body):
+    # a generated column's expression cannot be altered before Postgres 16
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("DROP INDEX IF EXISTS core_search_document_search")
+        cursor.execute("ALTER TABLE core_search_document DROP COLUMN IF EXISTS search")
+        cursor.execute(_search_column(title, body))
+        cursor.execute("CREATE INDEX core_search_document_search ON core_search_document USING GIN (search)")
+
+
+def split_words(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        _rebuild(schema_editor, SPLIT.format(column='title'), SPLIT.format(column='body'))
+
+
+def whole_words(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        _rebuild(schema_editor, 'title', 'body')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_change_log_txid'),
+    ]
+
+    operations = [
+        migrations.RunPython(split_words, whole_words),
+    ]
@@ -0,0 +1,18 @@
+from django.db import migrations
+
+from core.schema import column_pack_operations, index_pack_operations
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction on Postgres
+    atomic = False
+
+    dependencies = [
+        ('core', '0016_search_split_words'),
+    ]
+
+    operations = [
+        *column_pack_operations(3),
+        *index_pack_operations(4),
+    ]
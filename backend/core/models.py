@@ -1,8 +1,12 @@
+from functools import partial
+
 from django.db import models
 from django.utils import timezone
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
+from . import shards
+
 
 class DriverUser(models.Model):
     driver_user_id = models.AutoField(primary_key=True)
@@ -75,11 +79,23 @@ class ViolationType(models.Model):
         
 class Violation(models.Model):
     violation_id = models.AutoField(primary_key=True)
-    driver_user = models.ForeignKey('DriverUser', on_delete=models.CASCADE, db_column='driver_user_id')
-    law_officer = models.ForeignKey('LawOfficer', on_delete=models.SET_NULL, null=True, db_column='law_of_user_id')
+    # tickets may live on a station's shard, drivers and officers never do
+    # (core.shards), so these cannot be foreign key constraints there
+    driver_user = models.ForeignKey('DriverUser', on_delete=models.CASCADE, db_column='driver_user_id', db_constraint=False)
+    law_officer = models.ForeignKey(
+        'LawOfficer', on_delete=models.SET_NULL, null=True, db_column='law_of_user_id', db_constraint=False)
     location = models.CharField(max_length=255)
     status = models.CharField(max_length=50 ,default='unpaid')  # No choices, since your DB stores 'paid' and 'unpaid'
     total_fee = models.DecimalField(max_digits=10, decimal_places=2)
+    # added by core.schema column pack 1; null for tickets issued before it
+    issued_at = models.DateTimeField(null=True, blank=True)
+    # added by core.schema column pack 2; null when the device sent no position
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    geocell = models.IntegerField(null=True, blank=True)
+    # added by core.schema column pack 3; the officer's station when the ticket
+    # was issued, null for tickets issued before it
+    station = models.CharField(max_length=100, null=True, blank=True)
 
     class Meta:
         managed = False
@@ -98,6 +114,7 @@ class ViolationDetail(models.Model):
         on_delete=models.SET_NULL,
         null=True,
         db_column='violation_type',
+        db_constraint=False,
     )
     fee_at_time = models.DecimalField(max_digits=10, decimal_places=2)
     notes = models.TextField(blank=True, null=True)
@@ -127,7 +144,7 @@ class Payment(models.Model):
     ]
 
     violation = models.ForeignKey(Violation, on_delete=models.CASCADE, db_column='violation_id')
-    driver_user = models.ForeignKey(DriverUser, on_delete=models.CASCADE, db_column='driver_user_id')
+    driver_user = models.ForeignKey(DriverUser, on_delete=models.CASCADE, db_column='driver_user_id', db_constraint=False)
     payment_type = models.CharField(max_length=50, choices=PAYMENT_TYPES)
     payment_date = models.DateTimeField(auto_now_add=True)
     amount_paid = models.DecimalField(max_digits=10, decimal_places=2)
@@ -164,4 +181,293 @@ def mark_violation_paid_on_payment_completed(sender, instance, **kwargs):
         violation = instance.violation
         if violation.status.lower() != "paid":
             violation.status = "paid"
-            violation.save()
\ No newline at end of file
+            violation.save(update_fields=['status'])
+
+
+class CurrentTransactionId(models.Func):
+    """The id (xid8) of the transaction writing the row on PostgreSQL; NULL elsewhere."""
+
+    output_field = models.BigIntegerField()
+
+    def as_sql(self, compiler, connection, **extra_context):
+        return 'NULL', []
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return '(pg_current_xact_id()::text)::bigint', []
+
+
+class OldestRunningTransactionId(models.Func):
+    """The lowest transaction id still running (PostgreSQL only); every lower one has finished."""
+
+    output_field = models.BigIntegerField()
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return '(pg_snapshot_xmin(pg_current_snapshot())::text)::bigint', []
+
+
+class ChangeLogEntry(models.Model):
+    """One row per write to a table the admin console mirrors (see core.changefeed)."""
+
+    UPSERT = 'u'
+    DELETE = 'd'
+
+    seq = models.BigAutoField(primary_key=True)
+    entity = models.CharField(max_length=20)
+    entity_id = models.BigIntegerField()
+    op = models.CharField(max_length=1, choices=[(UPSERT, 'upsert'), (DELETE, 'delete')])
+    changed_at = models.DateTimeField(default=timezone.now)
+    # the writing transaction, which orders the feed by commit on PostgreSQL
+    txid = models.BigIntegerField(null=True, editable=False, db_default=CurrentTransactionId())
+
+    class Meta:
+        db_table = 'core_change_log'
+        indexes = [
+            models.Index(fields=['changed_at'], name='core_change_log_changed_at'),
+            models.Index(fields=['txid', 'seq'], name='core_change_log_txid'),
+        ]
+
+
+CHANGE_FEED_ENTITIES = {
+    DriverUser: 'drivers',
+    Payment: 'payments',
+    Violation: 'violations',
+    AuditLog: 'audit_logs',
+}
+
+
+def _record_change(entity, entity_id, op, using):
+    ChangeLogEntry.objects.using(using).create(entity=entity, entity_id=entity_id, op=op)
+
+
+def record_change_on_save(sender, instance, using, **kwargs):
+    # same database and transaction as the write itself, unless it went to a shard
+    shards.after_write(using, partial(_record_change, CHANGE_FEED_ENTITIES[sender], instance.pk, ChangeLogEntry.UPSERT))
+
+
+def record_change_on_delete(sender, instance, using, **kwargs):
+    shards.after_write(using, partial(_record_change, CHANGE_FEED_ENTITIES[sender], instance.pk, ChangeLogEntry.DELETE))
+
+
+for _model in CHANGE_FEED_ENTITIES:
+    post_save.connect(record_change_on_save, sender=_model, dispatch_uid=f'change_feed_save_{_model.__name__}')
+    post_delete.connect(record_change_on_delete, sender=_model, dispatch_uid=f'change_feed_delete_{_model.__name__}')
+
+
+class Job(models.Model):
+    """Deferred work for ``run_jobs`` workers (see core.jobs)."""
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUSES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (FAILED, 'Failed')]
+
+    queue = models.CharField(max_length=50, default='default')
+    task = models.CharField(max_length=200)
+    payload = models.JSONField(default=dict)
+    priority = models.SmallIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True, default='')
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Job #{self.pk} {self.task} ({self.status})"
+
+    class Meta:
+        db_table = 'core_job'
+        indexes = [
+            # the claim query: next runnable jobs of a queue, highest priority first
+            models.Index(
+                fields=['queue', '-priority', 'run_at'],
+                condition=models.Q(status='queued'),
+                name='core_job_runnable',
+            ),
+            models.Index(fields=['status', 'locked_at'], name='core_job_status_locked'),
+        ]
+
+
+class JobLock(models.Model):
+    """One row per queue; claims lock it where SKIP LOCKED is not available (SQLite)."""
+
+    queue = models.CharField(max_length=50, primary_key=True)
+    held_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'core_job_lock'
+
+
+class PaymentReviewLease(models.Model):
+    """An admin's claim on a payment awaiting review (see core.review)."""
+
+    # no database constraints: the payment and admin tables are not managed here.
+    # The payment may be on a station's database (core.shards), so deleting it
+    # leaves the lease behind; the next claim drops it.
+    payment = models.OneToOneField(
+        Payment, on_delete=models.DO_NOTHING, primary_key=True, db_column='payment_id',
+        db_constraint=False, related_name='review_lease',
+    )
+    lto_user = models.ForeignKey(
+        LtoAdminUser, on_delete=models.CASCADE, db_column='lto_user_id', db_constraint=False, related_name='+',
+    )
+    claim = models.UUIDField()
+    leased_until = models.DateTimeField()
+
+    def __str__(self):
+        return f"Payment #{self.payment_id} leased to {self.lto_user_id} until {self.leased_until}"
+
+    class Meta:
+        db_table = 'core_payment_review_lease'
+        indexes = [
+            models.Index(fields=['lto_user', 'leased_until'], name='core_review_lease_admin'),
+            models.Index(fields=['leased_until'], name='core_review_lease_until'),
+        ]
+
+
+class ViolationTypeFee(models.Model):
+    """A violation type's fee from ``effective_from`` until its next entry (see core.fees)."""
+
+    violation_type = models.ForeignKey(
+        ViolationType, on_delete=models.CASCADE, db_column='violation_type', db_constraint=False,
+        related_name='fee_schedule',
+    )
+    effective_from = models.DateTimeField()
+    amount_centavos = models.PositiveIntegerField()
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.violation_type_id}: {self.amount_centavos} centavos from {self.effective_from}"
+
+    class Meta:
+        db_table = 'core_violation_type_fee'
+        constraints = [
+            models.UniqueConstraint(fields=['violation_type', 'effective_from'], name='core_fee_type_effective'),
+        ]
+
+
+class HotspotCount(models.Model):
+    """Violations issued in one grid cell on one day (see core.hotspots)."""
+
+    day = models.DateField()
+    cell_y = models.IntegerField()
+    cell_x = models.IntegerField()
+    count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.day} ({self.cell_y}, {self.cell_x}): {self.count}"
+
+    class Meta:
+        db_table = 'core_hotspot_count'
+        constraints = [
+            # also the index for day-range + bounding box lookups
+            models.UniqueConstraint(fields=['day', 'cell_y', 'cell_x'], name='core_hotspot_day_cell'),
+        ]
+
+
+class SearchDocument(models.Model):
+    """Searchable text of one driver or violation (see core.search)."""
+
+    entity = models.CharField(max_length=20)
+    entity_id = models.IntegerField()
+    title = models.CharField(max_length=255)
+    body = models.TextField()
+
+    def __str__(self):
+        return f"{self.entity} #{self.entity_id}: {self.title}"
+
+    class Meta:
+        db_table = 'core_search_document'
+        constraints = [
+            models.UniqueConstraint(fields=['entity', 'entity_id'], name='core_search_entity'),
+        ]
+
+
+class ReportDay(models.Model):
+    """Whether a station's totals for one day are up to date (see core.reports)."""
+
+    station = models.CharField(max_length=100)
+    day = models.DateField()
+    # last write to the day's tickets or payments, and when its totals were last computed
+    changed_at = models.DateTimeField(null=True, blank=True)
+    built_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.station} {self.day}: built {self.built_at}, changed {self.changed_at}"
+
+    class Meta:
+        db_table = 'core_report_day'
+        constraints = [
+            models.UniqueConstraint(fields=['station', 'day'], name='core_report_station_day'),
+        ]
+
+
+class StationDayTotal(models.Model):
+    """One line of a station's totals for one day (see core.reports)."""
+
+    ISSUED = 'issued'
+    TYPE = 'type'
+    COLLECTED = 'collected'
+    METRICS = [(ISSUED, 'Fines issued'), (TYPE, 'Violations by type'), (COLLECTED, 'Fines collected by method')]
+
+    station = models.CharField(max_length=100)
+    day = models.DateField()
+    metric = models.CharField(max_length=10, choices=METRICS)
+    # violation type id or payment method; empty for ISSUED
+    key = models.CharField(max_length=50, blank=True, default='')
+    count = models.PositiveIntegerField(default=0)
+    amount_centavos = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.station} {self.day} {self.metric} {self.key}: {self.count}, {self.amount_centavos}"
+
+    class Meta:
+        db_table = 'core_station_day_total'
+        constraints = [
+            # also the index for a station's days in a month
+            models.UniqueConstraint(fields=['station', 'day', 'metric', 'key'], name='core_station_day_total_key'),
+        ]
+
+
+class IdempotencyKey(models.Model):
+    """A write's ``Idempotency-Key`` and the response it got (see core.idempotency)."""
+
+    scope = models.CharField(max_length=50)
+    # "<role>:<user id>", or the client address for anonymous calls
+    caller = models.CharField(max_length=100)
+    key = models.CharField(max_length=255)
+    # sha256 of the request body; the same key with another body is refused
+    fingerprint = models.CharField(max_length=64)
+    # the response; filled in before the row's transaction commits, so never seen empty
+    status = models.PositiveSmallIntegerField(default=0)
+    content = models.BinaryField(default=b'')
+    content_type = models.CharField(max_length=100, blank=True, default='')
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"{self.scope} {self.caller} {self.key}: {self.status}"
+
+    class Meta:
+        db_table = 'core_idempotency_key'
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'caller', 'key'], name='core_idempotency_key_unique'),
+        ]
+
+
+class TokenVersion(models.Model):
+    """How many times a user's tokens were revoked; tokens carry the version they were issued at (core.tokens)."""
+
+    role = models.CharField(max_length=10)
+    user_id = models.BigIntegerField()
+    version = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.role}:{self.user_id} v{self.version}"
+
+    class Meta:
+        db_table = 'core_token_version'
+        constraints = [
+            models.UniqueConstraint(fields=['role', 'user_id'], name='core_token_version_unique'),
+        ]
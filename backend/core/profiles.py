@@ -0,0 +1,154 @@
+"""
+Read-through cache for the profile endpoints.
+
+``get_driver_details``, ``get_officer_details`` and ``lto_admin_details`` run
+on every screen mount for rows that almost never change. ``get`` serves them
+from a cache, filling it on a miss with a query for just the columns the
+endpoint returns (never the driver's ``license_img``). Saving or deleting a
+driver, officer or admin drops their entry once the write commits.
+
+``CORE_PROFILE_CACHE['BACKEND']`` decides where entries live:
+
+* ``memory`` - an LRU per process. A write only clears the entry in the
+  process that made it; other workers serve the old profile for up to
+  ``TTL`` seconds.
+* ``cache`` - the Django cache named by ``CACHE`` (e.g. Redis or
+  memcached), shared by every worker, so a write clears it for all of them.
+
+Writes that bypass the ORM's ``save`` (``QuerySet.update``, raw SQL) are
+not seen; ``TTL`` bounds how long they stay hidden. ``stats`` returns the
+hit, miss and invalidation counters of this process.
+"""
+
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from . import shards
+from .lru import LRUCache
+from .models import DriverUser, LawOfficer, LtoAdminUser
+
+DEFAULTS = {
+    'BACKEND': 'memory',
+    # Django cache alias for the 'cache' backend
+    'CACHE': 'default',
+    'MAXSIZE': 10000,
+    'TTL': 300,
+}
+
+# kind -> model and the columns its endpoint returns
+PROFILES = {
+    'driver': (DriverUser, (
+        'full_name', 'license_status', 'license_expiry', 'birthday', 'email', 'phone_number', 'license_number',
+    )),
+    'officer': (LawOfficer, ('full_name', 'badge_id', 'station', 'phone_number')),
+    'admin': (LtoAdminUser, ('full_name', 'position', 'phone_number')),
+}
+KINDS = {model: kind for kind, (model, _fields) in PROFILES.items()}
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'CORE_PROFILE_CACHE', {}))
+    return config
+
+
+class SharedCache:
+    """A Django cache behind the ``LRUCache`` methods ``get`` uses."""
+
+    def __init__(self, alias, ttl):
+        self.cache = caches[alias]
+        self.ttl = ttl
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value):
+        self.cache.set(key, value, timeout=self.ttl)
+
+    def delete(self, key):
+        self.cache.delete(key)
+
+
+_backends = {}
+_lock = threading.Lock()
+_counters = {kind: {'hits': 0, 'misses': 0, 'invalidations': 0} for kind in PROFILES}
+
+
+def get_backend():
+    config = get_config()
+    key = (config['BACKEND'], config['CACHE'], config['MAXSIZE'], config['TTL'])
+    with _lock:
+        if key not in _backends:
+            if config['BACKEND'] == 'memory':
+                _backends[key] = LRUCache(maxsize=config['MAXSIZE'], ttl=config['TTL'])
+            elif config['BACKEND'] == 'cache':
+                _backends[key] = SharedCache(config['CACHE'], config['TTL'])
+            else:
+                raise ValueError(f"Unknown CORE_PROFILE_CACHE backend {config['BACKEND']!r}")
+        return _backends[key]
+
+
+def _key(kind, pk):
+    return f'profile:{kind}:{pk}'
+
+
+def _count(kind, counter):
+    with _lock:
+        _counters[kind][counter] += 1
+
+
+def get(kind, pk):
+    """The profile columns of the ``kind`` row with primary key ``pk``, or None."""
+    model, fields = PROFILES[kind]
+    pk = int(pk)
+    backend = get_backend()
+    profile = backend.get(_key(kind, pk))
+    if profile is not None:
+        _count(kind, 'hits')
+        return profile
+    _count(kind, 'misses')
+    # from the primary: a replica behind an invalidation would be cached for TTL seconds
+    profile = model.objects.using(shards.HOME).filter(pk=pk).values(*fields).first()
+    # missing rows are not cached: a new account must show up at once
+    if profile is not None:
+        backend.set(_key(kind, pk), profile)
+    return profile
+
+
+def invalidate(kind, pk):
+    get_backend().delete(_key(kind, pk))
+    _count(kind, 'invalidations')
+
+
+def stats():
+    """Counters of this process, per kind, plus the backend in use."""
+    config = get_config()
+    backend = get_backend()
+    with _lock:
+        result = {
+            'backend': config['BACKEND'],
+            'ttl': config['TTL'],
+            'kinds': {kind: dict(counters) for kind, counters in _counters.items()},
+        }
+    for counters in result['kinds'].values():
+        lookups = counters['hits'] + counters['misses']
+        counters['hit_ratio'] = round(counters['hits'] / lookups, 4) if lookups else None
+    if isinstance(backend, LRUCache):
+        result['size'] = len(backend)
+        result['maxsize'] = backend.maxsize
+    return result
+
+
+def invalidate_on_write(sender, instance, using, **kwargs):
+    # once committed: dropped any earlier, a miss in between would cache the old row again
+    kind, pk = KINDS[sender], instance.pk
+    transaction.on_commit(lambda: invalidate(kind, pk), using=using, robust=True)
+
+
+for _model in KINDS:
+    post_save.connect(invalidate_on_write, sender=_model, dispatch_uid=f'profile_cache_save_{_model.__name__}')
+    post_delete.connect(invalidate_on_write, sender=_model, dispatch_uid=f'profile_cache_delete_{_model.__name__}')
@@ -0,0 +1,242 @@
+"""
+Opt-in profiling for core API views.
+
+Enabled through ``CORE_PROFILING`` in settings. A request is profiled when
+its URL name is picked by the per-route sample rate, or when its profiling
+header carries a valid admin token (core.tokens). Each profiled request is
+written as a collapsed-stack file (one ``frame;frame;frame count`` line per
+stack) that flamegraph.pl, speedscope and inferno can read directly.
+"""
+
+import cProfile
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.urls import Resolver404, resolve
+
+from . import tokens
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': False,
+    # 'cprofile' is deterministic; 'sample' polls the request thread's stack
+    'MODE': 'sample',
+    'SAMPLE_INTERVAL': 0.005,
+    # fraction of requests to profile, per URL name ('*' is the fallback)
+    'SAMPLE_RATES': {},
+    # carries an admin's token; None turns profiling on request off
+    'HEADER': 'X-Profile-Token',
+    'OUTPUT_DIR': None,
+    'MAX_DIR_BYTES': 50 * 1024 * 1024,
+}
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'CORE_PROFILING', {}))
+    if not config['OUTPUT_DIR']:
+        config['OUTPUT_DIR'] = Path(settings.BASE_DIR) / 'profiles'
+    return config
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _cprofile_label(func):
+    filename, lineno, name = func
+    if filename == '~':
+        # built-ins are reported as ('~', 0, '<built-in method ...>')
+        return name
+    return f"{name} ({os.path.basename(filename)}:{lineno})"
+
+
+class StackSampler:
+    """Samples the stack of one thread at a fixed interval."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='core-profiler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self):
+        return self.stacks
+
+
+class CProfileCollector:
+    """Deterministic profile folded into collapsed stacks.
+
+    cProfile only records caller/callee pairs, so full stacks are rebuilt by
+    walking callers and splitting each function's own time between them in
+    proportion to the time each caller spent in it (the same approximation
+    flameprof uses). Counts are in microseconds.
+    """
+
+    MAX_DEPTH = 64
+
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+
+    def start(self):
+        self.profiler.enable()
+
+    def stop(self):
+        self.profiler.disable()
+
+    def collapsed(self):
+        self.profiler.create_stats()
+        stats = self.profiler.stats
+        stacks = Counter()
+
+        def walk(func, weight, suffix, seen):
+            callers = stats[func][4]
+            total = sum(c[3] for c in callers.values())
+            if not callers or total <= 0 or len(suffix) >= self.MAX_DEPTH:
+                stacks[';'.join(reversed(suffix))] += weight
+                return
+            for caller, caller_stats in callers.items():
+                if caller in seen or caller not in stats:
+                    stacks[';'.join(reversed(suffix))] += weight * caller_stats[3] / total
+                    continue
+                walk(caller, weight * caller_stats[3] / total,
+                     suffix + [_cprofile_label(caller)], seen | {caller})
+
+        for func, (_cc, _nc, tottime, _ct, _callers) in stats.items():
+            if tottime > 0:
+                walk(func, tottime * 1e6, [_cprofile_label(func)], {func})
+
+        return Counter({stack: int(round(n)) for stack, n in stacks.items() if n >= 0.5})
+
+
+def write_collapsed(stacks, output_dir, name, max_bytes):
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    path = output_dir / f"{name}-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{random.randrange(16 ** 6):06x}.folded"
+    with open(path, 'w') as fh:
+        for stack, count in stacks.most_common():
+            fh.write(f"{stack} {count}\n")
+    rotate(output_dir, max_bytes, keep=path)
+    return path
+
+
+def rotate(output_dir, max_bytes, keep=None):
+    """Delete the oldest profiles until the directory fits in ``max_bytes``.
+
+    ``keep`` (the profile just written) is never removed, even if it alone
+    is over the cap.
+    """
+    files = []
+    for entry in os.scandir(output_dir):
+        if entry.is_file() and entry.name.endswith('.folded') and entry.path != str(keep):
+            st = entry.stat()
+            files.append((st.st_mtime, st.st_size, entry.path))
+    files.sort()
+    total = sum(size for _, size, _ in files)
+    if keep is not None:
+        total += os.path.getsize(keep)
+    for _, size, path in files:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+class ProfilingMiddleware:
+    """Profiles sampled or explicitly requested calls into core views.
+
+    Keep this last in ``MIDDLEWARE`` so only the view itself is measured.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.config = get_config()
+
+    def __call__(self, request):
+        match = self.resolve(request)
+        if match is None or not self.should_profile(request, match):
+            return self.get_response(request)
+
+        config = self.config
+        if config['MODE'] == 'cprofile':
+            collector = CProfileCollector()
+        else:
+            collector = StackSampler(threading.get_ident(), config['SAMPLE_INTERVAL'])
+
+        collector.start()
+        try:
+            return self.get_response(request)
+        finally:
+            collector.stop()
+            name = match.url_name or match.func.__name__
+            try:
+                stacks = collector.collapsed()
+                if stacks:
+                    write_collapsed(stacks, config['OUTPUT_DIR'], name, config['MAX_DIR_BYTES'])
+            except Exception:
+                # a profile that cannot be written must not replace the view's response
+                logger.exception("could not write the profile of %s", name)
+
+    def resolve(self, request):
+        """The route of a request that could be profiled, or None.
+
+        Views are only resolved by the handler after the middleware chain, so
+        it is looked up here once profiling is on or the header is present.
+        """
+        config = self.config
+        if not config['ENABLED'] and not (config['HEADER'] and config['HEADER'] in request.headers):
+            return None
+        try:
+            match = resolve(request.path_info, getattr(request, 'urlconf', None))
+        except Resolver404:
+            return None
+        func = match.func
+        if not func.__module__.startswith('core.'):
+            return None
+        # async views (event streams) return before they do any work
+        if iscoroutinefunction(func):
+            return None
+        return match
+
+    def should_profile(self, request, match):
+        config = self.config
+        supplied = request.headers.get(config['HEADER']) if config['HEADER'] else None
+        if supplied:
+            actor = tokens.verify_token(supplied)
+            if actor is not None and actor.role == 'admin':
+                return True
+        if not config['ENABLED']:
+            return False
+        rates = config['SAMPLE_RATES']
+        rate = rates.get(match.url_name, rates.get('*', 0))
+        return rate > 0 and random.random() < rate
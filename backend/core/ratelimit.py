@@ -0,0 +1,256 @@
+"""
+Rate limiting and admission control for the core URLs.
+
+``CORE_RATE_LIMITS`` maps URL names to token buckets::
+
+    'submit_payment': {'rate': 0.5, 'burst': 5, 'keys': ['user', 'ip']},
+
+``rate`` is tokens per second, ``burst`` the bucket size, and ``keys`` says
+which buckets a request draws from: ``user`` (the token's actor, if any),
+``ip`` (the client address) and ``route`` (one bucket shared by everyone).
+A request must get a token from every bucket; otherwise it is answered
+with 429 and ``Retry-After`` before the view (and the database) is touched.
+
+Buckets live in one of two backends, chosen by ``CORE_RATE_LIMIT_BACKEND``:
+
+* ``memory`` - a per-process dict; limits apply per worker.
+* ``file`` - a fixed-size table in a memory-mapped file guarded by
+  ``flock``, shared by every worker process on the host.
+
+Separately, ``CORE_ADMISSION['MAX_INFLIGHT']`` caps how many requests may
+be inside core views at once per process. Keep it at or below the database
+pool size so a burst queues here, briefly, instead of at the database.
+"""
+
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+
+from django.conf import settings
+from django.http import JsonResponse
+
+from .lru import LRUCache
+from .tokens import claimed_actor
+
+
+def refill(tokens, updated, now, rate, burst):
+    return min(burst, tokens + (now - updated) * rate)
+
+
+def take(tokens, updated, now, rate, burst):
+    """Bucket step: ``(allowed, tokens_after, retry_after)``."""
+    tokens = refill(tokens, updated, now, rate, burst)
+    if tokens >= 1:
+        return True, tokens - 1, 0.0
+    return False, tokens, (1 - tokens) / rate if rate > 0 else 60.0
+
+
+class MemoryBackend:
+    def __init__(self, maxsize=100000):
+        # idle buckets are full again after burst/rate seconds, so they can be
+        # evicted by the LRU without changing any decision
+        self._buckets = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    def acquire(self, keys, now=None):
+        """``keys`` is a list of ``(key, rate, burst)``; all or nothing."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            states = []
+            worst = 0.0
+            for key, rate, burst in keys:
+                tokens, updated = self._buckets.get(key) or (burst, now)
+                allowed, after, retry = take(tokens, updated, now, rate, burst)
+                states.append((key, rate, burst, tokens, updated, after))
+                if not allowed:
+                    worst = max(worst, retry)
+            if worst:
+                return False, worst
+            for key, rate, burst, _tokens, _updated, after in states:
+                self._buckets.set(key, (after, now), ttl=burst / rate if rate > 0 else None)
+            return True, 0.0
+
+
+class FileBackend:
+    """Buckets in a shared, memory-mapped open-addressing table.
+
+    Each slot is ``(key digest, tokens, updated)``. Keys hash to a slot and
+    probe up to ``PROBE`` neighbours; if none is free, the least recently
+    updated one is taken over (which at worst hands a fresh, full bucket to
+    a key that collided). Times are wall-clock so all processes agree.
+    """
+
+    SLOT = struct.Struct('<Qdd')
+    PROBE = 8
+
+    def __init__(self, path, slots=65536):
+        self.path = path
+        self.slots = slots
+        size = self.SLOT.size * slots
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self._lock_file = open(path, 'rb')
+        self._thread_lock = threading.Lock()
+
+    def _digest(self, key):
+        # 0 marks an empty slot
+        return int.from_bytes(hashlib.blake2b(repr(key).encode(), digest_size=8).digest(), 'little') or 1
+
+    def _find(self, digest):
+        start = digest % self.slots
+        oldest = None
+        for i in range(self.PROBE):
+            index = (start + i) % self.slots
+            slot_digest, tokens, updated = self.SLOT.unpack_from(self._map, index * self.SLOT.size)
+            if slot_digest == digest:
+                return index, tokens, updated
+            if slot_digest == 0:
+                return index, None, None
+            if oldest is None or updated < oldest[1]:
+                oldest = (index, updated)
+        return oldest[0], None, None
+
+    def acquire(self, keys, now=None):
+        now = time.time() if now is None else now
+        with self._thread_lock:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                writes = []
+                worst = 0.0
+                for key, rate, burst in keys:
+                    digest = self._digest(key)
+                    index, tokens, updated = self._find(digest)
+                    if tokens is None:
+                        tokens, updated = burst, now
+                    allowed, after, retry = take(tokens, updated, now, rate, burst)
+                    writes.append((index, digest, after))
+                    if not allowed:
+                        worst = max(worst, retry)
+                if worst:
+                    return False, worst
+                for index, digest, after in writes:
+                    self.SLOT.pack_into(self._map, index * self.SLOT.size, digest, after, now)
+                return True, 0.0
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+
+class InflightLimiter:
+    """Caps concurrent requests in core views for this process."""
+
+    def __init__(self, limit, wait):
+        self.limit = limit
+        self.wait = wait
+        self.current = 0
+        self.peak = 0
+        self._semaphore = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self._semaphore.acquire(timeout=self.wait):
+            return False
+        with self._lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+        return True
+
+    def release(self):
+        with self._lock:
+            self.current -= 1
+        self._semaphore.release()
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def _process_wide(key, factory):
+    # one backend/limiter per process, however many handlers load the middleware
+    with _shared_lock:
+        if key not in _shared:
+            _shared[key] = factory()
+        return _shared[key]
+
+
+def get_backend():
+    kind = getattr(settings, 'CORE_RATE_LIMIT_BACKEND', 'memory')
+    if kind == 'file':
+        path = str(getattr(settings, 'CORE_RATE_LIMIT_FILE', os.path.join(settings.BASE_DIR, 'ratelimit.buckets')))
+        return _process_wide(('file', path), lambda: FileBackend(path))
+    if kind == 'memory':
+        return _process_wide(('memory',), MemoryBackend)
+    raise ValueError(f"Unknown CORE_RATE_LIMIT_BACKEND {kind!r}")
+
+
+def get_inflight_limiter():
+    """The process-wide limiter for ``CORE_ADMISSION``, or None if disabled."""
+    admission = getattr(settings, 'CORE_ADMISSION', {})
+    limit = admission.get('MAX_INFLIGHT')
+    if not limit:
+        return None
+    wait = admission.get('WAIT', 0.05)
+    return _process_wide(('inflight', limit, wait), lambda: InflightLimiter(limit, wait))
+
+
+def _too_many(message, retry_after, status=429):
+    response = JsonResponse({'success': False, 'error': message}, status=status)
+    response['Retry-After'] = str(max(1, int(retry_after + 0.999)))
+    return response
+
+
+class RateLimitMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.rules = getattr(settings, 'CORE_RATE_LIMITS', {})
+        self.backend = get_backend()
+        self.inflight = get_inflight_limiter()
+
+    def __call__(self, request):
+        try:
+            return self.get_response(request)
+        finally:
+            if getattr(request, '_core_admitted', False):
+                self.inflight.release()
+
+    def bucket_keys(self, request, url_name, rule):
+        keys = []
+        for kind in rule.get('keys', ('ip',)):
+            if kind == 'user':
+                actor = claimed_actor(request)
+                if actor is None:
+                    continue
+                ident = f'{actor.role}:{actor.user_id}'
+            elif kind == 'ip':
+                ident = request.META.get('REMOTE_ADDR', '')
+            elif kind == 'route':
+                ident = '*'
+            else:
+                raise ValueError(f"Unknown rate limit key {kind!r}")
+            keys.append(((url_name, kind, ident), rule['rate'], rule['burst']))
+        return keys
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not view_func.__module__.startswith('core.'):
+            return None
+        match = request.resolver_match
+        url_name = match.url_name if match else None
+        rule = self.rules.get(url_name)
+        if rule:
+            allowed, retry_after = self.backend.acquire(self.bucket_keys(request, url_name, rule))
+            if not allowed:
+                return _too_many('Too many requests. Slow down.', retry_after)
+        if self.inflight is not None:
+            if not self.inflight.acquire():
+                return _too_many('Server busy. Try again shortly.', 1, status=503)
+            request._core_admitted = True
+        return None
@@ -0,0 +1,426 @@
+"""
+Monthly station reports: violations by type, fines issued against fines
+collected, and collections by payment method.
+
+A report is summed from per-day totals (``StationDayTotal``), so a month is
+never read from the ticket tables in one go. The receivers below stamp the
+``ReportDay`` of a station's day when one of its tickets, details or
+payments is written; ``build`` recomputes only the days stamped since they
+were last computed (and days never computed), each station's from its own
+database (core.shards). Days are UTC days: tickets count on the day they
+were issued, collections on the day the payment was made. A ticket counts
+for the station stored on it when it was issued, so it stays there when its
+officer moves; tickets from before that column count for their officer's
+current station, and tickets without ``issued_at`` are not counted.
+
+A finished month is rendered once per format into ``CORE_REPORTS['DIR']``.
+The file name carries a digest of when each of its days was computed, so a
+file is never rewritten: a late change to the month (say a payment approved
+after month end) gives a new name on the next request, and the files it
+supersedes are deleted once the new one is in place. The current month is streamed straight from the
+day totals. ``build_station_reports`` builds many stations at once in a
+process pool.
+"""
+
+import csv
+import hashlib
+import io
+import logging
+import os
+import tempfile
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.html import escape
+from django.utils.text import slugify
+
+from . import fees, shards
+from .models import LawOfficer, Payment, ReportDay, StationDayTotal, Violation, ViolationDetail, ViolationType
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'DIR': 'reports',
+    # processes used by build_station_reports
+    'WORKERS': 4,
+}
+
+# payment status that counts as collected (as set by update_payment_status)
+COLLECTED = 'completed'
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'CORE_REPORTS', {}))
+    return config
+
+
+def parse_month(value):
+    """``date`` of the first day of a ``YYYY-MM`` month; raises ValueError."""
+    return datetime.strptime(value, '%Y-%m').date()
+
+
+def month_days(month):
+    """``(first, end)`` days of the month holding ``month``; ``end`` is exclusive."""
+    first = month.replace(day=1)
+    end = (first + timedelta(days=32)).replace(day=1)
+    return first, end
+
+
+def today():
+    return timezone.now().astimezone(dt_timezone.utc).date()
+
+
+def finished(month):
+    return month_days(month)[1] <= today()
+
+
+def stations():
+    """Every station with at least one officer."""
+    return list(
+        LawOfficer.objects.using(shards.HOME)
+        .exclude(station='').order_by('station').values_list('station', flat=True).distinct()
+    )
+
+
+def _day(value):
+    return value.astimezone(dt_timezone.utc).date() if value else None
+
+
+def _start(day):
+    return datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+
+
+def touch(station, day, using=shards.HOME):
+    """Marks a station's day as changed, so the next build recomputes it."""
+    ReportDay.objects.using(using).bulk_create(
+        [ReportDay(station=station, day=day, changed_at=timezone.now())],
+        update_conflicts=True, unique_fields=['station', 'day'], update_fields=['changed_at'],
+    )
+
+
+def _station_of(station, officer_id):
+    """A ticket's station: the one stored on it, else its officer's current one."""
+    if station:
+        return station
+    return shards.station(officer_id) if officer_id is not None else ''
+
+
+def _touch_on_commit(station, officer_id, day, using):
+    if day is None:
+        return
+    station = _station_of(station, officer_id)
+    if station:
+        home = shards.home(using)
+        # after the commit, so a build that starts later sees the write
+        transaction.on_commit(lambda: touch(station, day, home), using=using, robust=True)
+
+
+@receiver(pre_save, sender=Violation, dispatch_uid='reports_violation_moving')
+def remember_day(sender, instance, using, update_fields=None, **kwargs):
+    # an edit of issued_at, the station or the officer moves the ticket off a
+    # day whose totals then need recomputing too
+    instance._report_before = None
+    if instance._state.adding or instance.pk is None:
+        return
+    if update_fields is not None and not {'issued_at', 'station', 'law_officer', 'law_officer_id'} & set(update_fields):
+        return
+    instance._report_before = (
+        Violation.objects.using(using).filter(pk=instance.pk)
+        .values_list('station', 'law_officer_id', 'issued_at').first()
+    )
+
+
+@receiver(post_save, sender=Violation, dispatch_uid='reports_violation_saved')
+@receiver(post_delete, sender=Violation, dispatch_uid='reports_violation_deleted')
+def touch_violation(sender, instance, using, **kwargs):
+    _touch_on_commit(instance.station, instance.law_officer_id, _day(instance.issued_at), using)
+    before, instance._report_before = getattr(instance, '_report_before', None), None
+    if before and before != (instance.station, instance.law_officer_id, instance.issued_at):
+        _touch_on_commit(before[0], before[1], _day(before[2]), using)
+
+
+@receiver(post_save, sender=ViolationDetail, dispatch_uid='reports_detail_saved')
+@receiver(post_delete, sender=ViolationDetail, dispatch_uid='reports_detail_deleted')
+def touch_detail(sender, instance, using, **kwargs):
+    # register_violation bulk-creates details (no signal); its ticket's save covers them
+    ticket = (
+        Violation.objects.using(using).filter(pk=instance.violation_id)
+        .values_list('station', 'law_officer_id', 'issued_at').first()
+    )
+    if ticket:
+        _touch_on_commit(ticket[0], ticket[1], _day(ticket[2]), using)
+
+
+@receiver(post_save, sender=Payment, dispatch_uid='reports_payment_saved')
+@receiver(post_delete, sender=Payment, dispatch_uid='reports_payment_deleted')
+def touch_payment(sender, instance, using, **kwargs):
+    ticket = Violation.objects.using(using).filter(pk=instance.violation_id).values_list(
+        'station', 'law_officer_id').first()
+    if ticket:
+        _touch_on_commit(ticket[0], ticket[1], _day(instance.payment_date), using)
+
+
+def _stale(station, first, end, using):
+    """Days from ``first`` to ``end`` (exclusive) whose totals are missing or out of date."""
+    known = {
+        day: (changed_at, built_at)
+        for day, changed_at, built_at in ReportDay.objects.using(using)
+        .filter(station=station, day__gte=first, day__lt=end)
+        .values_list('day', 'changed_at', 'built_at')
+    }
+    days = []
+    for n in range((end - first).days):
+        day = first + timedelta(days=n)
+        changed_at, built_at = known.get(day, (None, None))
+        if built_at is None or (changed_at is not None and changed_at >= built_at):
+            days.append(day)
+    return days
+
+
+def _totals(station, days):
+    """``{(day, metric, key): (count, centavos)}`` for ``days``, from the station's database."""
+    alias = shards.for_station(station)
+    # tickets from before the station was stored on them count for their officer's
+    officers = list(LawOfficer.objects.using(shards.HOME).filter(station=station).values_list('pk', flat=True))
+
+    def at_station(prefix=''):
+        return Q(**{f'{prefix}station': station}) | Q(**{
+            f'{prefix}station__isnull': True, f'{prefix}law_officer_id__in': officers,
+        })
+
+    start, end = _start(min(days)), _start(max(days) + timedelta(days=1))
+    wanted = set(days)
+    totals = {}
+
+    def add(metric, rows):
+        for day, key, n, amount in rows:
+            if day in wanted:
+                totals[day, metric, '' if key is None else str(key)] = (n, fees.to_centavos(amount or 0))
+
+    tickets = Violation.objects.using(alias).filter(at_station(), issued_at__gte=start, issued_at__lt=end)
+    add(StationDayTotal.ISSUED, (
+        (day, None, n, amount) for day, n, amount in
+        tickets.annotate(day=TruncDate('issued_at', tzinfo=dt_timezone.utc))
+        .values_list('day').annotate(n=Count('pk'), amount=Sum('total_fee')).order_by()
+    ))
+    add(StationDayTotal.TYPE, (
+        ViolationDetail.objects.using(alias)
+        .filter(at_station('violation__'), violation__issued_at__gte=start, violation__issued_at__lt=end)
+        .annotate(day=TruncDate('violation__issued_at', tzinfo=dt_timezone.utc))
+        .values_list('day', 'violation_type_id').annotate(n=Count('pk'), amount=Sum('fee_at_time')).order_by()
+    ))
+    add(StationDayTotal.COLLECTED, (
+        Payment.objects.using(alias)
+        .filter(at_station('violation__'), status=COLLECTED, payment_date__gte=start, payment_date__lt=end)
+        .annotate(day=TruncDate('payment_date', tzinfo=dt_timezone.utc))
+        .values_list('day', 'payment_type').annotate(n=Count('pk'), amount=Sum('amount_paid')).order_by()
+    ))
+    return totals
+
+
+def build(station, month, using=shards.HOME):
+    """Recomputes the out-of-date days of a station's month (up to today); returns them."""
+    first, end = month_days(month)
+    end = min(end, today() + timedelta(days=1))
+    if not _stale(station, first, end, using):
+        return []
+    with transaction.atomic(using=using):
+        # one build of a station's month at a time: a concurrent one waits
+        # here for this to commit, then finds nothing left to recompute
+        ReportDay.objects.using(using).bulk_create(
+            [ReportDay(station=station, day=first + timedelta(days=n)) for n in range((end - first).days)],
+            ignore_conflicts=True,
+        )
+        list(
+            ReportDay.objects.using(using).select_for_update()
+            .filter(station=station, day__gte=first, day__lt=end).values_list('pk', flat=True)
+        )
+        days = _stale(station, first, end, using)
+        if not days:
+            return []
+        # a write stamped after this is picked up by the next build
+        started = timezone.now()
+        totals = _totals(station, days)
+        StationDayTotal.objects.using(using).filter(station=station, day__in=days).delete()
+        StationDayTotal.objects.using(using).bulk_create([
+            StationDayTotal(station=station, day=day, metric=metric, key=key, count=n, amount_centavos=amount)
+            for (day, metric, key), (n, amount) in totals.items()
+        ])
+        ReportDay.objects.using(using).filter(station=station, day__in=days).update(built_at=started)
+    return days
+
+
+def report(station, month, using=shards.HOME):
+    """The month's totals, summed from the day totals (call ``build`` first)."""
+    first, end = month_days(month)
+    sums = {}
+    rows = (
+        StationDayTotal.objects.using(using)
+        .filter(station=station, day__gte=first, day__lt=end)
+        .values_list('metric', 'key', 'count', 'amount_centavos')
+    )
+    for metric, key, n, amount in rows:
+        count, total = sums.get((metric, key), (0, 0))
+        sums[metric, key] = (count + n, total + amount)
+    type_names = dict(ViolationType.objects.using(using).values_list('violation_type', 'violation_name'))
+
+    def lines(metric, label):
+        found = [(label(key), n, amount) for (m, key), (n, amount) in sums.items() if m == metric]
+        return sorted(found, key=lambda line: (-line[2], line[0]))
+
+    issued = sums.get((StationDayTotal.ISSUED, ''), (0, 0))
+    methods = lines(StationDayTotal.COLLECTED, lambda key: key or 'Unknown')
+    collected = (sum(n for _label, n, _amount in methods), sum(amount for _label, _n, amount in methods))
+    return {
+        'station': station,
+        'month': f'{first:%Y-%m}',
+        'final': finished(month),
+        'issued': issued,
+        'collected': collected,
+        'types': lines(StationDayTotal.TYPE, lambda key: type_names.get(int(key), f'Type {key}') if key else 'Untyped'),
+        'methods': methods,
+    }
+
+
+def _csv_row(*values):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(values)
+    return buffer.getvalue()
+
+
+def render_csv(data):
+    """The report as CSV, one line at a time."""
+    yield _csv_row('station', 'month', 'section', 'item', 'count', 'amount')
+    head = (data['station'], data['month'])
+    yield _csv_row(*head, 'summary', 'Fines issued', data['issued'][0], fees.pesos(data['issued'][1]))
+    yield _csv_row(*head, 'summary', 'Fines collected', data['collected'][0], fees.pesos(data['collected'][1]))
+    yield _csv_row(*head, 'summary', 'Outstanding', '', fees.pesos(data['issued'][1] - data['collected'][1]))
+    for label, n, amount in data['types']:
+        yield _csv_row(*head, 'violation type', label, n, fees.pesos(amount))
+    for label, n, amount in data['methods']:
+        yield _csv_row(*head, 'payment method', label, n, fees.pesos(amount))
+
+
+def _html_table(title, rows):
+    yield f'<h2>{escape(title)}</h2>\n<table>\n<tr><th></th><th>Count</th><th>Amount (PHP)</th></tr>\n'
+    for label, n, amount in rows:
+        yield f'<tr><td>{escape(label)}</td><td>{n}</td><td>{fees.pesos(amount):,}</td></tr>\n'
+    yield '</table>\n'
+
+
+def render_html(data):
+    """The report as a printable HTML page, a section at a time."""
+    title = f"{data['station']} - {data['month']}"
+    yield (
+        f'<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>{escape(title)}</title>\n'
+        '<style>body{font-family:sans-serif;margin:2em}table{border-collapse:collapse;margin-bottom:1.5em}'
+        'td,th{border:1px solid #999;padding:4px 10px}td+td{text-align:right}'
+        '@media print{body{margin:0}}</style></head><body>\n'
+        f'<h1>Violation report: {escape(title)}</h1>\n'
+    )
+    if not data['final']:
+        yield '<p>Month in progress; figures are up to today.</p>\n'
+    outstanding = data['issued'][1] - data['collected'][1]
+    yield from _html_table('Summary', [
+        ('Fines issued', data['issued'][0], data['issued'][1]),
+        ('Fines collected', data['collected'][0], data['collected'][1]),
+        ('Outstanding', '', outstanding),
+    ])
+    yield from _html_table('Violations by type', data['types'])
+    yield from _html_table('Collections by payment method', data['methods'])
+    yield '</body></html>\n'
+
+
+# format -> (renderer, content type)
+FORMATS = {
+    'csv': (render_csv, 'text/csv'),
+    'html': (render_html, 'text/html'),
+}
+
+
+def _digest(station, month, using):
+    first, end = month_days(month)
+    stamps = (
+        ReportDay.objects.using(using)
+        .filter(station=station, day__gte=first, day__lt=end).order_by('day')
+        .values_list('day', 'built_at')
+    )
+    digest = hashlib.sha256()
+    for day, built_at in stamps:
+        digest.update(f'{day}:{built_at.isoformat()};'.encode())
+    return digest.hexdigest()[:16]
+
+
+def path_for(station, month, fmt, using=shards.HOME):
+    """Where the rendered finished month goes; the name changes whenever a day is recomputed."""
+    name = f"{month_days(month)[0]:%Y-%m}-{_digest(station, month, using)}.{fmt}"
+    return Path(get_config()['DIR']) / (slugify(station) or 'station') / name
+
+
+def _remove_superseded(path, month, fmt):
+    """Deletes the month's other ``fmt`` files next to ``path``; a reader that has one open keeps it."""
+    for old in path.parent.glob(f'{month_days(month)[0]:%Y-%m}-*.{fmt}'):
+        if old != path:
+            try:
+                old.unlink(missing_ok=True)
+            except OSError:
+                # e.g. still open on Windows; a later write tries again
+                logger.warning("could not remove superseded report %s", old, exc_info=True)
+
+
+def write(station, month, fmt, using=shards.HOME):
+    """Renders a built, finished month to its file unless it exists; returns the path.
+
+    Files of the month rendered before a late change are deleted.
+    """
+    path = path_for(station, month, fmt, using)
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        render = FORMATS[fmt][0]
+        # rename into place, so readers never see a partial file
+        handle, temp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'w', encoding='utf-8', newline='') as out:
+                out.writelines(render(report(station, month, using)))
+            os.replace(temp, path)
+        except BaseException:
+            os.unlink(temp)
+            raise
+        _remove_superseded(path, month, fmt)
+    return path
+
+
+def open_report(station, month, fmt, using=shards.HOME):
+    """Builds what is out of date and returns ``(chunks, content type)``.
+
+    ``chunks`` is an open binary file for a finished month, else a generator
+    of text.
+    """
+    render, content_type = FORMATS[fmt]
+    build(station, month, using)
+    if finished(month):
+        return open(write(station, month, fmt, using), 'rb'), content_type
+    return render(report(station, month, using)), content_type
+
+
+def build_and_write(station, month, formats=('csv', 'html')):
+    """Builds a station's month and, once it is finished, writes its files.
+
+    Module-level so ``build_station_reports`` can send it to a process pool.
+    """
+    days = build(station, month)
+    paths = [str(write(station, month, fmt)) for fmt in formats] if finished(month) else []
+    return station, len(days), paths
+
+
+def last_month():
+    """First day of the month before this one."""
+    return (today().replace(day=1) - timedelta(days=1)).replace(day=1)
@@ -0,0 +1,204 @@
+"""
+Payment review queue shared by the admins on shift.
+
+``claim`` hands an admin a lease on the oldest payments still ``For
+Checking``, up to ``limit`` of them, including any the admin already holds
+(those are renewed). Until the lease runs out (``LEASE`` seconds) no other
+admin is given those payments, and ``update_payment_status`` refuses them to
+anyone but the holder. Approving a payment or calling ``release`` ends its
+lease; an expired lease is simply taken over by the next claim.
+
+A payment is claimed by inserting its lease row, whose primary key is the
+payment id, or by taking over an expired one with a conditional update, so
+two claims can never both get the same payment. On Postgres the candidate
+payments are also read with ``FOR UPDATE SKIP LOCKED``, so concurrent claims
+pick different payments instead of losing the same ones to each other; on
+SQLite claims take turns on a ``JobLock`` row.
+
+Leases are kept in the home database, payments in their station's database
+(core.shards), so the two are never joined: the live leases are read first
+and left out of each database's candidates by id. The candidates of every
+database stay locked until the leases are written.
+"""
+
+import heapq
+import uuid
+from contextlib import ExitStack
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+
+from . import shards
+from .jobs import lock_queues
+from .models import DriverUser, Payment, PaymentReviewLease
+
+PENDING = 'For Checking'
+
+# JobLock row that serialises claims where SKIP LOCKED is not available
+LOCK = 'payment_review'
+
+DEFAULTS = {
+    'LEASE': 300,
+    'BATCH': 10,
+    'MAX_BATCH': 50,
+    # claim rounds before settling for fewer than ``limit`` payments
+    'ATTEMPTS': 3,
+}
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'CORE_REVIEW_QUEUE', {}))
+    return config
+
+
+def _active(now):
+    return PaymentReviewLease.objects.filter(leased_until__gt=now)
+
+
+def _leased(now):
+    """``{alias: ids}`` of the payments under a live lease."""
+    return shards.group(_active(now).values_list('payment_id', flat=True))
+
+
+def _round(lto_user_id, claim_id, need, now, until):
+    """Leases up to ``need`` unleased pending payments; returns how many were tried."""
+    with ExitStack() as stack:
+        # the shards first, as in shards.atomic: they commit after the leases
+        for alias in [*shards.shard_aliases(), shards.HOME]:
+            stack.enter_context(transaction.atomic(using=alias))
+        if not connections[shards.HOME].features.has_select_for_update_skip_locked:
+            # as in core.jobs: take SQLite's write lock before reading, so claims
+            # run one at a time instead of racing for the same payments
+            lock_queues([LOCK], now)
+        leased = _leased(now)
+        candidates = []
+        for alias in shards.aliases():
+            pending = (
+                Payment.objects.using(alias)
+                .filter(status=PENDING)
+                .exclude(pk__in=leased.get(alias, []))
+                .order_by('payment_date', 'payment_id')
+            )
+            if connections[alias].features.has_select_for_update_skip_locked:
+                pending = pending.select_for_update(skip_locked=True, of=('self',))
+            candidates.extend(pending.values_list('payment_date', 'payment_id')[:need])
+        # the oldest ``need`` of every database's oldest ``need``
+        ids = [pk for _date, pk in heapq.nsmallest(need, candidates)]
+        if not ids:
+            return 0
+        PaymentReviewLease.objects.bulk_create(
+            [PaymentReviewLease(payment_id=pk, lto_user_id=lto_user_id, claim=claim_id, leased_until=until)
+             for pk in ids],
+            ignore_conflicts=True,
+        )
+        # leases that ran out are taken over only if they are still expired
+        PaymentReviewLease.objects.filter(payment_id__in=ids, leased_until__lte=now).update(
+            lto_user_id=lto_user_id, claim=claim_id, leased_until=until)
+    return len(ids)
+
+
+def claim(lto_user_id, limit=None):
+    """Leases up to ``limit`` payments to the admin; returns them oldest first."""
+    config = get_config()
+    limit = max(1, min(limit or config['BATCH'], config['MAX_BATCH']))
+    now = timezone.now()
+    until = now + timedelta(seconds=config['LEASE'])
+    claim_id = uuid.uuid4()
+
+    # what the admin still holds counts toward the limit and is renewed
+    _active(now).filter(lto_user_id=lto_user_id).update(claim=claim_id, leased_until=until)
+    mine = PaymentReviewLease.objects.filter(lto_user_id=lto_user_id, claim=claim_id)
+    won = mine.count()
+    for _ in range(config['ATTEMPTS']):
+        if won >= limit or not _round(lto_user_id, claim_id, limit - won, now, until):
+            break
+        won = mine.count()
+
+    held = set(mine.values_list('payment_id', flat=True))
+    rows = []
+    for alias, ids in shards.group(held).items():
+        rows.extend(
+            Payment.objects.using(alias)
+            .filter(pk__in=ids, status=PENDING)
+            .values('payment_id', 'driver_user_id', 'violation_id', 'amount_paid',
+                    'transaction_ref', 'status', 'payment_date')
+        )
+    rows.sort(key=lambda p: (p['payment_date'], p['payment_id']))
+    # approved (or removed) by someone before the lease was written
+    done = held - {p['payment_id'] for p in rows}
+    if done:
+        mine.filter(payment_id__in=done).delete()
+    names = dict(DriverUser.objects.filter(pk__in={p['driver_user_id'] for p in rows}).values_list('pk', 'full_name'))
+    payments = [
+        {
+            'id': p['payment_id'],
+            'driver': names.get(p['driver_user_id']) or '',
+            'violation_id': p['violation_id'],
+            'amount': float(p['amount_paid']),
+            'transaction_ref': p['transaction_ref'],
+            'status': p['status'].lower(),
+            'payment_date': p['payment_date'].isoformat(),
+        }
+        for p in rows
+    ]
+    return {'leased_until': until.isoformat(), 'payments': payments}
+
+
+def release(lto_user_id, payment_ids=None):
+    """Gives back the admin's leases (all of them, or only ``payment_ids``)."""
+    leases = PaymentReviewLease.objects.filter(lto_user_id=lto_user_id)
+    if payment_ids is not None:
+        leases = leases.filter(payment_id__in=payment_ids)
+    removed, _ = leases.delete()
+    return removed
+
+
+def holder(payment_id):
+    """The admin holding a live lease on the payment, or None."""
+    return _active(timezone.now()).filter(payment_id=payment_id).values_list('lto_user_id', flat=True).first()
+
+
+def close(payment_id):
+    """Ends the payment's lease once it has been reviewed."""
+    PaymentReviewLease.objects.filter(payment_id=payment_id).delete()
+
+
+def stats(lto_user_id=None):
+    """Queue depth, how much of it is leased, and the age of the oldest payments."""
+    now = timezone.now()
+    leases = _leased(now)
+
+    def count(alias):
+        leased = Q(pk__in=leases.get(alias, []))
+        return Payment.objects.filter(status=PENDING).aggregate(
+            depth=Count('payment_id'),
+            leased=Count('payment_id', filter=leased),
+            oldest=Min('payment_date'),
+            oldest_available=Min('payment_date', filter=~leased),
+        )
+
+    counts = [c for _alias, c in shards.fan_out(count)]
+    totals = {
+        'depth': sum(c['depth'] for c in counts),
+        'leased': sum(c['leased'] for c in counts),
+        'oldest': min((c['oldest'] for c in counts if c['oldest']), default=None),
+        'oldest_available': min((c['oldest_available'] for c in counts if c['oldest_available']), default=None),
+    }
+
+    def age(value):
+        return round((now - value).total_seconds()) if value else None
+
+    result = {
+        'depth': totals['depth'],
+        'leased': totals['leased'],
+        'available': totals['depth'] - totals['leased'],
+        'oldest_age_seconds': age(totals['oldest']),
+        'oldest_available_age_seconds': age(totals['oldest_available']),
+    }
+    if lto_user_id is not None:
+        result['mine'] = _active(now).filter(lto_user_id=lto_user_id).count()
+    return result
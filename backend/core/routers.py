@@ -0,0 +1,129 @@
+"""
+Database routing for the core app.
+
+``StationShardRouter`` keeps tickets, details and payments on the database
+of their station (see core.shards) and everything else on ``default``.
+``PrimaryReplicaRouter`` sends reads made by the views in
+``CORE_REPLICA_VIEWS`` to the ``replica`` alias and everything else to
+``default``. ``ReplicaRoutingMiddleware`` decides per request whether the
+replica may be used: once a client writes, it is pinned to the primary for
+``CORE_REPLICA_PIN_SECONDS`` (via a signed cookie, so no session lookup) so
+it always reads its own writes while the replica catches up.
+"""
+
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core import signing
+from django.db import connections
+
+from . import shards
+
+REPLICA = 'replica'
+PIN_COOKIE = 'lto_primary_pin'
+
+# per-request routing state; ContextVar so it also works for async views
+_use_replica = ContextVar('core_use_replica', default=False)
+_wrote = ContextVar('core_wrote', default=False)
+
+
+def replica_available():
+    return REPLICA in connections.databases
+
+
+class StationShardRouter:
+    """Routes the sharded models; defers everything on the home database to the next router."""
+
+    def _route(self, model, hints):
+        instance = hints.get('instance')
+        db = getattr(getattr(instance, '_state', None), 'db', None)
+        if model._meta.label in shards.SHARDED_MODELS:
+            # rows reached from a ticket or payment live where it does
+            if db is not None and instance._meta.label in shards.SHARDED_MODELS:
+                return db
+            return shards.current()
+        if db is not None and shards.is_shard(db):
+            # a driver, officer or violation type reached from a sharded row
+            return shards.HOME
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self._route(model, hints)
+
+    def db_for_write(self, model, **hints):
+        db = self._route(model, hints)
+        if db is not None:
+            _wrote.set(True)
+        return db
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # tickets on a shard point at drivers and officers on the home database
+        if shards.is_shard(obj1._state.db) or shards.is_shard(obj2._state.db):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # shards only hold the unmanaged ticket tables; see init_shards
+        if shards.is_shard(db):
+            return False
+        return None
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _use_replica.get() and replica_available():
+            return REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        _wrote.set(True)
+        # once this request writes, its remaining reads go to the primary too
+        _use_replica.set(False)
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {'default', REPLICA}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == REPLICA:
+            return False
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.replica_views = set(getattr(settings, 'CORE_REPLICA_VIEWS', ()))
+        self.pin_seconds = getattr(settings, 'CORE_REPLICA_PIN_SECONDS', 10)
+
+    def __call__(self, request):
+        replica_token = _use_replica.set(False)
+        wrote_token = _wrote.set(False)
+        try:
+            response = self.get_response(request)
+            if _wrote.get():
+                response.set_signed_cookie(
+                    PIN_COOKIE, str(time.time() + self.pin_seconds),
+                    max_age=self.pin_seconds, httponly=True, samesite='Lax',
+                )
+            return response
+        finally:
+            _use_replica.reset(replica_token)
+            _wrote.reset(wrote_token)
+
+    def pinned(self, request):
+        try:
+            until = float(request.get_signed_cookie(PIN_COOKIE, max_age=self.pin_seconds))
+        except (KeyError, ValueError, signing.BadSignature):
+            return False
+        return until > time.time()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        if match and match.url_name in self.replica_views:
+            _use_replica.set(not self.pinned(request))
+        return None
@@ -0,0 +1,181 @@
+"""
+Schema additions for the unmanaged core tables.
+
+Django does not create anything for ``managed = False`` models, so indexes
+our access paths rely on are kept here as numbered packs and applied from
+migrations (``0002_index_pack_v1`` applies pack 1, and so on). Columns added
+to those tables are kept the same way in ``COLUMN_PACKS``; the model field
+must be nullable, and is declared on the model as well. A pack must never
+change once a migration references it; add a new pack instead.
+
+Tables that do not exist yet are skipped, so the migrations are safe to run
+on an empty database (e.g. Django's test database).
+"""
+
+from django.db import models
+
+INDEX_PACKS = {
+    1: [
+        # driver_penalties, and any per-driver ticket listing by status
+        ('violations_driver_status_idx', 'violations', ('driver_user_id', 'status')),
+        ('violations_officer_idx', 'violations', ('law_of_user_id',)),
+        ('violations_details_violation_idx', 'violations_details', ('violation_id',)),
+        ('violations_details_type_idx', 'violations_details', ('violation_type',)),
+        # get_driver_payments orders a driver's payments by date
+        ('payment_driver_date_idx', 'payment', ('driver_user_id', 'payment_date')),
+        ('payment_violation_idx', 'payment', ('violation_id',)),
+        ('payment_status_date_idx', 'payment', ('status', 'payment_date')),
+        # lto_admin_audit_logs orders an admin's entries by time
+        ('audit_log_lto_user_ts_idx', 'audit_log', ('lto_user', 'timestamp')),
+        ('audit_log_driver_idx', 'audit_log', ('driver_user_id',)),
+        # verify_driver and register_violation look drivers up by name + license
+        ('driver_user_name_license_idx', 'driver_user', ('full_name', 'license_number')),
+    ],
+    2: [
+        # the violations in one hotspot cell over a time range (core.hotspots)
+        ('violations_geocell_issued_idx', 'violations', ('geocell', 'issued_at')),
+    ],
+    3: [
+        # an officer's tickets over a range of days (core.reports)
+        ('violations_officer_issued_idx', 'violations', ('law_of_user_id', 'issued_at')),
+    ],
+    4: [
+        # a station's tickets over a range of days (core.reports)
+        ('violations_station_issued_idx', 'violations', ('station', 'issued_at')),
+    ],
+}
+
+COLUMN_PACKS = {
+    1: [
+        # when a ticket was issued; its fees are looked up by this time (core.fees)
+        ('violations', 'issued_at', models.DateTimeField(null=True)),
+    ],
+    2: [
+        # where the officer's device was when the ticket was issued
+        ('violations', 'latitude', models.FloatField(null=True)),
+        ('violations', 'longitude', models.FloatField(null=True)),
+        # grid cell of latitude/longitude (core.hotspots)
+        ('violations', 'geocell', models.IntegerField(null=True)),
+    ],
+    3: [
+        # the issuing officer's station at the time; reports count the ticket there
+        ('violations', 'station', models.CharField(max_length=100, null=True)),
+    ],
+}
+
+
+def _existing_tables(connection):
+    return set(connection.introspection.table_names())
+
+
+def _index_is_invalid(cursor, name):
+    """True if a failed concurrent build left the (Postgres) index behind, marked invalid."""
+    cursor.execute(
+        "SELECT NOT i.indisvalid FROM pg_index i WHERE i.indexrelid = to_regclass(%s)", [name])
+    row = cursor.fetchone()
+    return bool(row and row[0])
+
+
+def create_index_pack(connection, version):
+    """Create the indexes of pack ``version``; returns the names created."""
+    qn = connection.ops.quote_name
+    tables = _existing_tables(connection)
+    # CONCURRENTLY keeps large tables writable while the index builds; it
+    # cannot run in a transaction, so the migrations using this are atomic = False
+    concurrently = 'CONCURRENTLY ' if connection.vendor == 'postgresql' else ''
+    created = []
+    with connection.cursor() as cursor:
+        for name, table, columns in INDEX_PACKS[version]:
+            if table not in tables:
+                continue
+            if concurrently and _index_is_invalid(cursor, qn(name)):
+                # IF NOT EXISTS would keep the broken index forever; build it again
+                cursor.execute(f"DROP INDEX CONCURRENTLY {qn(name)}")
+            cursor.execute(
+                f"CREATE INDEX {concurrently}IF NOT EXISTS {qn(name)} "
+                f"ON {qn(table)} ({', '.join(qn(c) for c in columns)})"
+            )
+            created.append(name)
+    return created
+
+
+def drop_index_pack(connection, version):
+    qn = connection.ops.quote_name
+    concurrently = 'CONCURRENTLY ' if connection.vendor == 'postgresql' else ''
+    with connection.cursor() as cursor:
+        for name, _table, _columns in INDEX_PACKS[version]:
+            cursor.execute(f"DROP INDEX {concurrently}IF EXISTS {qn(name)}")
+
+
+def _existing_columns(connection, table):
+    with connection.cursor() as cursor:
+        return {column.name for column in connection.introspection.get_table_description(cursor, table)}
+
+
+def add_column_pack(connection, version):
+    """Add the columns of pack ``version``; returns the ``table.column`` names added."""
+    qn = connection.ops.quote_name
+    tables = _existing_tables(connection)
+    added = []
+    with connection.cursor() as cursor:
+        for table, column, field in COLUMN_PACKS[version]:
+            if table not in tables or column in _existing_columns(connection, table):
+                continue
+            # nullable without a default: no table rewrite on Postgres
+            cursor.execute(f"ALTER TABLE {qn(table)} ADD COLUMN {qn(column)} {field.db_type(connection)} NULL")
+            added.append(f'{table}.{column}')
+    return added
+
+
+def drop_column_pack(connection, version):
+    qn = connection.ops.quote_name
+    tables = _existing_tables(connection)
+    with connection.cursor() as cursor:
+        for table, column, _field in COLUMN_PACKS[version]:
+            if table in tables and column in _existing_columns(connection, table):
+                cursor.execute(f"ALTER TABLE {qn(table)} DROP COLUMN {qn(column)}")
+
+
+def create_unmanaged_tables(connection, models=None):
+    """Create the tables of the unmanaged core ``models`` (default: all) that are missing."""
+    from django.apps import apps
+
+    existing = _existing_tables(connection)
+    with connection.schema_editor() as editor:
+        for model in models or apps.get_app_config('core').get_models():
+            if not model._meta.managed and model._meta.db_table not in existing:
+                editor.create_model(model)
+
+
+def apply_all(connection):
+    """Apply every pack, for databases built outside migrations (benchmarks, station shards)."""
+    for version in sorted(COLUMN_PACKS):
+        add_column_pack(connection, version)
+    for version in sorted(INDEX_PACKS):
+        create_index_pack(connection, version)
+
+
+def index_pack_operations(version):
+    """Migration operations that apply (and reverse) index pack ``version``."""
+    from django.db import migrations
+
+    def forwards(apps, schema_editor):
+        create_index_pack(schema_editor.connection, version)
+
+    def backwards(apps, schema_editor):
+        drop_index_pack(schema_editor.connection, version)
+
+    return [migrations.RunPython(forwards, backwards)]
+
+
+def column_pack_operations(version):
+    """Migration operations that apply (and reverse) column pack ``version``."""
+    from django.db import migrations
+
+    def forwards(apps, schema_editor):
+        add_column_pack(schema_editor.connection, version)
+
+    def backwards(apps, schema_editor):
+        drop_column_pack(schema_editor.connection, version)
+
+    return [migrations.RunPython(forwards, backwards)]
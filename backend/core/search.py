@@ -0,0 +1,214 @@
+"""
+Full-text search over drivers and violations for the admin console.
+
+Each driver and each violation has one ``SearchDocument``: a title (the
+driver's name and license, or the violation number and location) and a
+body with the rest of its searchable text. Migration ``0009_search`` adds
+the full-text index over those rows: a weighted ``tsvector`` column with a
+GIN index on Postgres, an FTS5 table kept in step by triggers on SQLite.
+
+Both split the text into runs of letters and digits, as ``terms`` splits the
+query: FTS5's tokenizer does so already, and on Postgres the column indexes
+the text with every other character replaced by a space (migration
+``0016_search_split_words``), since Postgres's parser would otherwise keep
+``driver1@example.com`` or a hyphenated plate as one word that no query
+term matches.
+
+Documents are rewritten whenever a driver, violation or violation detail is
+saved or deleted, once the transaction commits (a violation's details are
+written after the violation itself). ``rebuild_search_index`` rewrites all
+of them, for data loaded with bulk inserts or raw SQL.
+
+Every word of the query must be in the document, the last one possibly
+unfinished (``juan dela c`` finds "Juan Dela Cruz"), so results follow the
+admin's typing. Results come best match first; the database ranks every
+match and returns only the page asked for.
+"""
+
+import re
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import shards
+from .models import DriverUser, SearchDocument, Violation, ViolationDetail
+
+DEFAULTS = {
+    'PAGE_SIZE': 20,
+    'MAX_PAGE_SIZE': 100,
+    # deep pages cost as much as every page before them
+    'MAX_OFFSET': 1000,
+    'MAX_TERMS': 8,
+}
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'CORE_SEARCH', {}))
+    return config
+
+
+def _drivers(ids, using):
+    rows = DriverUser.objects.using(using).filter(pk__in=ids).values_list(
+        'driver_user_id', 'full_name', 'license_number', 'email', 'username')
+    return {
+        pk: (f'{name} ({license_number})', f'{email} {username}')
+        for pk, name, license_number, email, username in rows
+    }
+
+
+def _violations(ids, using):
+    documents = {}
+    # read from the station databases (core.shards); the documents stay on ``using``
+    for alias, chunk in shards.group(ids, using).items():
+        rows = Violation.objects.using(alias).filter(pk__in=chunk).values_list('violation_id', 'location')
+        text = {pk: [] for pk, _location in rows}
+        details = ViolationDetail.objects.using(alias).filter(violation_id__in=list(text)).values_list(
+            'violation_id', 'notes', 'platenumber', 'car_name', 'vehicle_type')
+        for violation_id, *fields in details:
+            text[violation_id].extend(value for value in fields if value)
+        for pk, location in rows:
+            documents[pk] = (f'Violation #{pk}, {location}', ' '.join(text[pk]))
+    return documents
+
+
+# entity -> builder of {id: (title, body)} for the given ids
+BUILDERS = {
+    'drivers': _drivers,
+    'violations': _violations,
+}
+
+
+def index(entity, ids, using='default'):
+    """Rewrites the documents of ``ids``, dropping those whose row is gone."""
+    ids = list(ids)
+    texts = BUILDERS[entity](ids, using)
+    SearchDocument.objects.using(using).bulk_create(
+        [SearchDocument(entity=entity, entity_id=pk, title=title[:255], body=body) for pk, (title, body) in texts.items()],
+        update_conflicts=True, unique_fields=['entity', 'entity_id'], update_fields=['title', 'body'],
+    )
+    gone = set(ids) - set(texts)
+    if gone:
+        SearchDocument.objects.using(using).filter(entity=entity, entity_id__in=gone).delete()
+
+
+def _reindex_on_commit(entity, pk, using):
+    if pk is not None:
+        home = shards.home(using)
+        # a lambda, not a partial: robust on_commit logs a failure by the callback's __qualname__
+        transaction.on_commit(lambda: index(entity, [pk], home), using=using, robust=True)
+
+
+@receiver(post_save, sender=DriverUser, dispatch_uid='search_driver_saved')
+@receiver(post_delete, sender=DriverUser, dispatch_uid='search_driver_deleted')
+def reindex_driver(sender, instance, using, **kwargs):
+    _reindex_on_commit('drivers', instance.pk, using)
+
+
+@receiver(post_save, sender=Violation, dispatch_uid='search_violation_saved')
+@receiver(post_delete, sender=Violation, dispatch_uid='search_violation_deleted')
+def reindex_violation(sender, instance, using, **kwargs):
+    _reindex_on_commit('violations', instance.pk, using)
+
+
+@receiver(post_save, sender=ViolationDetail, dispatch_uid='search_detail_saved')
+@receiver(post_delete, sender=ViolationDetail, dispatch_uid='search_detail_deleted')
+def reindex_detail(sender, instance, using, **kwargs):
+    _reindex_on_commit('violations', instance.violation_id, using)
+
+
+def rebuild(using='default', chunk_size=5000, log=None):
+    """Rewrites every document; returns the number written per entity."""
+    log = log or (lambda msg: None)
+    written = {'drivers': 0, 'violations': 0}
+    sources = [('drivers', DriverUser, using, None)]
+    # violations are read one station database at a time, each in its id range
+    sources += [('violations', Violation, alias, shards.id_range(alias)) for alias in shards.aliases(using)]
+    for entity, model, alias, id_range in sources:
+        pk_name = model._meta.pk.name
+        ids = model.objects.using(alias).order_by(pk_name).values_list(pk_name, flat=True)
+        last = id_range[0] if id_range else 0
+        while True:
+            chunk = list(ids.filter(pk__gt=last)[:chunk_size])
+            if not chunk:
+                break
+            with transaction.atomic(using=using):
+                index(entity, chunk, using)
+            last = chunk[-1]
+            written[entity] += len(chunk)
+            log(f"{entity}: {written[entity]}")
+        # documents of rows deleted behind our back
+        stale = SearchDocument.objects.using(using).filter(entity=entity, entity_id__gt=last)
+        if id_range:
+            stale = stale.filter(entity_id__lt=id_range[1])
+        stale.delete()
+    return written
+
+
+def terms(query):
+    """The words of ``query`` that are searched for, lowercased.
+
+    Runs of letters and digits, like the index's words: ``_`` separates
+    words too.
+    """
+    return re.findall(r'[^\W_]+', query.lower())[:get_config()['MAX_TERMS']]
+
+
+def _postgres_sql(words, entity):
+    sql = (
+        "SELECT d.entity, d.entity_id, d.title, ts_rank(d.search, q) AS rank "
+        "FROM core_search_document d, to_tsquery('simple', %s) q "
+        "WHERE d.search @@ q{entity} "
+        "ORDER BY rank DESC, d.id"
+    )
+    query = ' & '.join([*words[:-1], f'{words[-1]}:*'])
+    if entity:
+        return sql.format(entity=" AND d.entity = %s"), [query, entity]
+    return sql.format(entity=''), [query]
+
+
+def _sqlite_sql(words, entity):
+    # bm25 is lower for better matches, and a title hit counts four times a body hit
+    sql = (
+        "SELECT d.entity, d.entity_id, d.title, -bm25(core_search_fts, 4.0, 1.0) AS rank "
+        "FROM core_search_fts JOIN core_search_document d ON d.id = core_search_fts.rowid "
+        "WHERE core_search_fts MATCH %s{entity} "
+        "ORDER BY bm25(core_search_fts, 4.0, 1.0), d.id"
+    )
+    query = ' '.join([*(f'"{word}"' for word in words[:-1]), f'"{words[-1]}"*'])
+    if entity:
+        return sql.format(entity=" AND d.entity = %s"), [query, entity]
+    return sql.format(entity=''), [query]
+
+
+QUERIES = {
+    'postgresql': _postgres_sql,
+    'sqlite': _sqlite_sql,
+}
+
+
+def search(query, entity=None, limit=None, offset=0, using=None):
+    """One page of documents matching ``query``, best first.
+
+    Returns ``(results, has_more)``; each result has the ``type`` (entity),
+    ``id``, ``title`` and ``rank``.
+    """
+    config = get_config()
+    limit = min(limit or config['PAGE_SIZE'], config['MAX_PAGE_SIZE'])
+    words = terms(query)
+    if not words:
+        return [], False
+    connection = connections[using or router.db_for_read(SearchDocument)]
+    if connection.vendor not in QUERIES:
+        raise NotImplementedError(f"Full-text search is not available on {connection.vendor}")
+    sql, params = QUERIES[connection.vendor](words, entity)
+    with connection.cursor() as cursor:
+        cursor.execute(f"{sql} LIMIT %s OFFSET %s", [*params, limit + 1, offset])
+        rows = cursor.fetchall()
+    results = [
+        {'type': row_entity, 'id': entity_id, 'title': title, 'rank': round(rank, 4)}
+        for row_entity, entity_id, title, rank in rows[:limit]
+    ]
+    return results, len(rows) > limit
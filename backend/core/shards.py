@@ -0,0 +1,273 @@
+"""
+Per-station databases for tickets and payments.
+
+Drivers, officers, admins, the violation-type catalog and every ``core_*``
+table live in the home database (``default``). The tickets of a station -
+its ``violations``, their ``violations_details`` and their ``payment`` rows
+- can be moved to a database of their own, a shard, listed in
+``CORE_SHARDS``::
+
+    CORE_SHARDS = {
+        'STRIDE': 100_000_000,
+        'SHARDS': {
+            'shard_north': {'NUMBER': 1, 'STATIONS': ['Quezon City', 'Baguio']},
+        },
+    }
+
+A ticket goes to the shard of the issuing officer's station; stations not
+listed stay in the home database. Its payments go where the ticket is.
+
+Shard ``n`` hands out ids from ``n * STRIDE`` up to the next shard's range
+(``init_shards`` moves its sequences there), so the id of a ticket, detail
+or payment says where it lives and a lookup by id goes straight to one
+database. The home database is shard 0 and must stay below ``STRIDE``. A
+shard's number is part of every id it has handed out: never change it.
+
+``StationShardRouter`` (core.routers) sends queries on those three models
+to the database chosen with ``use()``, or to the one a related row was read
+from. A write to a shard cannot share a transaction with the home database,
+so what a shard write records there (change feed, hotspot counters, search
+documents) is written through ``after_write``, once the shard commits.
+Queries over every station go through ``fan_out``, which runs them on all
+databases in parallel; merging the results is up to the caller.
+"""
+
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import close_old_connections, connections, transaction
+
+from .lru import LRUCache
+
+HOME = 'default'
+
+# models kept per station, as app labels (the router checks these)
+SHARDED_MODELS = {'core.Violation', 'core.ViolationDetail', 'core.Payment'}
+
+DEFAULTS = {
+    'STRIDE': 100_000_000,
+    'SHARDS': {},
+    # seconds an officer's station is remembered
+    'STATION_CACHE_TTL': 300,
+}
+
+# the database sharded models go to, when no related row says otherwise
+_current = ContextVar('core_shard', default=None)
+
+_stations = LRUCache(maxsize=4096)
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'CORE_SHARDS', {}))
+    return config
+
+
+def shard_aliases():
+    """The shard databases, by number."""
+    shards = get_config()['SHARDS']
+    return sorted(shards, key=lambda alias: shards[alias]['NUMBER'])
+
+
+def aliases(home=HOME):
+    """Every database holding tickets: ``home`` first, then the shards."""
+    return [home, *shard_aliases()]
+
+
+def is_shard(alias):
+    return alias in get_config()['SHARDS']
+
+
+def models(alias):
+    """The models with tables on ``alias``: the sharded ones on a shard, else all (None)."""
+    if not is_shard(alias):
+        return None
+    from django.apps import apps
+
+    return [apps.get_model(label) for label in sorted(SHARDED_MODELS)]
+
+
+def home(using):
+    """The home database for work that follows a write on ``using``."""
+    return HOME if is_shard(using) else using
+
+
+def number(alias):
+    return get_config()['SHARDS'][alias]['NUMBER'] if is_shard(alias) else 0
+
+
+def id_range(alias):
+    """``(first, end)`` of the ids ``alias`` hands out; ``end`` is exclusive."""
+    stride = get_config()['STRIDE']
+    n = number(alias)
+    return n * stride, (n + 1) * stride
+
+
+def for_station(station, home=HOME):
+    for alias, shard in get_config()['SHARDS'].items():
+        if station in shard['STATIONS']:
+            return alias
+    return home
+
+
+def station(officer_id):
+    """The station of ``officer_id`` ('' if unknown), cached for ``STATION_CACHE_TTL`` seconds."""
+    found = _stations.get(officer_id)
+    if found is None:
+        from .models import LawOfficer
+
+        found = LawOfficer.objects.using(HOME).filter(pk=officer_id).values_list('station', flat=True).first() or ''
+        _stations.set(officer_id, found, ttl=get_config()['STATION_CACHE_TTL'])
+    return found
+
+
+def for_officer(officer_id, home=HOME):
+    """Where the tickets of ``officer_id`` go."""
+    if not get_config()['SHARDS']:
+        return home
+    return for_station(station(officer_id), home)
+
+
+def for_id(pk, home=HOME):
+    """The database of the ticket, detail or payment with this id."""
+    config = get_config()
+    n = int(pk) // config['STRIDE']
+    for alias, shard in config['SHARDS'].items():
+        if shard['NUMBER'] == n:
+            return alias
+    return home
+
+
+def group(ids, home=HOME):
+    """``{alias: ids}`` for ids of tickets, details or payments."""
+    grouped = {}
+    for pk in ids:
+        grouped.setdefault(for_id(pk, home), []).append(pk)
+    return grouped
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def use(alias):
+    """Route queries on tickets, details and payments to ``alias``."""
+    # the home database is left to the other routers (replica reads)
+    token = _current.set(None if alias == HOME else alias)
+    try:
+        yield alias
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def atomic(alias):
+    """One transaction on ``alias`` and one on the home database.
+
+    The shard commits last, so it still holds its row locks while the home
+    database commits; the two are not atomic together.
+    """
+    with ExitStack() as stack:
+        stack.enter_context(transaction.atomic(using=alias))
+        if alias != HOME:
+            stack.enter_context(transaction.atomic(using=HOME))
+        yield
+
+
+def after_write(using, func):
+    """Runs ``func(alias)`` on the home database for a write made on ``using``.
+
+    In the write's own transaction when it went to the home database; once it
+    commits when it went to a shard.
+    """
+    if is_shard(using):
+        transaction.on_commit(lambda: func(HOME), using=using, robust=True)
+    else:
+        func(using)
+
+
+_executor = None
+_executor_size = 0
+_executor_lock = threading.Lock()
+
+
+def _executor_for(n):
+    global _executor, _executor_size
+    with _executor_lock:
+        if _executor is None or _executor_size < n:
+            # one slot per database, for a few requests fanning out at once
+            _executor_size = 4 * n
+            _executor = ThreadPoolExecutor(max_workers=_executor_size, thread_name_prefix='shard-fan-out')
+        return _executor
+
+
+def _run(func, alias):
+    # each worker thread has its own connections; treat every call like a request
+    close_old_connections()
+    try:
+        with use(alias):
+            return func(alias)
+    finally:
+        close_old_connections()
+
+
+def fan_out(func, home=HOME):
+    """``[(alias, func(alias))]`` for every database, run in parallel.
+
+    ``func`` runs inside ``use(alias)``. Exceptions are raised in the caller.
+    """
+    targets = aliases(home)
+    if len(targets) == 1:
+        with use(home):
+            return [(home, func(home))]
+    executor = _executor_for(len(targets))
+    futures = [
+        # copy the caller's context so replica routing carries over
+        (alias, executor.submit(contextvars.copy_context().run, _run, func, alias))
+        for alias in targets
+    ]
+    return [(alias, future.result()) for alias, future in futures]
+
+
+def reserve_ids(alias):
+    """Moves the id sequences of ``alias`` up to the start of its range; returns the tables moved.
+
+    A sequence is never moved back, so this is safe to run again.
+    """
+    from .models import Payment, Violation, ViolationDetail
+
+    connection = connections[alias]
+    first, _end = id_range(alias)
+    moved = []
+    with connection.cursor() as cursor:
+        for model in (Violation, ViolationDetail, Payment):
+            table, pk = model._meta.db_table, model._meta.pk.column
+            cursor.execute(f"SELECT MAX({connection.ops.quote_name(pk)}) FROM {connection.ops.quote_name(table)}")
+            if (cursor.fetchone()[0] or 0) >= first:
+                continue
+            if connection.vendor == 'postgresql':
+                cursor.execute("SELECT pg_get_serial_sequence(%s, %s)", [table, pk])
+                sequence = cursor.fetchone()[0]
+                cursor.execute(f"SELECT last_value FROM {sequence}")
+                if cursor.fetchone()[0] >= first:
+                    continue
+                cursor.execute("SELECT setval(%s, %s)", [sequence, first])
+            elif connection.vendor == 'sqlite':
+                # AUTOINCREMENT tables continue after the highest value in sqlite_sequence
+                cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = %s", [table])
+                row = cursor.fetchone()
+                if row is None:
+                    cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)", [table, first])
+                elif row[0] < first:
+                    cursor.execute("UPDATE sqlite_sequence SET seq = %s WHERE name = %s", [first, table])
+                else:
+                    continue
+            else:
+                raise NotImplementedError(f"Id ranges are not implemented for {connection.vendor}")
+            moved.append(table)
+    return moved
@@ -0,0 +1,22 @@
+"""
+Background tasks for ``run_jobs`` (see core/jobs.py).
+"""
+
+from django.utils import timezone
+
+from . import jobs
+from .models import AuditLog, LtoAdminUser
+
+
+@jobs.task(queue='audit', max_attempts=10)
+def write_audit_log(action_type, description, lto_user_id=None, driver_user_id=None, timestamp=None):
+    # callers pass the admin id from the request body; ignore ids that do not exist
+    if lto_user_id is not None and not LtoAdminUser.objects.filter(pk=lto_user_id).exists():
+        lto_user_id = None
+    AuditLog.objects.create(
+        action_type=action_type,
+        description=description,
+        lto_user_id=lto_user_id,
+        driver_user_id=driver_user_id,
+        timestamp=timestamp or timezone.now(),
+    )
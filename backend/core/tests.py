@@ -1,3 +1,735 @@
-from django.test import TestCase
+"""
+Tests for the core app.
 
-# Create your tests here.
+The legacy tables are ``managed = False``, so the test databases Django
+creates lack them; ``setUpModule`` builds them the way benchdata does. The
+replica and shard tests need those aliases configured, e.g.
+
+    LTO_DB_BACKEND=sqlite LTO_DB_REPLICA_PATH=replica.sqlite3 \\
+        LTO_DB_SHARDS="1:north=Baguio" python manage.py test core
+
+(the replica mirrors the default test database). Without them those tests
+are skipped.
+
+The tests are ``TransactionTestCase``s: on_commit receivers and
+``shards.fan_out``'s threads only see committed rows.
+"""
+
+import io
+import json
+import logging
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock, skipUnless
+
+from django.apps import apps
+from django.core import signing
+from django.core.management import CommandError, call_command
+from django.core.management.color import no_style
+from django.db import connections, transaction
+from django.http import JsonResponse
+from django.test import Client, RequestFactory, SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from . import changefeed, fees, hotspots, idempotency, jobs, profiles, profiling, reports, routers, schema, search, shards, tokens
+from .credentials import HashingBusy, get_throttle, hash_password
+from .models import (
+    ChangeLogEntry, DriverUser, HotspotCount, IdempotencyKey, Job, LawOfficer, LtoAdminUser, ReportDay, SearchDocument, TokenVersion,
+    Violation, ViolationType, ViolationTypeFee,
+)
+from .tokens import claimed_actor, get_actor, issue_token, max_age, revoke_user, verify_token
+
+SHARDED = bool(shards.shard_aliases())
+REPLICA = routers.replica_available()
+
+
+def setUpModule():
+    for alias in shards.aliases():
+        connection = connections[alias]
+        schema.create_unmanaged_tables(connection, shards.models(alias))
+        schema.apply_all(connection)
+        if shards.is_shard(alias):
+            shards.reserve_ids(alias)
+
+
+_runs = []
+
+
+@jobs.task(name='core.tests.record_run', queue='tests')
+def record_run(n):
+    _runs.append(n)
+
+
+def _json(data, **kwargs):
+    return {'data': json.dumps(data), 'content_type': 'application/json', **kwargs}
+
+
+def _bearer(role, user_id):
+    return {'Authorization': f'Bearer {issue_token(role, user_id)}'}
+
+
+def _shard_station():
+    """A station whose tickets go to the first shard."""
+    return shards.get_config()['SHARDS'][shards.shard_aliases()[0]]['STATIONS'][0]
+
+
+@override_settings(CORE_RATE_LIMITS={}, CORE_ADMISSION={})
+class CoreTestCase(TransactionTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        # process-wide caches would carry rows over from the previous test
+        fees.invalidate()
+        shards._stations.clear()
+        profiles.get_backend().clear()
+        get_throttle()._failures.clear()
+        tokens._version_cache.clear()
+
+        self.driver = DriverUser.objects.create(
+            username='juan', password=hash_password('secret'), full_name='Juan Dela Cruz', email='juan@example.com',
+            phone_number='09170000001', license_number='N01-23-456789', account_status='Verified',
+        )
+        self.officer = LawOfficer.objects.create(
+            username='officer', password=hash_password('secret'), badge_id='B000001', station='Quezon City',
+            full_name='Officer One',
+        )
+        self.admin = LtoAdminUser.objects.create(
+            username='admin', password=hash_password('secret'), full_name='Admin One', position='Records Officer',
+        )
+        self.speeding = ViolationType.objects.create(violation_type=1, violation_name='Overspeeding',
+                                                     violation_fee=Decimal('1000.00'))
+        self.parking = ViolationType.objects.create(violation_type=2, violation_name='Illegal parking',
+                                                    violation_fee=Decimal('500.10'))
+        self.client = Client()
+
+    def tearDown(self):
+        # TransactionTestCase only flushes the tables Django manages
+        for alias in shards.aliases():
+            connection = connections[alias]
+            tables = [
+                model._meta.db_table for model in shards.models(alias) or apps.get_app_config('core').get_models()
+                if not model._meta.managed
+            ]
+            connection.ops.execute_sql_flush(connection.ops.sql_flush(no_style(), tables, allow_cascade=True))
+
+    def ticket(self, body=None, **kwargs):
+        return self.client.post('/api/violation/register/', **_json({
+            'driver_name': self.driver.full_name, 'license_number': self.driver.license_number,
+            'address': 'EDSA, Quezon City', 'platenumber': 'ABC 1234', 'vehicle_type': 'Sedan',
+            'car_name': 'Toyota Vios', 'vehicle_color': 'White', 'notes': '',
+            'violations': [{'violation_type': 1}, {'violation_type': 2}],
+            **(body or {}),
+        }, **kwargs))
+
+
+@skipUnless(REPLICA, "needs the 'replica' alias (LTO_DB_REPLICA_PATH)")
+class PrimaryReplicaRouterTests(CoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = self.admin_client()
+
+    def admin_client(self):
+        return Client(headers=_bearer('admin', self.admin.pk))
+
+    def driver_users(self, client):
+        """Queries made on the primary and on the replica by one driver_users request."""
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections[routers.REPLICA]) as replica:
+            response = client.get('/api/driver_users/')
+        self.assertEqual(response.status_code, 200)
+        return len(primary), len(replica)
+
+    def test_read_only_view_reads_from_replica(self):
+        primary, replica = self.driver_users(self.client)
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+
+    def test_other_views_use_primary(self):
+        with CaptureQueriesContext(connections[routers.REPLICA]) as replica:
+            response = self.client.post('/api/driver/details/', **_json({'driver_user_id': self.driver.pk}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(replica), 0)
+
+    def test_write_pins_client_to_primary(self):
+        response = self.client.post('/api/verify_driver_admin/', **_json({'driver_user_id': self.driver.pk}))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(routers.PIN_COOKIE, response.cookies)
+
+        primary, replica = self.driver_users(self.client)
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+        # other clients still read from the replica
+        self.assertEqual(self.driver_users(self.admin_client())[0], 0)
+
+    def test_expired_or_forged_pin_is_ignored(self):
+        signer = signing.get_cookie_signer(salt=routers.PIN_COOKIE)
+        for value in (signer.sign(str(time.time() - 1)), f'{time.time() + 60}:forged'):
+            client = self.admin_client()
+            client.cookies[routers.PIN_COOKIE] = value
+            self.assertEqual(self.driver_users(client)[0], 0)
+
+
+@skipUnless(SHARDED, "needs station shards (LTO_DB_SHARDS)")
+class ShardTests(CoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.shard = shards.shard_aliases()[0]
+        self.shard_officer = LawOfficer.objects.create(
+            username='north', password='x', badge_id='B000002', station=_shard_station(), full_name='Officer Two',
+        )
+
+    def test_routing(self):
+        self.assertEqual(shards.for_station(_shard_station()), self.shard)
+        self.assertEqual(shards.for_station('Nowhere'), shards.HOME)
+        self.assertEqual(shards.for_officer(self.shard_officer.pk), self.shard)
+        self.assertEqual(shards.for_officer(self.officer.pk), shards.HOME)
+        first, end = shards.id_range(self.shard)
+        self.assertEqual(shards.for_id(first + 1), self.shard)
+        self.assertEqual(shards.for_id(end - 1), self.shard)
+        self.assertEqual(shards.for_id(1), shards.HOME)
+        self.assertEqual(shards.group([1, first + 1, 2]), {shards.HOME: [1, 2], self.shard: [first + 1]})
+
+    def test_tickets_are_written_to_the_station_shard(self):
+        home = self.ticket(headers=_bearer('officer', self.officer.pk)).json()['violation_id']
+        north = self.ticket(headers=_bearer('officer', self.shard_officer.pk)).json()['violation_id']
+
+        first, end = shards.id_range(self.shard)
+        self.assertLess(home, first)
+        self.assertTrue(first < north < end)
+        self.assertTrue(Violation.objects.using(self.shard).filter(pk=north).exists())
+        self.assertFalse(Violation.objects.using(shards.HOME).filter(pk=north).exists())
+        self.assertEqual(Violation.objects.using(self.shard).get(pk=north).details.count(), 2)
+
+    def test_fan_out_runs_on_every_database(self):
+        self.ticket(headers=_bearer('officer', self.shard_officer.pk))
+        self.ticket(headers=_bearer('officer', self.shard_officer.pk))
+        self.ticket(headers=_bearer('officer', self.officer.pk))
+
+        results = shards.fan_out(lambda alias: (shards.current(), Violation.objects.count()))
+        self.assertEqual([alias for alias, _result in results], shards.aliases())
+        counts = dict(results)
+        # the home database is left to the other routers
+        self.assertEqual(counts[shards.HOME], (None, 1))
+        self.assertEqual(counts[self.shard], (self.shard, 2))
+
+    def test_fan_out_raises_in_the_caller(self):
+        def fail(alias):
+            if alias == self.shard:
+                raise RuntimeError(alias)
+            return alias
+
+        with self.assertRaisesMessage(RuntimeError, self.shard):
+            shards.fan_out(fail)
+
+    def test_transaction_ref_is_unique_across_shards(self):
+        tickets = [
+            self.ticket(headers=_bearer('officer', officer.pk)).json()['violation_id']
+            for officer in (self.officer, self.shard_officer)
+        ]
+        accepted = [
+            self.client.post('/api/payment/submit/', **_json({
+                'violation_id': violation_id, 'driver_user_id': self.driver.pk, 'payment_type': 'GCash',
+                'amount_paid': '1500.10', 'transaction_ref': 'GC-0001',
+            })).json()['success']
+            for violation_id in tickets
+        ]
+        self.assertEqual(accepted, [True, False])
+
+
+class SchemaTests(SimpleTestCase):
+    def test_invalid_concurrent_index_is_rebuilt(self):
+        """A concurrent build that failed leaves an INVALID index; IF NOT EXISTS alone would keep it."""
+        statements = []
+
+        class Cursor:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def execute(self, sql, params=None):
+                statements.append(sql)
+                self.invalid = sql.startswith('SELECT') and params == ['"violations_officer_idx"']
+
+            def fetchone(self):
+                return (self.invalid,)
+
+        connection = mock.Mock(vendor='postgresql', cursor=Cursor)
+        connection.ops.quote_name = lambda name: f'"{name}"'
+        with mock.patch.object(schema, '_existing_tables', return_value={'violations', 'violations_details', 'payment'}):
+            schema.create_index_pack(connection, 1)
+
+        drops = [sql for sql in statements if sql.startswith('DROP')]
+        self.assertEqual(drops, ['DROP INDEX CONCURRENTLY "violations_officer_idx"'])
+        rebuilt = statements.index(drops[0]) + 1
+        self.assertTrue(statements[rebuilt].startswith('CREATE INDEX CONCURRENTLY IF NOT EXISTS "violations_officer_idx"'))
+
+
+class FeeTests(CoreTestCase):
+    def test_centavos(self):
+        self.assertEqual(fees.to_centavos('500.10'), 50010)
+        self.assertEqual(fees.to_centavos(Decimal('0.20')), 20)
+        self.assertEqual(fees.to_centavos(15), 1500)
+        self.assertEqual(fees.pesos(50010), Decimal('500.10'))
+        with self.assertRaises(ValueError):
+            fees.to_centavos('1.005')
+
+    def test_schedule_picks_the_fee_in_force(self):
+        now = datetime.now(dt_timezone.utc)
+        ViolationTypeFee.objects.create(violation_type=self.speeding, effective_from=now - timedelta(days=30),
+                                        amount_centavos=120000)
+        ViolationTypeFee.objects.create(violation_type=self.speeding, effective_from=now + timedelta(days=30),
+                                        amount_centavos=150000)
+        schedule = fees.FeeSchedule.load()
+
+        self.assertEqual(schedule.fee(1, now - timedelta(days=60)), 100000)
+        self.assertEqual(schedule.fee(1, now), 120000)
+        self.assertEqual(schedule.fee(1, now + timedelta(days=31)), 150000)
+        # no schedule: the type's own fee
+        self.assertEqual(schedule.fee('2', now), 50010)
+        self.assertEqual(schedule.price([1, 2, 2], now), ([120000, 50010, 50010], 220020))
+        with self.assertRaises(fees.UnknownViolationType):
+            schedule.fee(99)
+
+    def test_tickets_are_priced_by_the_server(self):
+        response = self.ticket(headers=_bearer('officer', self.officer.pk))
+        data = response.json()
+        self.assertEqual(response.status_code, 200, data)
+        self.assertEqual(data['total_centavos'], 150010)
+        self.assertEqual(data['total_fee'], '1500.10')
+        self.assertEqual(Violation.objects.get(pk=data['violation_id']).total_fee, Decimal('1500.10'))
+
+    def test_schedule_change_reprices_new_tickets(self):
+        ViolationTypeFee.objects.create(violation_type=self.parking,
+                                        effective_from=datetime.now(dt_timezone.utc) - timedelta(seconds=1),
+                                        amount_centavos=35)
+        data = self.ticket(headers=_bearer('officer', self.officer.pk)).json()
+        self.assertEqual([line['fee_centavos'] for line in data['fees']], [100000, 35])
+
+    def test_set_fee_never_edits_a_row(self):
+        effective_from = (datetime.now(dt_timezone.utc) + timedelta(days=1)).isoformat()
+        call_command('set_fee', '1', '1200.00', effective_from=effective_from, stdout=io.StringIO())
+        call_command('set_fee', '1', '1200.00', effective_from=effective_from, stdout=io.StringIO())
+        with self.assertRaises(CommandError):
+            call_command('set_fee', '1', '1300.00', effective_from=effective_from, stdout=io.StringIO())
+        self.assertEqual(list(ViolationTypeFee.objects.values_list('amount_centavos', flat=True)), [120000])
+
+    def test_driver_penalties_query_count_does_not_grow(self):
+        def penalties():
+            with CaptureQueriesContext(connections['default']) as queries:
+                response = self.client.post('/api/driver/penalties/', **_json(
+                    {'driver_user_id': self.driver.pk}, headers=_bearer('driver', self.driver.pk)))
+            return response.json()['penalties'], len(queries)
+
+        self.ticket(headers=_bearer('officer', self.officer.pk))
+        lines, one_ticket = penalties()
+        self.assertEqual(
+            [(line['violation_type'], line['officer'], line['fee_centavos']) for line in lines],
+            [('Overspeeding', 'Officer One', 100000), ('Illegal parking', 'Officer One', 50010)],
+        )
+        for _ in range(3):
+            self.ticket(headers=_bearer('officer', self.officer.pk))
+        lines, four_tickets = penalties()
+        self.assertEqual((len(lines), four_tickets), (8, one_ticket))
+
+
+class IdempotencyTests(CoreTestCase):
+    def test_retry_replays_the_first_response(self):
+        headers = {**_bearer('officer', self.officer.pk), 'Idempotency-Key': 'ticket-1'}
+        first = self.ticket(headers=headers)
+        retry = self.ticket(headers=headers)
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Violation.objects.using(shards.HOME).count(), 1)
+
+    def test_key_reused_for_another_request(self):
+        headers = {**_bearer('officer', self.officer.pk), 'Idempotency-Key': 'ticket-1'}
+        self.ticket(headers=headers)
+        response = self.client.post('/api/violation/register/', **_json({'driver_name': 'Someone else'}, headers=headers))
+        self.assertEqual(response.status_code, 422)
+
+    def test_keys_are_per_caller(self):
+        other = LawOfficer.objects.create(username='other', password='x', badge_id='B000003', station='Manila',
+                                          full_name='Officer Three')
+        first = self.ticket(headers={**_bearer('officer', self.officer.pk), 'Idempotency-Key': 'ticket-1'})
+        second = self.ticket(headers={**_bearer('officer', other.pk), 'Idempotency-Key': 'ticket-1'})
+        self.assertNotEqual(first.json()['violation_id'], second.json()['violation_id'])
+
+    def test_server_errors_are_not_stored(self):
+        statuses = iter([500, 201])
+        calls = []
+
+        @idempotency.idempotent('test')
+        def view(request):
+            calls.append(request)
+            return JsonResponse({'n': len(calls)}, status=next(statuses))
+
+        def request():
+            return RequestFactory().post('/', '{}', content_type='application/json', HTTP_IDEMPOTENCY_KEY='k')
+
+        self.assertEqual(view(request()).status_code, 500)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(view(request()).status_code, 201)
+        replay = view(request())
+        self.assertEqual((replay.status_code, json.loads(replay.content)), (201, {'n': 2}))
+        self.assertEqual(len(calls), 2)
+
+    def test_expired_keys_are_pruned(self):
+        self.ticket(headers={**_bearer('officer', self.officer.pk), 'Idempotency-Key': 'ticket-1'})
+        IdempotencyKey.objects.update(created_at=datetime.now(dt_timezone.utc) - timedelta(days=2))
+        self.assertEqual(idempotency.prune(), 1)
+
+
+class ChangeFeedTests(CoreTestCase):
+    def rename(self, name):
+        self.driver.full_name = name
+        self.driver.save()
+
+    def test_pages_follow_the_head(self):
+        cursor = changefeed.head()
+        self.rename('Juan Santos')
+        self.rename('Juan Reyes')
+        page = changefeed.changes_since(cursor)
+        self.assertEqual([d['name'] for d in page['drivers']], ['Juan Reyes'])
+        self.assertEqual(page['cursor'], changefeed.head())
+        self.assertFalse(page['has_more'])
+        self.assertEqual(changefeed.changes_since(page['cursor'])['drivers'], [])
+
+    def test_limit_and_tombstones(self):
+        cursor = changefeed.head()
+        self.rename('Juan Santos')
+        driver_id = self.driver.pk
+        self.driver.delete()
+        page = changefeed.changes_since(cursor, limit=1)
+        self.assertTrue(page['has_more'])
+        # the row is gone by the time the first entry is read
+        self.assertEqual(page['deleted'], {'drivers': [driver_id]})
+        page = changefeed.changes_since(page['cursor'], limit=1)
+        self.assertEqual((page['has_more'], page['deleted']), (False, {'drivers': [driver_id]}))
+
+    def test_pruned_cursor_expires(self):
+        cursor = changefeed.head()
+        self.rename('Juan Santos')
+        self.rename('Juan Reyes')
+        ChangeLogEntry.objects.update(changed_at=datetime.now(dt_timezone.utc) - timedelta(days=60))
+        changefeed.prune()
+        with self.assertRaises(changefeed.CursorExpired):
+            changefeed.changes_since(cursor)
+
+    @skipUnless(connections['default'].vendor == 'postgresql', "commit order only differs from seq order on PostgreSQL")
+    def test_entry_committed_late_is_not_skipped(self):
+        cursor = changefeed.head()
+        written, release = threading.Event(), threading.Event()
+
+        def long_transaction():
+            try:
+                with transaction.atomic():
+                    # takes the lower seq, commits last
+                    DriverUser.objects.filter(pk=self.driver.pk).update(full_name='Juan Santos')
+                    ChangeLogEntry.objects.create(entity='drivers', entity_id=self.driver.pk, op=ChangeLogEntry.UPSERT)
+                    written.set()
+                    release.wait(10)
+            finally:
+                connections.close_all()
+
+        thread = threading.Thread(target=long_transaction)
+        thread.start()
+        written.wait(10)
+        # a later transaction commits first
+        ChangeLogEntry.objects.create(entity='audit_logs', entity_id=1, op=ChangeLogEntry.UPSERT)
+        self.assertEqual(changefeed.changes_since(cursor)['cursor'], cursor)
+        release.set()
+        thread.join()
+        page = changefeed.changes_since(cursor)
+        self.assertEqual([d['name'] for d in page['drivers']], ['Juan Santos'])
+
+
+class SearchTests(CoreTestCase):
+    def test_compound_words_match_their_parts(self):
+        self.driver.email = 'driver_1@example.com'
+        self.driver.save()
+        for query in ('driver_1@example.com', 'driver 1 example', 'N01-23-456789', 'n01 23 4567'):
+            results, _ = search.search(query, entity='drivers')
+            self.assertEqual([r['id'] for r in results], [self.driver.pk], query)
+
+    def test_best_match_is_ranked_among_all_matches(self):
+        # the best match (in a title) is the oldest document; newer ones only match in their body
+        for n in range(30):
+            DriverUser.objects.create(username=f'pedro{n}', password='x', full_name=f'Pedro Santos {n}',
+                                      email=f'cruz{n}@example.com', phone_number='0917', license_number=f'D{n}')
+        with override_settings(CORE_SEARCH={'PAGE_SIZE': 1}):
+            results, has_more = search.search('cruz', entity='drivers')
+        self.assertEqual(([r['id'] for r in results], has_more), ([self.driver.pk], True))
+
+
+class HotspotTests(CoreTestCase):
+    def counts(self):
+        return {
+            hotspots.cell_id(row, column): n
+            for row, column, n in HotspotCount.objects.filter(count__gt=0).values_list('cell_y', 'cell_x', 'count')
+        }
+
+    def test_moved_ticket_moves_its_count(self):
+        ticket_id = self.ticket(
+            {'latitude': 14.65, 'longitude': 121.05}, headers=_bearer('officer', self.officer.pk)).json()['violation_id']
+        violation = Violation.objects.using(shards.for_id(ticket_id)).get(pk=ticket_id)
+        old_cell = violation.geocell
+        violation.latitude = 14.55
+        violation.save()
+        self.assertEqual(self.counts(), {violation.geocell: 1})
+        self.assertNotEqual(violation.geocell, old_cell)
+
+    def test_box_across_the_antimeridian(self):
+        today = hotspots.default_range()[1]
+        for longitude in (179.5, -179.5, 0.5):
+            HotspotCount.objects.create(day=today, count=1, **dict(zip(('cell_y', 'cell_x'), hotspots.cell_of(10, longitude))))
+        cells = hotspots.hotspots(today, today, box=(9, 179, 11, -179))
+        self.assertEqual(sorted(cell['west'] for cell in cells), [-179.5, 179.5])
+
+
+class ReportTests(CoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.ticket_id = self.ticket(headers=_bearer('officer', self.officer.pk)).json()['violation_id']
+        self.month = reports.last_month()
+        Violation.objects.filter(pk=self.ticket_id).update(issued_at=reports._start(self.month) + timedelta(hours=9))
+        reports.touch('Quezon City', self.month)
+
+    def test_ticket_stays_with_the_station_it_was_issued_at(self):
+        self.assertEqual(Violation.objects.get(pk=self.ticket_id).station, 'Quezon City')
+        LawOfficer.objects.filter(pk=self.officer.pk).update(station='Makati')
+        shards._stations.clear()
+        reports.build('Quezon City', self.month)
+        reports.build('Makati', self.month)
+        self.assertEqual(reports.report('Quezon City', self.month)['issued'], (1, 150010))
+        self.assertEqual(reports.report('Makati', self.month)['issued'], (0, 0))
+
+    def test_late_change_replaces_the_months_file(self):
+        with tempfile.TemporaryDirectory() as folder, override_settings(CORE_REPORTS={'DIR': folder}):
+            reports.build('Quezon City', self.month)
+            first = reports.write('Quezon City', self.month, 'csv')
+            # say a payment approved after month end
+            reports.touch('Quezon City', self.month + timedelta(days=3))
+            reports.build('Quezon City', self.month)
+            second = reports.write('Quezon City', self.month, 'csv')
+            self.assertNotEqual(first, second)
+            self.assertEqual(list(second.parent.iterdir()), [second])
+
+
+class ProfilingTests(CoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        profiling_on_request = override_settings(CORE_PROFILING={'MODE': 'cprofile', 'OUTPUT_DIR': self.folder.name})
+        profiling_on_request.enable()
+        self.addCleanup(profiling_on_request.disable)
+        # the middleware reads its settings once, when the client's handler loads it
+        self.client = Client()
+
+    def test_header_needs_an_admin_token(self):
+        self.client.get('/api/hello/', headers={'X-Profile-Token': 'secret'})
+        self.client.get('/api/hello/', headers={'X-Profile-Token': issue_token('officer', self.officer.pk)})
+        self.assertEqual(list(Path(self.folder.name).iterdir()), [])
+        self.client.get('/api/hello/', headers={'X-Profile-Token': issue_token('admin', self.admin.pk)})
+        self.assertEqual(len(list(Path(self.folder.name).iterdir())), 1)
+
+    def test_failed_profile_keeps_the_response(self):
+        with mock.patch.object(profiling, 'write_collapsed', side_effect=OSError('disk full')), \
+                self.assertLogs('core.profiling', logging.ERROR):
+            response = self.client.get(
+                '/api/hello/', headers={'X-Profile-Token': issue_token('admin', self.admin.pk)})
+        self.assertEqual(response.status_code, 200)
+
+
+class TokenTests(CoreTestCase):
+    def test_round_trip(self):
+        actor = verify_token(issue_token('officer', self.officer.pk))
+        self.assertEqual((actor.role, actor.user_id), ('officer', self.officer.pk))
+
+    def test_tampered_and_foreign_tokens(self):
+        token = issue_token('driver', self.driver.pk)
+        self.assertIsNone(verify_token(token[:-1] + ('A' if token[-1] != 'A' else 'B')))
+        self.assertIsNone(verify_token(signing.dumps({'r': 'admin', 'u': 1, 'i': int(time.time())})))
+        with self.assertRaises(ValueError):
+            issue_token('root', 1)
+
+    def test_expiry(self):
+        with mock.patch('time.time', return_value=time.time() - max_age() - 5):
+            token = issue_token('driver', self.driver.pk)
+        self.assertIsNone(verify_token(token))
+
+    def test_revoke_rejects_earlier_tokens_only(self):
+        before = issue_token('driver', self.driver.pk)
+        other = issue_token('officer', self.officer.pk)
+        revoke_user('driver', self.driver.pk)
+        revoke_user('driver', self.driver.pk)
+        self.assertIsNone(verify_token(before))
+        self.assertIsNotNone(verify_token(issue_token('driver', self.driver.pk)))
+        self.assertIsNotNone(verify_token(other))
+
+    def test_verify_uses_cached_version(self):
+        token = issue_token('driver', self.driver.pk)
+        with self.assertNumQueries(0):
+            self.assertIsNotNone(verify_token(token))
+
+    def test_revocation_elsewhere_applies_after_ttl(self):
+        token = issue_token('driver', self.driver.pk)
+        # another process revoked: the row changes but this process's cache does not
+        TokenVersion.objects.create(role='driver', user_id=self.driver.pk, version=1)
+        self.assertIsNotNone(verify_token(token))
+        newer = issue_token('driver', self.driver.pk)
+        self.assertIsNone(verify_token(token))
+        self.assertIsNotNone(verify_token(newer))
+
+        tokens._version_cache.clear()
+        stale = issue_token('officer', self.officer.pk)
+        TokenVersion.objects.create(role='officer', user_id=self.officer.pk, version=1)
+        with mock.patch('time.monotonic', return_value=time.monotonic() + tokens.version_ttl() + 1):
+            self.assertIsNone(verify_token(stale))
+
+    def test_rate_limiter_identity_costs_no_query(self):
+        request = RequestFactory().get('/', headers=_bearer('driver', self.driver.pk))
+        revoke_user('driver', self.driver.pk)
+        with self.assertNumQueries(0):
+            actor = claimed_actor(request)
+        self.assertEqual((actor.role, actor.user_id), ('driver', self.driver.pk))
+        self.assertIsNone(get_actor(request))
+
+    def test_admin_and_officer_endpoints_always_need_a_token(self):
+        body = _json({'driver_user_id': self.driver.pk})
+        self.assertEqual(self.client.post('/api/verify_driver_admin/', **body).status_code, 401)
+        self.assertEqual(self.client.get('/api/driver_users/').status_code, 401)
+        self.assertEqual(self.client.get('/api/payments/').status_code, 401)
+        self.assertEqual(self.client.get('/api/violation/types/').status_code, 401)
+        self.assertEqual(
+            self.client.post('/api/verify_driver_admin/', **body, headers=_bearer('officer', self.officer.pk)).status_code,
+            403)
+        self.assertEqual(
+            self.client.post('/api/verify_driver_admin/', **body, headers=_bearer('admin', self.admin.pk)).status_code,
+            200)
+
+    def test_token_required(self):
+        self.assertEqual(self.client.get('/api/review/').status_code, 401)
+        self.assertEqual(self.client.get('/api/review/', headers=_bearer('driver', self.driver.pk)).status_code, 403)
+        self.assertEqual(self.client.get('/api/review/', headers=_bearer('admin', self.admin.pk)).status_code, 200)
+
+    def test_logout(self):
+        headers = _bearer('driver', self.driver.pk)
+        self.assertEqual(self.client.post('/api/logout/', headers=headers).status_code, 200)
+        self.assertEqual(self.client.post('/api/logout/', headers=headers).status_code, 401)
+
+    def test_change_password(self):
+        old = issue_token('driver', self.driver.pk)
+        headers = {'Authorization': f'Bearer {old}'}
+        wrong = self.client.post('/api/password/change/', **_json(
+            {'current_password': 'guess', 'new_password': 'new secret'}, headers=headers))
+        self.assertEqual(wrong.status_code, 403)
+
+        response = self.client.post('/api/password/change/', **_json(
+            {'current_password': 'secret', 'new_password': 'new secret'}, headers=headers))
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(verify_token(old))
+        self.assertIsNotNone(verify_token(response.json()['token']))
+        login = self.client.post('/api/login/', **_json({'username': 'juan', 'password': 'new secret'}))
+        self.assertEqual(login.status_code, 200)
+
+    def test_failed_logins_lock_out_only_their_address(self):
+        for _ in range(5):
+            self.client.post('/api/login/', **_json({'username': 'juan', 'password': 'guess'}, REMOTE_ADDR='10.0.0.9'))
+        locked = self.client.post('/api/login/', **_json({'username': 'juan', 'password': 'secret'}, REMOTE_ADDR='10.0.0.9'))
+        self.assertEqual(locked.status_code, 429)
+        login = self.client.post('/api/login/', **_json({'username': 'juan', 'password': 'secret'}, REMOTE_ADDR='10.0.0.1'))
+        self.assertEqual(login.status_code, 200)
+
+    def test_register_when_hashing_is_busy(self):
+        with mock.patch('core.views.hash_password', side_effect=HashingBusy('busy')):
+            response = self.client.post('/api/driver/register/', **_json({
+                'username': 'maria', 'password': 'secret', 'full_name': 'Maria Clara', 'email': 'maria@example.com',
+                'phone_number': '09170000002', 'license_number': 'N02-23-456789', 'birthday': '1990-01-01',
+            }))
+        self.assertEqual((response.status_code, response['Retry-After']), (503, '1'))
+
+
+class CommitReceiverTests(CoreTestCase):
+    """The search index, profile cache and report days follow writes once they commit."""
+
+    def setUp(self):
+        super().setUp()
+        self.ticket_id = self.ticket(headers=_bearer('officer', self.officer.pk)).json()['violation_id']
+        self.alias = shards.for_id(self.ticket_id)
+
+    def test_search_index(self):
+        self.assertTrue(SearchDocument.objects.filter(entity='drivers', entity_id=self.driver.pk).exists())
+        self.driver.full_name = 'Juan Santos'
+        self.driver.save()
+        self.assertIn('Juan Santos', SearchDocument.objects.get(entity='drivers', entity_id=self.driver.pk).title)
+
+        violation = Violation.objects.using(self.alias).get(pk=self.ticket_id)
+        violation.location = 'Katipunan Ave, Quezon City'
+        violation.save()
+        self.assertIn('Katipunan', search.search('katipunan', entity='violations')[0][0]['title'])
+        self.driver.delete()
+        self.assertFalse(SearchDocument.objects.filter(entity='drivers', entity_id=self.driver.pk).exists())
+
+    def test_profile_cache(self):
+        self.assertEqual(profiles.get('driver', self.driver.pk)['full_name'], 'Juan Dela Cruz')
+        with transaction.atomic():
+            self.driver.full_name = 'Juan Santos'
+            self.driver.save()
+            # dropped from the cache only once the write commits
+            self.assertEqual(profiles.get('driver', self.driver.pk)['full_name'], 'Juan Dela Cruz')
+        self.assertEqual(profiles.get('driver', self.driver.pk)['full_name'], 'Juan Santos')
+
+    def test_report_days(self):
+        violation = Violation.objects.using(self.alias).get(pk=self.ticket_id)
+        day = reports._day(violation.issued_at)
+        self.assertTrue(ReportDay.objects.filter(station='Quezon City', day=day).exists())
+
+        ReportDay.objects.all().delete()
+        violation.issued_at -= timedelta(days=3)
+        violation.save()
+        # the day it moved from is stale too
+        self.assertEqual(
+            set(ReportDay.objects.filter(station='Quezon City').values_list('day', flat=True)),
+            {day, day - timedelta(days=3)},
+        )
+
+    def test_failing_receiver_does_not_undo_the_write(self):
+        with mock.patch.object(search, 'index', side_effect=RuntimeError('index is down')), \
+                self.assertLogs('django.db.backends.base', logging.ERROR) as logs:
+            with transaction.atomic():
+                self.driver.full_name = 'Juan Santos'
+                self.driver.save()
+        self.assertIn('index is down', logs.output[0])
+        self.assertEqual(DriverUser.objects.get(pk=self.driver.pk).full_name, 'Juan Santos')
+
+
+class JobTests(CoreTestCase):
+    def setUp(self):
+        super().setUp()
+        _runs.clear()
+
+    def test_jobs_run_once_when_a_batch_outlives_the_lease(self):
+        for n in (1, 2):
+            record_run.enqueue(n=n)
+        first = jobs.Worker(['tests'], name='first')
+        claimed = jobs.claim(['tests'], 'first', batch=10)
+        first.execute(claimed[0])
+
+        # the second job waited behind the first for longer than the lease; another worker takes it over
+        Job.objects.filter(pk=claimed[1].pk).update(locked_at=datetime.now(dt_timezone.utc) - timedelta(hours=1))
+        self.assertEqual(jobs.requeue_stale(first.lease), 1)
+        jobs.Worker(['tests'], name='second').run(burst=True)
+        first.execute(claimed[1])
+
+        self.assertEqual(sorted(_runs), [1, 2])
+        self.assertFalse(Job.objects.exists())
@@ -0,0 +1,206 @@
+"""
+Stateless signed tokens for the core API.
+
+``universal_login`` issues a token carrying the user's role and id, signed
+with ``SECRET_KEY`` (``django.core.signing``, HMAC-SHA256). Clients send it as
+``Authorization: Bearer <token>``. Verifying it is pure CPU apart from the
+user's ``TokenVersion``, which each process keeps in a small LRU for
+``CORE_TOKEN_VERSION_TTL`` seconds, so views learn who is calling without a
+database hit.
+
+Tokens cannot be withdrawn individually; ``revoke_user`` (on logout and on a
+password change) bumps the user's version, which rejects every token issued
+before it. The revoking process drops its cached version when the bump
+commits; other processes refuse the old tokens once their cached version
+expires, within ``CORE_TOKEN_VERSION_TTL``. Versions are read from the home
+database, never a replica.
+"""
+
+import time
+from dataclasses import dataclass
+from functools import wraps
+
+from django.conf import settings
+from django.core import signing
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.http import JsonResponse
+
+from . import shards
+from .lru import LRUCache
+from .models import TokenVersion
+
+SALT = 'core.tokens'
+ROLES = ('driver', 'officer', 'admin')
+
+_version_cache = LRUCache(maxsize=10000)
+
+
+@dataclass(frozen=True)
+class Actor:
+    role: str
+    user_id: int
+    issued_at: int
+
+
+def max_age():
+    return getattr(settings, 'CORE_TOKEN_MAX_AGE', 12 * 60 * 60)
+
+
+def _versions(role, user_id):
+    return TokenVersion.objects.using(shards.HOME).filter(role=role, user_id=user_id)
+
+
+def version_ttl():
+    return getattr(settings, 'CORE_TOKEN_VERSION_TTL', 30)
+
+
+def current_version(role, user_id, fresh=False):
+    """The version tokens for the user must carry; 0 until their first revocation.
+
+    Served from the per-process cache unless ``fresh``; a fresh read refills it.
+    """
+    key = (role, int(user_id))
+    if not fresh:
+        version = _version_cache.get(key)
+        if version is not None:
+            return version
+    version = _versions(role, user_id).values_list('version', flat=True).first() or 0
+    _version_cache.set(key, version, ttl=version_ttl())
+    return version
+
+
+def issue_token(role, user_id):
+    if role not in ROLES:
+        raise ValueError(f"Unknown role {role!r}")
+    # fresh: a version cached before another process revoked would sign a token that is already stale
+    payload = {'r': role, 'u': user_id, 'i': int(time.time()), 'v': current_version(role, user_id, fresh=True)}
+    return signing.dumps(payload, salt=SALT, compress=True)
+
+
+def _claims(token):
+    """``(actor, version)`` from a token with a valid signature and age, or None."""
+    try:
+        payload = signing.loads(token, salt=SALT, max_age=max_age())
+        actor = Actor(role=payload['r'], user_id=int(payload['u']), issued_at=int(payload['i']))
+        # tokens issued before versions existed count as version 0
+        version = int(payload.get('v', 0))
+    except (signing.BadSignature, KeyError, TypeError, ValueError):
+        return None
+    if actor.role not in ROLES:
+        return None
+    return actor, version
+
+
+def verify_token(token):
+    """The ``Actor`` for a valid token, or None."""
+    claims = _claims(token)
+    if claims is None:
+        return None
+    actor, version = claims
+    current = current_version(actor.role, actor.user_id)
+    if version > current:
+        # versions only grow: the token was issued after a revocation this process has not seen yet
+        current = current_version(actor.role, actor.user_id, fresh=True)
+    if version != current:
+        return None
+    return actor
+
+
+def revoke_user(role, user_id):
+    """Rejects every token issued to the user so far; tokens issued afterwards are valid."""
+    key = (role, int(user_id))
+    versions = _versions(role, int(user_id))
+    with transaction.atomic(using=shards.HOME):
+        # dropped again on commit, in case a verify re-read the old version in between
+        _version_cache.delete(key)
+        transaction.on_commit(lambda: _version_cache.delete(key), using=shards.HOME)
+        if versions.update(version=F('version') + 1):
+            return
+        try:
+            with transaction.atomic(using=shards.HOME):
+                TokenVersion.objects.using(shards.HOME).create(role=role, user_id=int(user_id), version=1)
+        except IntegrityError:
+            # revoked concurrently for the first time
+            versions.update(version=F('version') + 1)
+
+
+def _bearer(request):
+    header = request.headers.get('Authorization', '')
+    scheme, _, token = header.partition(' ')
+    return token.strip() if scheme.lower() == 'bearer' and token else None
+
+
+def get_actor(request):
+    # a view may ask more than once; verify the token once per request
+    if not hasattr(request, '_core_actor'):
+        token = _bearer(request)
+        request._core_actor = verify_token(token) if token else None
+    return request._core_actor
+
+
+def claimed_actor(request):
+    """The actor the bearer token names, checking its signature and age but not revocation.
+
+    Costs no query, so the rate limiter can pick a bucket before admitting the
+    request; a revoked token still names its user. Never use it to authorize.
+    """
+    token = _bearer(request)
+    claims = _claims(token) if token else None
+    return claims[0] if claims else None
+
+
+def actor_mismatch(request, role, claimed_id):
+    """True when the caller's token is for ``role`` but a different user than ``claimed_id``.
+
+    Endpoints that still take a user id in the body use this so a token
+    holder cannot act for someone else.
+    """
+    actor = getattr(request, 'actor', None)
+    if actor is None or actor.role != role or claimed_id in (None, ''):
+        return False
+    return str(claimed_id) != str(actor.user_id)
+
+
+def with_actor(*roles):
+    """Sets ``request.actor`` from the bearer token (None if absent or invalid).
+
+    ``roles`` are the roles the endpoint serves. With ``CORE_REQUIRE_TOKENS``
+    on, a request without a valid token for one of them is rejected; while it
+    is off, anonymous callers are still let through for older clients. Only
+    driver endpoints use it that way; officer and admin endpoints always take
+    ``token_required``.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            request.actor = get_actor(request)
+            if roles and getattr(settings, 'CORE_REQUIRE_TOKENS', False):
+                denied = _check_roles(request.actor, roles)
+                if denied:
+                    return denied
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def token_required(*roles):
+    """Like ``with_actor`` but always requires a valid token for one of ``roles``."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            request.actor = get_actor(request)
+            denied = _check_roles(request.actor, roles)
+            if denied:
+                return denied
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _check_roles(actor, roles):
+    if actor is None:
+        return JsonResponse({'success': False, 'error': 'Authentication required.'}, status=401)
+    if roles and actor.role not in roles:
+        return JsonResponse({'success': False, 'error': 'Not allowed for this account type.'}, status=403)
+    return None
@@ -4,6 +4,8 @@ from . import views
 urlpatterns = [
     path('hello/', views.hello_world, name='hello_world'),
     path('login/', views.universal_login, name='universal_login'), 
+    path('logout/', views.logout, name='logout'),
+    path('password/change/', views.change_password, name='change_password'),
     path('driver/details/', views.get_driver_details, name='get_driver_details'),
     path('driver/penalties/', views.driver_penalties, name='driver_penalties'),
     path('driver/register/', views.register_driver, name='register_driver'),
@@ -12,6 +14,7 @@ urlpatterns = [
     path('driver/verify/', views.verify_driver, name='verify_driver'),
     path('violation/register/', views.register_violation, name='register_violation'),
     path('violation/types/', views.get_violation_types, name='get_violation_types'),
+    path('violation/hotspots/', views.violation_hotspots, name='violation_hotspots'),
     path('payment/submit/', views.submit_payment, name='submit_payment'),
     path('driver/payments/', views.get_driver_payments, name='get_driver_payments'),
     path('lto_admin_details/', views.lto_admin_details, name='lto_admin_details'),
@@ -19,6 +22,14 @@ urlpatterns = [
     path('verify_driver_admin/', views.verify_driver_admin, name='verify_driver_admin'),
     path('driver_users/', views.driver_users, name='driver_users'),
     path('payments/', views.payments, name='payments'),
+    path('changes/', views.change_feed, name='change_feed'),
+    path('events/', views.event_stream, name='event_stream'),
     path('update_license_expiry/', views.update_license_expiry, name='update_license_expiry'),
     path('update_payment_status/', views.update_payment_status, name='update_payment_status'),
+    path('review/claim/', views.claim_payments, name='claim_payments'),
+    path('review/release/', views.release_payments, name='release_payments'),
+    path('review/', views.review_queue, name='review_queue'),
+    path('cache/profiles/', views.profile_cache_stats, name='profile_cache_stats'),
+    path('reports/station/', views.station_report, name='station_report'),
+    path('search/', views.full_text_search, name='search'),
 ]
\ No newline at end of file
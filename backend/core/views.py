@@ -1,4 +1,9 @@
-from django.http import JsonResponse
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.text import slugify
+from django.db import IntegrityError, transaction
 from django.db.models import Max
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
@@ -9,9 +14,18 @@ from django.contrib.auth.models import User
 from datetime import datetime
 import json
 import base64
+import heapq
+import logging
 from .models import DriverUser, Violation, ViolationDetail, LawOfficer, LtoAdminUser, ViolationType, Payment, AuditLog
-from django.contrib.auth.decorators import login_required
+from . import changefeed, events, fees, hotspots, profiles, reports, review, search, shards
+from .tasks import write_audit_log
+from .credentials import HashingBusy, client_ip, get_throttle, hash_password, verify_password
+from .idempotency import idempotent
+from .tokens import actor_mismatch, get_actor, issue_token, revoke_user, token_required, verify_token, with_actor
 
+logger = logging.getLogger(__name__)
+
+@with_actor()
 def hello_world(request):
     return JsonResponse({'message': 'Hello from Django backend!'})
 
@@ -34,10 +48,30 @@ def api_login(request):
         else:
             return JsonResponse({"success": False, "error": "Invalid credentials"}, status=400)
         
+def _password_login(model, username, password, fields):
+    """The ``model`` row for ``username`` if ``password`` matches.
+
+    False when the username exists but the password does not match, None when
+    there is no such username (and nothing was hashed). Legacy plaintext
+    passwords (and hashes from an outdated hasher) are rehashed on a
+    successful login.
+    """
+    user = model.objects.filter(username=username).only('pk', 'password', *fields).first()
+    if user is None:
+        return None
+    matches, new_hash = verify_password(password, user.password)
+    if not matches:
+        return False
+    if new_hash:
+        model.objects.filter(pk=user.pk).update(password=new_hash)
+    return user
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
+@with_actor()
 def universal_login(request):
-    print("universal_login called")
+    logger.debug("universal_login called")
     try:
         data = json.loads(request.body)
         username = data.get('username')
@@ -46,9 +80,19 @@ def universal_login(request):
         if not username or not password:
             return JsonResponse({'success': False, 'error': 'Username and password are required.'}, status=400)
 
-        # DRIVER LOGIN (plain text match)
-        driver = DriverUser.objects.filter(username=username, password=password).first()
+        # Turn away brute-force attempts before any hashing or queries
+        throttle = get_throttle()
+        ip = client_ip(request)
+        retry_after = throttle.blocked(username, ip)
+        if retry_after:
+            response = JsonResponse({'success': False, 'error': 'Too many failed attempts. Try again later.'}, status=429)
+            response['Retry-After'] = str(retry_after)
+            return response
+
+        # DRIVER LOGIN
+        driver = _password_login(DriverUser, username, password, ('full_name', 'account_status'))
         if driver:
+            throttle.reset(username, ip)
             if getattr(driver, 'account_status', 'Unverified') != "Verified":
                 return JsonResponse({
                     'success': False,
@@ -59,101 +103,197 @@ def universal_login(request):
                 'user_type': 'driver',
                 'user_id': driver.driver_user_id,
                 'full_name': driver.full_name,
-                'account_status': driver.account_status
+                'account_status': driver.account_status,
+                'token': issue_token('driver', driver.driver_user_id),
             })
 
-        # LAW OFFICER LOGIN (plain text match)
-        officer = LawOfficer.objects.filter(username=username, password=password).first()
+        # LAW OFFICER LOGIN
+        officer = _password_login(LawOfficer, username, password, ('full_name',))
         if officer:
+            throttle.reset(username, ip)
             return JsonResponse({
                 'success': True,
                 'user_type': 'officer',
                 'user_id': officer.law_of_user_id,
-                'full_name': officer.full_name
+                'full_name': officer.full_name,
+                'token': issue_token('officer', officer.law_of_user_id),
             })
 
-        # LTO ADMIN LOGIN (plain text match)
-        admin = LtoAdminUser.objects.filter(username=username, password=password).first()
+        # LTO ADMIN LOGIN
+        admin = _password_login(LtoAdminUser, username, password, ('full_name',))
         if admin:
+            throttle.reset(username, ip)
             return JsonResponse({
                 'success': True,
                 'user_type': 'admin',
                 'user_id': admin.lto_user,
-                'full_name': admin.full_name
+                'full_name': admin.full_name,
+                'token': issue_token('admin', admin.lto_user),
             })
 
+        if driver is None and officer is None and admin is None:
+            # hash anyway: an unknown username must take as long as a wrong password
+            verify_password(password, '')
+        throttle.record_failure(username, ip)
         return JsonResponse({'success': False, 'error': 'Invalid credentials'}, status=401)
 
+    except HashingBusy:
+        response = JsonResponse({'success': False, 'error': 'Login is busy. Try again shortly.'}, status=503)
+        response['Retry-After'] = '1'
+        return response
     except json.JSONDecodeError:
         return JsonResponse({'success': False, 'error': 'Invalid JSON.'}, status=400)
     except Exception as e:
         return JsonResponse({'success': False, 'error': str(e)}, status=500)
     
+
+ACCOUNT_MODELS = {'driver': DriverUser, 'officer': LawOfficer, 'admin': LtoAdminUser}
+
+
+@csrf_exempt
+@require_POST
+@token_required()
+def logout(request):
+    """Ends every session of the caller: all tokens issued to them so far stop working."""
+    revoke_user(request.actor.role, request.actor.user_id)
+    return JsonResponse({'success': True})
+
+
+@csrf_exempt
+@require_POST
+@token_required()
+def change_password(request):
+    """Sets a new password and revokes the caller's tokens; returns a fresh token for this device."""
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'success': False, 'error': 'Invalid JSON.'}, status=400)
+    current, new = data.get('current_password'), data.get('new_password')
+    if not current or not new:
+        return JsonResponse(
+            {'success': False, 'error': 'current_password and new_password are required.'}, status=400)
+
+    actor = request.actor
+    model = ACCOUNT_MODELS[actor.role]
+    user = model.objects.filter(pk=actor.user_id).only('pk', 'username', 'password').first()
+    if user is None:
+        return JsonResponse({'success': False, 'error': 'Account not found.'}, status=404)
+
+    # as in universal_login: a stolen token must not allow guessing the password
+    throttle = get_throttle()
+    ip = client_ip(request)
+    retry_after = throttle.blocked(user.username, ip)
+    if retry_after:
+        response = JsonResponse({'success': False, 'error': 'Too many failed attempts. Try again later.'}, status=429)
+        response['Retry-After'] = str(retry_after)
+        return response
+    try:
+        matches, _ = verify_password(current, user.password)
+        if not matches:
+            throttle.record_failure(user.username, ip)
+            return JsonResponse({'success': False, 'error': 'Current password is incorrect.'}, status=403)
+        new_hash = hash_password(new)
+    except HashingBusy:
+        response = JsonResponse({'success': False, 'error': 'Busy. Try again shortly.'}, status=503)
+        response['Retry-After'] = '1'
+        return response
+    throttle.reset(user.username, ip)
+
+    with transaction.atomic():
+        model.objects.filter(pk=user.pk).update(password=new_hash)
+        revoke_user(actor.role, actor.user_id)
+    logger.info("password changed", extra={'role': actor.role, 'user_id': actor.user_id})
+    return JsonResponse({'success': True, 'token': issue_token(actor.role, actor.user_id)})
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
+@with_actor('driver')
 def get_driver_details(request):
-    print("Method:", request.method)
-    print("Headers:", request.headers)
-    print("Body:", request.body)
     try:
         data = json.loads(request.body)
     except json.JSONDecodeError:
         return JsonResponse({'success': False, 'error': 'Invalid JSON.'}, status=400)
 
     driver_user_id = data.get('driver_user_id')
-    print("Parsed data:", data)
-    print("driver_user_id:", driver_user_id)
+    logger.debug("get_driver_details", extra={'driver_user_id': driver_user_id})
     if not driver_user_id:
         return JsonResponse({'success': False, 'error': 'driver_user_id is required.'}, status=400)
+    if actor_mismatch(request, 'driver', driver_user_id):
+        return JsonResponse({'success': False, 'error': 'Not allowed.'}, status=403)
 
     try:
-        user = DriverUser.objects.get(driver_user_id=driver_user_id)
+        # cached, without the license image (core.profiles)
+        profile = profiles.get('driver', driver_user_id)
+        if profile is None:
+            return JsonResponse({'success': False, 'error': 'User not found'}, status=404)
+        # age changes with the date, so it is worked out per request
+        user = DriverUser(birthday=profile['birthday'])
         return JsonResponse({
             'success': True,
-            'full_name': user.full_name,
+            'full_name': profile['full_name'],
             'age': user.age,
-            'license_status': user.license_status,
-            'license_expiry': user.license_expiry.isoformat() if user.license_expiry else None,
-            'birthday': user.birthday.isoformat() if user.birthday else None,
-            'email': user.email,
-            'phone_number': user.phone_number,
-            'license_number': user.license_number,
+            'license_status': profile['license_status'],
+            'license_expiry': profile['license_expiry'].isoformat() if profile['license_expiry'] else None,
+            'birthday': profile['birthday'].isoformat() if profile['birthday'] else None,
+            'email': profile['email'],
+            'phone_number': profile['phone_number'],
+            'license_number': profile['license_number'],
         })
-    except DriverUser.DoesNotExist:
-        return JsonResponse({'success': False, 'error': 'User not found'}, status=404)
     except Exception as e:
         return JsonResponse({'success': False, 'error': str(e)}, status=500)
 
 @csrf_exempt
 @require_http_methods(["POST"])
+@with_actor('driver')
 def driver_penalties(request):
     try:
         data = json.loads(request.body)
         driver_user_id = data.get('driver_user_id')
         if not driver_user_id:
             return JsonResponse({'success': False, 'error': 'Missing driver_user_id'}, status=400)
+        if actor_mismatch(request, 'driver', driver_user_id):
+            return JsonResponse({'success': False, 'error': 'Not allowed.'}, status=403)
         
-        violations = Violation.objects.filter(driver_user_id=driver_user_id)
+        def penalties(alias):
+            # a driver can be ticketed at any station; one query per database for every line
+            return list(
+                ViolationDetail.objects.filter(violation__driver_user_id=driver_user_id)
+                .order_by('violation_id', 'pk')
+                .values_list('violation_id', 'violation_type_id', 'fee_at_time', 'violation__total_fee',
+                             'violation__status', 'violation__law_officer_id')
+            )
+
+        # each database hands out higher ids than the one before it, so this stays in id order
+        lines = [row for _alias, rows in shards.fan_out(penalties) for row in rows]
+        # officers and violation types live on the home database: one lookup each
+        officers = dict(
+            LawOfficer.objects.using(shards.HOME).filter(pk__in={line[5] for line in lines})
+            .values_list('pk', 'full_name')
+        )
+        type_names = dict(
+            ViolationType.objects.using(shards.HOME).filter(pk__in={line[1] for line in lines})
+            .values_list('pk', 'violation_name')
+        )
         penalty_list = []
-        for v in violations:
-            officer_name = v.law_officer.full_name if v.law_officer else "N/A"
-            details = ViolationDetail.objects.filter(violation_id=v.violation_id)
-            for detail in details:
-                penalty_list.append({
-                    'violation_id': v.violation_id,  # <-- Add this line!
-                    'violation_type': detail.violation_type.violation_name if detail.violation_type else "N/A",
-                    'officer': officer_name,
-                    'fee': float(detail.fee_at_time) if detail.fee_at_time else float(v.total_fee),
-                    'status': v.status,
-                })
+        for violation_id, type_id, fee_at_time, total_fee, status, officer_id in lines:
+            fee = fees.to_centavos(fee_at_time if fee_at_time else total_fee)
+            penalty_list.append({
+                'violation_id': violation_id,
+                'violation_type': type_names.get(type_id, "N/A"),
+                'officer': officers.get(officer_id, "N/A"),
+                'fee': str(fees.pesos(fee)),
+                'fee_centavos': fee,
+                'status': status,
+            })
         return JsonResponse({'success': True, 'penalties': penalty_list})
     except Exception as e:
-        import traceback
-        print(traceback.format_exc())
+        logger.exception("driver_penalties failed")
         return JsonResponse({'success': False, 'error': str(e)}, status=500)
     
 @csrf_exempt
 @require_http_methods(["POST"])
+@with_actor()
 def register_driver(request):
     try:
         data = json.loads(request.body)
@@ -168,22 +308,22 @@ def register_driver(request):
 
         required = [username, password, full_name, email, phone_number, license_number, birthday]
         if not all(required):
-            print("Missing fields:", required)
+            logger.info("register_driver missing fields", extra={'data': data})
             return JsonResponse({"success": False, "error": "All fields are required."})
 
         if DriverUser.objects.filter(username=username).exists():
-            print("Username exists:", username)
+            logger.info("register_driver username exists", extra={'username': username})
             return JsonResponse({"success": False, "error": "Username already exists."})
 
         try:
             birthday_obj = datetime.strptime(birthday, "%Y-%m-%d").date()
         except Exception as e:
-            print("Birthday error:", e)
+            logger.info("register_driver invalid birthday", extra={'error': str(e)})
             return JsonResponse({"success": False, "error": "Invalid birthday format. Use YYYY-MM-DD."})
 
         driver = DriverUser(
             username=username,
-            password=password,
+            password=hash_password(password),
             full_name=full_name,
             email=email,
             phone_number=phone_number,
@@ -201,60 +341,74 @@ def register_driver(request):
                     save=False
                 )
             except Exception as e:
-                print("Image error:", e)
+                logger.warning("register_driver image upload failed", extra={'error': str(e)})
                 return JsonResponse({"success": False, "error": f"Image upload failed: {e}"})
 
-        print(f"Saving driver: {username}")
         driver.save()
-        print(f"Driver saved: {driver.id}")
+        logger.info("driver registered", extra={'driver_user_id': driver.driver_user_id})
+        transaction.on_commit(lambda: events.publish(
+            'driver_registered',
+            id=driver.driver_user_id,
+            name=driver.full_name,
+            license=driver.license_number,
+            status=driver.account_status,
+            license_expiry=None,
+        ), robust=True)
         return JsonResponse({"success": True, "message": "Driver registered successfully."})
 
+    except HashingBusy:
+        # as in universal_login: the hashing pool is full, not the request wrong
+        response = JsonResponse({"success": False, "error": "Registration is busy. Try again shortly."}, status=503)
+        response['Retry-After'] = '1'
+        return response
     except Exception as e:
-        print("REGISTER EXCEPTION:", e)
+        logger.exception("register_driver failed")
         return JsonResponse({"success": False, "error": str(e)})
     
 @csrf_exempt
 @require_http_methods(["POST"])
+@token_required('officer')
 def get_officer_details(request):
     try:
         data = json.loads(request.body)
         officer_user_id = data.get('officer_user_id')
         if not officer_user_id:
             return JsonResponse({'success': False, 'error': 'officer_user_id is required.'}, status=400)
-        user = LawOfficer.objects.get(law_of_user_id=officer_user_id)
+        if actor_mismatch(request, 'officer', officer_user_id):
+            return JsonResponse({'success': False, 'error': 'Not allowed.'}, status=403)
+        user = profiles.get('officer', officer_user_id)
+        if user is None:
+            return JsonResponse({'success': False, 'error': 'Officer not found'}, status=404)
         return JsonResponse({
             'success': True,
-            'full_name': user.full_name,
-            'badge_id': user.badge_id,
-            'station': user.station,
-            'phone_number': user.phone_number,
+            'full_name': user['full_name'],
+            'badge_id': user['badge_id'],
+            'station': user['station'],
+            'phone_number': user['phone_number'],
         })
-    except LawOfficer.DoesNotExist:
-        return JsonResponse({'success': False, 'error': 'Officer not found'}, status=404)
     except Exception as e:
         return JsonResponse({'success': False, 'error': str(e)}, status=500)
     
+@token_required('officer')
 def get_next_violation_id(request):
-    max_id = Violation.objects.aggregate(Max('violation_id'))['violation_id__max'] or 0
-    next_id = max_id + 1
+    # the officer's tickets go to the database of their station
+    alias = shards.for_officer(request.actor.user_id)
+    with shards.use(alias):
+        max_id = Violation.objects.aggregate(Max('violation_id'))['violation_id__max']
+    next_id = (max_id or shards.id_range(alias)[0]) + 1
     return JsonResponse({'next_violation_id': next_id})
 
-@login_required
 @csrf_exempt
+@token_required('officer')
+@idempotent('register_violation')
 def register_violation(request):
     if request.method != "POST":
         return JsonResponse({"success": False, "error": "Invalid method"}, status=405)
 
     try:
         data = json.loads(request.body)
-        # Get officer username from session
-        officer_username = request.session.get('username')
-        if not officer_username:
-            return JsonResponse({"success": False, "error": "No logged-in officer found."}, status=400)
-        try:
-            law_officer = LawOfficer.objects.get(username=officer_username)
-        except LawOfficer.DoesNotExist:
-            return JsonResponse({"success": False, "error": "Law officer not found."}, status=400)
+        # The officer comes from the signed token; no session or officer lookup needed
+        law_officer_id = request.actor.user_id
 
         # Get driver by name/license, etc
         driver_name = data.get("driver_name")
@@ -270,49 +424,71 @@ def register_violation(request):
         if not (driver_name and license_number and address and violations):
             return JsonResponse({"success": False, "error": "Missing required fields."}, status=400)
 
+        try:
+            # where the officer's device was, if it could tell
+            position = hotspots.position(data.get("latitude"), data.get("longitude"))
+        except (TypeError, ValueError) as e:
+            return JsonResponse({"success": False, "error": f"Invalid position: {e}"}, status=400)
+
         try:
             driver = DriverUser.objects.get(full_name=driver_name, license_number=license_number)
         except DriverUser.DoesNotExist:
             return JsonResponse({"success": False, "error": "Driver not found."}, status=404)
 
-        total_fee = sum(float(v.get("fee_at_time", 0)) for v in violations)
-
-        violation = Violation.objects.create(
-            driver_user=driver,
-            law_officer=law_officer,
-            location=address,
-            status="unpaid",
-            total_fee=total_fee,
-        )
+        # Fees come from the schedule in force now; a fee_at_time sent by the client is ignored
+        issued_at = timezone.now()
+        type_ids = [v.get("violation_type") for v in violations]
+        try:
+            line_fees, total = fees.get_schedule().price(type_ids, issued_at)
+        except fees.UnknownViolationType as e:
+            return JsonResponse({"success": False, "error": f"Unknown violation type: {e}"}, status=400)
 
-        for v in violations:
-            violation_type_id = v.get("violation_type")
-            fee_at_time = v.get("fee_at_time")
-            vt = None
-            if violation_type_id:
-                try:
-                    vt = ViolationType.objects.get(pk=violation_type_id)
-                except ViolationType.DoesNotExist:
-                    pass
-
-            ViolationDetail.objects.create(
-                violation=violation,
-                violation_type=vt,
-                fee_at_time=fee_at_time,
-                notes=notes,
-                platenumber=platenumber,
-                vehicle_type=vehicle_type,
-                car_name=car_name,
-                vehicle_color=vehicle_color,
+        # All or nothing, so a failed attempt leaves no partial ticket behind to duplicate on retry.
+        # The ticket is kept with the other tickets of the officer's station (core.shards).
+        alias = shards.for_officer(law_officer_id)
+        with shards.use(alias), transaction.atomic(using=alias):
+            violation = Violation.objects.create(
+                driver_user=driver,
+                law_officer_id=law_officer_id,
+                # reports count the ticket for this station even if the officer moves
+                station=shards.station(law_officer_id) or None,
+                location=address,
+                status="unpaid",
+                total_fee=fees.pesos(total),
+                issued_at=issued_at,
+                latitude=position[0] if position else None,
+                longitude=position[1] if position else None,
             )
+            ViolationDetail.objects.bulk_create([
+                ViolationDetail(
+                    violation=violation,
+                    violation_type_id=int(type_id),
+                    fee_at_time=fees.pesos(fee),
+                    notes=notes,
+                    platenumber=platenumber,
+                    vehicle_type=vehicle_type,
+                    car_name=car_name,
+                    vehicle_color=vehicle_color,
+                )
+                for type_id, fee in zip(type_ids, line_fees)
+            ])
 
-        return JsonResponse({"success": True, "violation_id": violation.violation_id})
+        return JsonResponse({
+            "success": True,
+            "violation_id": violation.violation_id,
+            "total_fee": str(fees.pesos(total)),
+            "total_centavos": total,
+            "fees": [
+                {"violation_type": int(type_id), "fee_at_time": str(fees.pesos(fee)), "fee_centavos": fee}
+                for type_id, fee in zip(type_ids, line_fees)
+            ],
+        })
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("register_violation failed")
         return JsonResponse({"success": False, "error": str(e)}, status=500)
 
 @csrf_exempt
+@token_required('officer')
 def verify_driver(request):
     # Only accept POST requests
     if request.method != 'POST':
@@ -330,23 +506,42 @@ def verify_driver(request):
     except Exception as e:
         return JsonResponse({'success': False, 'error': str(e)}, status=500)
     
+@token_required('officer')
 def get_violation_types(request):
-    types = ViolationType.objects.all().values('violation_type', 'violation_name', 'violation_fee')
-    # For the frontend Picker, use "id" as the value (can also use violation_type)
-    data = [
-        {
+    types = ViolationType.objects.all().values('violation_type', 'violation_name')
+    schedule = fees.get_schedule()
+    now = timezone.now()
+    data = []
+    for vt in types:
+        # the fee in force now, which register_violation will charge
+        fee = schedule.fee(vt['violation_type'], now)
+        # For the frontend Picker, use "id" as the value (can also use violation_type)
+        data.append({
             "id": vt['violation_type'],
             "violation_name": vt['violation_name'],
-            "violation_fee": str(vt['violation_fee']),
-        }
-        for vt in types
-    ]
+            "violation_fee": str(fees.pesos(fee)),
+            "fee_centavos": fee,
+        })
     return JsonResponse({'violation_types': data})
 
 
+def _payment_with_ref(alias, transaction_ref):
+    return Payment.objects.using(alias).filter(transaction_ref=transaction_ref).values(
+        'payment_id', 'violation_id', 'driver_user_id').first()
+
+
+def _repeated_payment(existing, violation, driver):
+    """The answer to a payment whose ``transaction_ref`` is already recorded as ``existing``."""
+    if existing and existing['violation_id'] == violation.violation_id and existing['driver_user_id'] == driver.driver_user_id:
+        return JsonResponse({"success": True, "payment_id": existing['payment_id']})
+    return JsonResponse({"success": False, "error": "transaction_ref has already been used."})
+
+
 @csrf_exempt
+@with_actor('driver')
+@idempotent('submit_payment')
 def submit_payment(request):
-    print("submit_payment called")
+    logger.debug("submit_payment called")
     if request.method == "POST":
         data = json.loads(request.body)
         violation_id = data.get("violation_id")
@@ -354,34 +549,59 @@ def submit_payment(request):
         payment_type = data.get("payment_type")
         amount_paid = data.get("amount_paid")
         transaction_ref = data.get("transaction_ref")
+        if actor_mismatch(request, 'driver', driver_user_id):
+            return JsonResponse({"success": False, "error": "Not allowed."}, status=403)
 
         # Force status to "For Checking" on creation
         status = "For Checking"
 
+        # the payment is kept with its ticket, on the ticket's station database
+        alias = shards.for_id(violation_id) if violation_id else shards.HOME
         try:
-            violation = Violation.objects.get(pk=violation_id)
+            violation = Violation.objects.using(alias).get(pk=violation_id)
             driver = DriverUser.objects.get(pk=driver_user_id)
+            if shards.shard_aliases():
+                # each database only enforces its own unique index; look for the ref on all of them
+                # (only two submissions racing on different databases can both get through)
+                used = [row for _alias, row in shards.fan_out(lambda a: _payment_with_ref(a, transaction_ref)) if row]
+                if used:
+                    return _repeated_payment(used[0], violation, driver)
             # Create Payment record with "For Checking" status
-            payment = Payment.objects.create(
-                violation=violation,
-                driver_user=driver,
-                payment_type=payment_type,
-                amount_paid=amount_paid,
-                transaction_ref=transaction_ref,
-                status=status,
-            )
+            with transaction.atomic(using=alias):
+                payment = Payment.objects.using(alias).create(
+                    violation=violation,
+                    driver_user=driver,
+                    payment_type=payment_type,
+                    amount_paid=amount_paid,
+                    transaction_ref=transaction_ref,
+                    status=status,
+                )
+                # same shape as a row of payments/
+                transaction.on_commit(lambda: events.publish(
+                    'payment_submitted',
+                    id=payment.payment_id,
+                    driver=driver.full_name,
+                    amount=float(payment.amount_paid),
+                    transaction_ref=payment.transaction_ref,
+                    status=payment.status.lower(),
+                ), using=alias, robust=True)
             # Do NOT update Violation status yet
             return JsonResponse({"success": True, "payment_id": payment.payment_id})
         except Violation.DoesNotExist:
             return JsonResponse({"success": False, "error": "Violation not found."})
         except DriverUser.DoesNotExist:
             return JsonResponse({"success": False, "error": "Driver not found."})
+        except IntegrityError:
+            # transaction_ref is unique: a retry (from another worker, or without
+            # an Idempotency-Key) of a payment that already went through
+            return _repeated_payment(_payment_with_ref(alias, transaction_ref), violation, driver)
         except Exception as e:
-            return JsonResponse({"success": False, "error": str(e)})
+            return JsonResponse({"success": False, "error": str(e)}, status=500)
     return JsonResponse({"success": False, "error": "Invalid method"}, status=405)
 
 
 @csrf_exempt
+@with_actor('driver')
 def get_driver_payments(request):
     if request.method != "POST":
         return JsonResponse({"success": False, "error": "POST only."}, status=405)
@@ -390,9 +610,13 @@ def get_driver_payments(request):
         driver_user_id = data.get("driver_user_id")
         if not driver_user_id:
             return JsonResponse({"success": False, "error": "driver_user_id is required."}, status=400)
+        if actor_mismatch(request, 'driver', driver_user_id):
+            return JsonResponse({"success": False, "error": "Not allowed."}, status=403)
 
-        # Fetch all payment history for this driver
-        payments = Payment.objects.filter(driver_user_id=driver_user_id).order_by("-payment_date")
+        # Fetch all payment history for this driver, from every station's database
+        results = shards.fan_out(
+            lambda alias: list(Payment.objects.filter(driver_user_id=driver_user_id).order_by("-payment_date")))
+        payments = heapq.merge(*(rows for _alias, rows in results), key=lambda p: p.payment_date, reverse=True)
         payments_list = [
             {
                 "payment_id": p.payment_id,
@@ -412,6 +636,7 @@ def get_driver_payments(request):
     
 @csrf_exempt
 @require_http_methods(["POST"])
+@token_required('admin')
 def lto_admin_details(request):
     try:
         data = json.loads(request.body)
@@ -421,25 +646,30 @@ def lto_admin_details(request):
     user_id = data.get('user_id')
     if not user_id:
         return JsonResponse({'success': False, 'error': 'user_id is required.'}, status=400)
+    if actor_mismatch(request, 'admin', user_id):
+        return JsonResponse({'success': False, 'error': 'Not allowed.'}, status=403)
 
     try:
-        admin = LtoAdminUser.objects.get(lto_user=user_id)
+        admin = profiles.get('admin', user_id)
+        if admin is None:
+            return JsonResponse({'success': False, 'error': 'Admin not found'}, status=404)
         return JsonResponse({
             'success': True,
-            'full_name': admin.full_name,
-            'position': admin.position,
-            'phone_number': admin.phone_number,
+            'full_name': admin['full_name'],
+            'position': admin['position'],
+            'phone_number': admin['phone_number'],
         })
-    except LtoAdminUser.DoesNotExist:
-        return JsonResponse({'success': False, 'error': 'Admin not found'}, status=404)
     except Exception as e:
         return JsonResponse({'success': False, 'error': str(e)}, status=500)
 
 @csrf_exempt
 @require_http_methods(["POST"])
+@token_required('admin')
 def lto_admin_audit_logs(request):
     data = json.loads(request.body)
-    user_id = data.get('user_id')
+    user_id = data.get('user_id') or request.actor.user_id
+    if actor_mismatch(request, 'admin', user_id):
+        return JsonResponse({'success': False, 'error': 'Not allowed.'}, status=403)
     logs = AuditLog.objects.filter(lto_user=user_id).order_by('-timestamp')
     return JsonResponse({'logs': [
         {
@@ -452,6 +682,7 @@ def lto_admin_audit_logs(request):
     ]})
 
 @csrf_exempt
+@token_required('admin')
 def driver_users(request):
     if request.method == 'GET':
         drivers = DriverUser.objects.all()
@@ -464,52 +695,116 @@ def driver_users(request):
                 'status': d.account_status,
                 'license_expiry': str(d.license_expiry) if d.license_expiry else None,
             })
-        print("Driver Response:", driver_list)  # Debug print
+        logger.debug("driver_users", extra={'count': len(driver_list)})
         return JsonResponse({'drivers': driver_list})
 
+@token_required('admin')
 def payments(request):
-    payments = Payment.objects.all()
+    # every station's payments, in id order; drivers are looked up once in the home database
+    results = shards.fan_out(lambda alias: list(Payment.objects.all()))
+    payments = [p for _alias, rows in results for p in rows]
+    names = dict(DriverUser.objects.filter(pk__in={p.driver_user_id for p in payments}).values_list('pk', 'full_name'))
     data = []
     for p in payments:
         data.append({
             "id": p.payment_id,
-            "driver": p.driver_user.full_name if hasattr(p, 'driver_user') else "",
+            "driver": names.get(p.driver_user_id) or "",
             "amount": float(p.amount_paid),  # Fixed here
             "transaction_ref": p.transaction_ref,
             "status": p.status.lower(),  # Ensure lower case for frontend
         })
     return JsonResponse({"payments": data})
 
+
+@require_http_methods(["GET"])
+@token_required('admin')
+def change_feed(request):
+    """Drivers, payments, violations and audit logs changed since ``cursor``.
+
+    Without ``cursor`` only the current head is returned; see core/changefeed.py.
+    """
+    try:
+        cursor = int(request.GET['cursor']) if request.GET.get('cursor') else None
+        limit = int(request.GET['limit']) if request.GET.get('limit') else None
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'cursor and limit must be integers.'}, status=400)
+    if (cursor is not None and cursor < 0) or (limit is not None and limit < 1):
+        return JsonResponse({'success': False, 'error': 'cursor and limit must be positive.'}, status=400)
+
+    if cursor is None:
+        return JsonResponse({'success': True, 'cursor': changefeed.head(), 'has_more': False})
+    try:
+        page = changefeed.changes_since(cursor, limit)
+    except changefeed.CursorExpired:
+        return JsonResponse({'success': False, 'error': 'cursor has expired; reload and start from a new cursor.'}, status=410)
+    return JsonResponse({'success': True, **page})
+
+@require_http_methods(["GET"])
+async def event_stream(request):
+    """Server-sent events for the admin console (see core/events.py).
+
+    Always needs an admin token. Browsers' EventSource cannot send headers, so
+    the token may also be given as ``?token=``. Under backend.asgi this path is
+    answered by ``events.StreamApp`` before it reaches Django; this view only
+    streams under Django's own ASGI handler. Under WSGI and runserver it
+    answers 501: a WSGI server reads an async stream to the end before
+    sending it, which for this endless one means never.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'success': False, 'error': 'Event streams are only served over ASGI (backend.asgi).'}, status=501)
+    # verifying a token reads its version from the database
+    actor = await sync_to_async(lambda: get_actor(request) or verify_token(request.GET.get('token', '')))()
+    denied = events.refuse(actor)
+    if denied:
+        return JsonResponse({'success': False, 'error': denied[1]}, status=denied[0])
+
+    config = events.get_config()
+    broker = events.get_broker()
+    try:
+        subscription = broker.subscribe(config['QUEUE_SIZE'])
+    except events.TooManySubscribers:
+        response = JsonResponse({'success': False, 'error': 'Too many open event streams.'}, status=503)
+        response['Retry-After'] = '30'
+        return response
+    response = StreamingHttpResponse(
+        events.stream(broker, subscription, config['HEARTBEAT']), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # nginx would otherwise buffer the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 @csrf_exempt
 @require_POST
+@token_required('admin')
 def verify_driver_admin(request):
     try:
-        print("Request received")
         data = json.loads(request.body)
-        print("Request body:", data)
         driver_user_id = data.get('driver_user_id')
-        print("driver_user_id:", driver_user_id)
         if not driver_user_id:
             return JsonResponse({'success': False, 'error': 'driver_user_id is required'}, status=400)
 
         from .models import DriverUser
-        print("Import success")
         driver = DriverUser.objects.get(pk=driver_user_id)
-        print("Driver found:", driver)
         driver.account_status = 'Verified'
-        driver.save()
-        print("Driver verified and saved")
+        with transaction.atomic():
+            driver.save()
+            write_audit_log.enqueue(
+                action_type='verify_driver', description=f'Verified driver #{driver_user_id}',
+                lto_user_id=request.actor.user_id, driver_user_id=driver.driver_user_id,
+                timestamp=timezone.now().isoformat(),
+            )
+        logger.info("driver verified", extra={'driver_user_id': driver_user_id})
         return JsonResponse({'success': True, 'message': f'Driver {driver_user_id} verified.'})
     except DriverUser.DoesNotExist:
-        print("Driver not found")
         return JsonResponse({'success': False, 'error': 'Driver not found.'}, status=404)
     except Exception as e:
-        print("Exception occurred:", str(e))
+        logger.exception("verify_driver_admin failed")
         return JsonResponse({'success': False, 'error': str(e)}, status=500)
     
 
 @csrf_exempt
 @require_POST
+@token_required('admin')
 def update_license_expiry(request):
     try:
         data = json.loads(request.body)
@@ -526,7 +821,14 @@ def update_license_expiry(request):
         from .models import DriverUser
         driver = DriverUser.objects.get(pk=driver_user_id)
         driver.license_expiry = license_expiry
-        driver.save()
+        with transaction.atomic():
+            driver.save()
+            write_audit_log.enqueue(
+                action_type='update_license_expiry',
+                description=f'Updated license expiry for driver #{driver_user_id} to {license_expiry}',
+                lto_user_id=request.actor.user_id, driver_user_id=driver.driver_user_id,
+                timestamp=timezone.now().isoformat(),
+            )
         return JsonResponse({'success': True, 'message': f'Driver {driver_user_id} license expiry updated.'})
     except DriverUser.DoesNotExist:
         return JsonResponse({'success': False, 'error': 'Driver not found.'}, status=404)
@@ -536,23 +838,211 @@ def update_license_expiry(request):
 
 @csrf_exempt
 @require_POST
+@token_required('admin')
 def update_payment_status(request):
     try:
         data = json.loads(request.body)
         payment_id = data.get('payment_id')
         status = data.get('status', '').lower()  # ensure lowercase
-        user_id = data.get('user_id')
         if not payment_id or not status:
             return JsonResponse({'success': False, 'error': 'payment_id and status are required'}, status=400)
         if status != "completed":
             return JsonResponse({'success': False, 'error': 'Only status "completed" is allowed.'}, status=400)
 
         from .models import Payment  # adjust to your payment model location
-        payment = Payment.objects.get(pk=payment_id)
+        alias = shards.for_id(payment_id)
+        payment = Payment.objects.using(alias).get(pk=payment_id)
+        admin_id = request.actor.user_id
+        holder = review.holder(payment.payment_id)
+        if holder is not None and str(holder) != str(admin_id):
+            return JsonResponse({'success': False, 'error': 'Another admin is reviewing this payment.'}, status=409)
         payment.status = status
-        payment.save()
+        with shards.atomic(alias):
+            # the post_save receiver marks the violation paid in the same transaction;
+            # the lease and the audit job are in the home database
+            payment.save()
+            review.close(payment.payment_id)
+            write_audit_log.enqueue(
+                action_type='approve_payment', description=f'Updated payment #{payment_id} to {status}',
+                lto_user_id=admin_id, driver_user_id=payment.driver_user_id,
+                timestamp=timezone.now().isoformat(),
+            )
+        transaction.on_commit(lambda: events.publish('payment_approved', id=payment.payment_id, status=status), using=alias, robust=True)
         return JsonResponse({'success': True, 'message': f'Payment {payment_id} marked as completed.'})
     except Payment.DoesNotExist:
         return JsonResponse({'success': False, 'error': 'Payment not found.'}, status=404)
     except Exception as e:
-        return JsonResponse({'success': False, 'error': str(e)}, status=500)
\ No newline at end of file
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+
+@csrf_exempt
+@require_POST
+@token_required('admin')
+def claim_payments(request):
+    """Leases the next ``limit`` payments awaiting review to this admin; see core/review.py."""
+    try:
+        data = json.loads(request.body or b'{}')
+        limit = int(data['limit']) if data.get('limit') is not None else None
+    except (ValueError, TypeError):
+        return JsonResponse({'success': False, 'error': 'limit must be an integer.'}, status=400)
+    if limit is not None and limit < 1:
+        return JsonResponse({'success': False, 'error': 'limit must be positive.'}, status=400)
+    try:
+        claimed = review.claim(request.actor.user_id, limit)
+        return JsonResponse({'success': True, **claimed, 'queue': review.stats(request.actor.user_id)})
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+
+@csrf_exempt
+@require_POST
+@token_required('admin')
+def release_payments(request):
+    """Gives back this admin's leases; all of them unless ``payment_ids`` is sent."""
+    try:
+        data = json.loads(request.body or b'{}')
+        payment_ids = data.get('payment_ids')
+        if payment_ids is not None:
+            payment_ids = [int(pk) for pk in payment_ids]
+    except (ValueError, TypeError):
+        return JsonResponse({'success': False, 'error': 'payment_ids must be a list of integers.'}, status=400)
+    try:
+        released = review.release(request.actor.user_id, payment_ids)
+        return JsonResponse({'success': True, 'released': released})
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+
+@require_http_methods(["GET"])
+@token_required('admin')
+def review_queue(request):
+    """Depth of the review queue and the age of its oldest payment."""
+    try:
+        return JsonResponse({'success': True, **review.stats(request.actor.user_id)})
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+
+@require_http_methods(["GET"])
+@token_required('admin')
+def profile_cache_stats(request):
+    """Hit, miss and invalidation counters of this worker's profile cache."""
+    try:
+        return JsonResponse({'success': True, **profiles.stats()})
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+
+@require_http_methods(["GET"])
+@token_required('admin')
+def station_report(request):
+    """A station's monthly report as CSV or a printable page; see core/reports.py.
+
+    ``month`` is ``YYYY-MM`` (default: last month), ``format`` is ``csv`` or ``html``.
+    """
+    params = request.GET
+    station = params.get('station', '').strip()
+    fmt = params.get('format') or 'csv'
+    if not station:
+        return JsonResponse({'success': False, 'error': 'station is required.'}, status=400)
+    if fmt not in reports.FORMATS:
+        return JsonResponse({'success': False, 'error': f"format must be one of {', '.join(reports.FORMATS)}."}, status=400)
+    try:
+        month = reports.parse_month(params['month']) if params.get('month') else reports.last_month()
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'month must be YYYY-MM.'}, status=400)
+    if month > reports.today():
+        return JsonResponse({'success': False, 'error': 'month is in the future.'}, status=400)
+    if not LawOfficer.objects.filter(station=station).exists():
+        return JsonResponse({'success': False, 'error': 'Unknown station.'}, status=404)
+
+    try:
+        chunks, content_type = reports.open_report(station, month, fmt)
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+    filename = f"{slugify(station) or 'station'}-{month:%Y-%m}.{fmt}"
+    if reports.finished(month):
+        # finished months come from their file on disk
+        response = FileResponse(chunks, content_type=f'{content_type}; charset=utf-8')
+    else:
+        response = StreamingHttpResponse(chunks, content_type=f'{content_type}; charset=utf-8')
+        response['Cache-Control'] = 'no-cache'
+    disposition = 'attachment' if fmt == 'csv' else 'inline'
+    response['Content-Disposition'] = f'{disposition}; filename="{filename}"'
+    return response
+
+
+@require_http_methods(["GET"])
+@token_required('admin', 'officer')
+def violation_hotspots(request):
+    """Cells with the most violations in a box and day range; see core/hotspots.py.
+
+    With ``cell``, the violations issued in that cell instead.
+    """
+    config = hotspots.get_config()
+    params = request.GET
+    try:
+        since, until = hotspots.default_range()
+        if params.get('since'):
+            since = datetime.strptime(params['since'], '%Y-%m-%d').date()
+        if params.get('until'):
+            until = datetime.strptime(params['until'], '%Y-%m-%d').date()
+        box = None
+        if any(params.get(k) for k in ('south', 'west', 'north', 'east')):
+            box = tuple(float(params[k]) for k in ('south', 'west', 'north', 'east'))
+        zoom = int(params.get('zoom') or 1)
+        limit = int(params['limit']) if params.get('limit') else None
+        cell = int(params['cell']) if params.get('cell') else None
+    except (KeyError, ValueError):
+        return JsonResponse({'success': False, 'error': 'Invalid parameters; dates are YYYY-MM-DD and a box needs south, west, north and east.'}, status=400)
+    if until < since or (until - since).days >= config['MAX_DAYS']:
+        return JsonResponse({'success': False, 'error': f"since..until must be in order and at most {config['MAX_DAYS']} days."}, status=400)
+    # west > east is a box across the antimeridian
+    if box is not None and not (-90 <= box[0] <= box[2] <= 90 and -180 <= box[1] <= 180 and -180 <= box[3] <= 180):
+        return JsonResponse({'success': False, 'error': 'The box must have south <= north, within -90..90 and -180..180.'}, status=400)
+    if zoom < 1 or (limit is not None and limit < 1):
+        return JsonResponse({'success': False, 'error': 'zoom and limit must be positive.'}, status=400)
+    limit = min(limit or config['TOP'], config['MAX_CELLS'])
+
+    try:
+        if cell is not None:
+            rows = hotspots.violations_in_cell(cell, since, until, limit)
+            return JsonResponse({'success': True, 'since': str(since), 'until': str(until), 'violations': rows})
+        cells = hotspots.hotspots(since, until, box, zoom, limit)
+        return JsonResponse({'success': True, 'since': str(since), 'until': str(until), 'zoom': zoom, 'cells': cells})
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+
+@require_http_methods(["GET"])
+@token_required('admin')
+def full_text_search(request):
+    """Drivers and violations matching ``q``, best first; see core/search.py.
+
+    ``type`` narrows the results to ``drivers`` or ``violations``.
+    """
+    config = search.get_config()
+    params = request.GET
+    query = params.get('q', '').strip()
+    entity = params.get('type') or None
+    if not query:
+        return JsonResponse({'success': False, 'error': 'q is required.'}, status=400)
+    if entity is not None and entity not in search.BUILDERS:
+        return JsonResponse({'success': False, 'error': f"type must be one of {', '.join(search.BUILDERS)}."}, status=400)
+    try:
+        page = int(params.get('page') or 1)
+        limit = int(params.get('limit') or config['PAGE_SIZE'])
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'page and limit must be numbers.'}, status=400)
+    if page < 1 or limit < 1:
+        return JsonResponse({'success': False, 'error': 'page and limit must be positive.'}, status=400)
+    limit = min(limit, config['MAX_PAGE_SIZE'])
+    offset = (page - 1) * limit
+    if offset > config['MAX_OFFSET']:
+        return JsonResponse({'success': False, 'error': 'Too many pages; narrow the search instead.'}, status=400)
+
+    try:
+        results, has_more = search.search(query, entity, limit, offset)
+        return JsonResponse({'success': True, 'page': page, 'has_more': has_more, 'results': results})
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)